@@ -0,0 +1,603 @@
+"""
+Headless HTTP API for the financial data chatbot.
+
+A plain ASGI application (no web framework) that answers questions with
+the same pipeline as the Streamlit app: fast path, answer cache, code
+templates, generate_pandas_code, validate_and_execute_code and the
+formatters. One process holds one shared dataset (the DataStore snapshot
+with its dimension index and aggregate cube) and one model gateway for all
+requests; blocking work runs on a thread pool, so requests are served
+concurrently and the event loop stays free to accept new ones.
+
+Run with:
+    uvicorn api:app --host 0.0.0.0 --port 8000
+
+Endpoints:
+    GET  /health              Data version, rows and model gateway counters
+    POST /query               {"question", "session_id"?, "temperature"?} -> answer, code, result
+    POST /query/stream        Same body; Server-Sent Events: meta, chunk..., done
+    POST /batch               {"questions": [...], "temperature"?} -> one answer per question
+    GET  /results/<handle>    Rows of a stored result (?offset=0&limit=100)
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Same as the Streamlit app: generated code gets copy-on-write views of the
+# shared frame instead of copies
+pd.set_option("mode.copy_on_write", True)
+
+from utils.answer_cache import AnswerCache
+from utils.batch import answer_questions
+from utils.chat_history import ChatHistoryStore
+from utils.code_cache import CodeTemplateCache
+from utils.data_refresh import DataStore
+from utils.fast_path import FastPathPlanner
+from utils.model_gateway import get_model_gateway
+from utils.prompt_retrieval import PromptRetriever
+from utils.query_generator import generate_pandas_code, validate_and_execute_code
+from utils.response_formatter import format_results_as_natural_language, stream_results_as_natural_language
+from utils.result_store import ResultStore, formatter_input
+from utils.tracing import Trace, TraceSink
+
+MODEL_NAME = "gemini-2.5-flash"
+SCHEMA_PATH = "schema/P&L.md"
+DEFAULT_TEMPERATURE = 0.7
+MAX_BODY_BYTES = 1024 * 1024
+# Result rows returned inline with an answer; the rest via /results/<handle>
+RESULT_ROWS = 100
+
+
+def _unique_values(df):
+    return {
+        "companies": sorted(df["CompanyName"].dropna().unique().tolist()),
+        "countries": sorted(df["Country"].dropna().unique().tolist()),
+        "accounts": sorted(df["Account"].dropna().unique().tolist()),
+        "years": sorted(df["Year"].dropna().unique().tolist()),
+        "date_range": f"{df['Year'].min()} - {df['Year'].max()}",
+        "total_records": len(df)
+    }
+
+
+def _json_default(value):
+    if hasattr(value, 'item'):
+        return _plain(value.item())
+    return str(value)
+
+
+def _plain(value):
+    """Replace NaN/inf floats (not valid JSON) with None, recursively."""
+    if isinstance(value, float) and (value != value or value in (float('inf'), float('-inf'))):
+        return None
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    return value
+
+
+def result_payload(result, handle=None, offset=0, limit=RESULT_ROWS):
+    """
+    JSON-ready view of an execution result.
+
+    DataFrames and Series are returned as columns plus up to `limit` rows
+    starting at `offset`, with the total row count; other values as is.
+    """
+    if isinstance(result, dict) and 'result' in result:
+        result = result['result']
+    payload = {'handle': handle}
+    if isinstance(result, pd.Series):
+        result = result.to_frame(name=result.name if result.name is not None else 'value')
+    if isinstance(result, pd.DataFrame):
+        named_index = result.index.name is not None or result.index.nlevels > 1
+        frame = result.iloc[offset:offset + limit]
+        if named_index or not pd.api.types.is_integer_dtype(frame.index):
+            frame = frame.reset_index()
+        values = frame.astype(object).where(frame.notna(), None)
+        payload.update(
+            type='table',
+            columns=[str(c) for c in frame.columns],
+            rows=_plain(values.values.tolist()),
+            total_rows=len(result),
+            offset=offset,
+        )
+    else:
+        payload.update(type='value', value=_plain(result))
+    return payload
+
+
+class ApiState:
+    """
+    Everything the API shares between requests.
+
+    The data snapshot, model gateway, answer cache, result store and trace
+    sink are process-wide; the planner, code templates and prompt
+    retriever are rebuilt once per data version.
+
+    Parameters:
+    data_store (DataStore): Data source (default: the workbook, watched)
+    model_client: Gateway or client with generate_content(_stream)
+        (default: the process-wide ModelGateway)
+    answer_cache (AnswerCache): Shared answer cache; None disables it
+    workers (int): Threads for blocking work (code execution, model calls)
+    model_name (str): Gemini model
+    """
+
+    def __init__(self, data_store=None, model_client=None, answer_cache='default', workers=None,
+                 model_name=MODEL_NAME, schema_path=SCHEMA_PATH, trace_path=None):
+        self.store = data_store or DataStore()
+        self.models = model_client or get_model_gateway()
+        self.answer_cache = AnswerCache() if answer_cache == 'default' else answer_cache
+        self.result_store = ResultStore()
+        self.trace_sink = TraceSink(trace_path or os.getenv("TRACE_FILE", "data/.cache/traces.jsonl"))
+        self.model_name = model_name
+        self.schema_path = schema_path
+        self.pool = ThreadPoolExecutor(
+            max_workers=workers or int(os.getenv("API_WORKERS", "16")), thread_name_prefix="api"
+        )
+        self._lock = threading.Lock()
+        self._schema = (None, None)
+        self._versions = OrderedDict()
+        self._sessions = OrderedDict()
+
+    def schema(self):
+        """Schema text, re-read only when the file changes."""
+        mtime = os.path.getmtime(self.schema_path)
+        with self._lock:
+            if self._schema[0] != mtime:
+                with open(self.schema_path, "r") as f:
+                    self._schema = (mtime, f.read())
+            return self._schema[1]
+
+    def context(self):
+        """
+        Take one data snapshot and the objects derived from it.
+
+        Returns:
+        dict: snapshot, schema_docs, unique_values, code_cache, retriever
+        and planner of the current data version
+        """
+        snapshot = self.store.snapshot()
+        schema_docs = self.schema()
+        with self._lock:
+            derived = self._versions.get(snapshot.version)
+            if derived is None:
+                unique_values = _unique_values(snapshot.df)
+                derived = {
+                    'unique_values': unique_values,
+                    'code_cache': CodeTemplateCache(
+                        unique_values["companies"], unique_values["countries"], unique_values["accounts"]
+                    ),
+                    'retriever': PromptRetriever(schema_docs, unique_values["companies"], unique_values["accounts"]),
+                    'planner': FastPathPlanner(
+                        unique_values["companies"], unique_values["countries"], unique_values["years"]
+                    ),
+                }
+                self._versions[snapshot.version] = derived
+                while len(self._versions) > 2:
+                    self._versions.popitem(last=False)
+                if self.answer_cache is not None:
+                    self.answer_cache.invalidate(snapshot.version)
+        return dict(derived, snapshot=snapshot, schema_docs=schema_docs)
+
+    def session(self, session_id, max_sessions=256):
+        """Chat history of a session, kept in memory for the most recent sessions."""
+        with self._lock:
+            history = self._sessions.get(session_id)
+            if history is None:
+                history = self._sessions[session_id] = ChatHistoryStore(session_id)
+                while len(self._sessions) > max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            return history
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.store.stop()
+
+
+def prepare_answer(state, question, session_id=None, temperature=DEFAULT_TEMPERATURE):
+    """
+    Run a question up to the narrative: everything but the formatter call.
+
+    Follows the same order as the Streamlit chat (answer cache, fast path,
+    code template, code generation) and executes the code against one data
+    snapshot. Fast-path and cached answers come back with their narrative.
+
+    Returns:
+    dict: question, source, code, result (execution result), handle,
+    answer (or None if the formatter still has to run), digest (formatter
+    input), chat_history, history, cache_key and the request's trace
+    """
+    trace = Trace(question, sink=state.trace_sink)
+    trace.set(interface='api')
+    context = state.context()
+    snapshot, unique_values = context['snapshot'], context['unique_values']
+    history = state.session(session_id) if session_id else None
+    if history is not None:
+        history.append("user", question)
+    chat_history = history.context() if history is not None else None
+    helpers = {
+        "lookup": snapshot.index.lookup,
+        "cube": snapshot.cube,
+        "fx": snapshot.fx,
+        "last_result": state.result_store.get(history.state.get("last_result_handle")) if history else None,
+        "results": state.result_store,
+    }
+    prepared = {
+        'question': question, 'source': None, 'code': None, 'result': None, 'handle': None, 'answer': None,
+        'digest': None, 'chat_history': chat_history, 'history': history, 'cache_key': None, 'trace': trace,
+        'temperature': temperature, 'data_version': snapshot.version, 'unique_values': unique_values, 'turn': {},
+    }
+
+    def execute(code, compiled=None):
+        optimization = {}
+        with trace.stage('execution'):
+            result = validate_and_execute_code(code, snapshot.df, helpers, compiled=compiled, optimization=optimization)
+        if optimization:
+            trace.set(cost_before=optimization['cost_before'], cost_after=optimization['cost_after'])
+        return result
+
+    def keep(result, code):
+        if isinstance(result, dict):
+            prepared['handle'] = state.result_store.put(result.get('result'), question, code, snapshot.version)
+
+    if state.answer_cache is not None:
+        prepared['cache_key'] = AnswerCache.make_key(
+            question, chat_history, snapshot.version, state.model_name, temperature
+        )
+        with trace.stage('cache_lookup'):
+            cached = state.answer_cache.get(prepared['cache_key'])
+        if cached is not None:
+            prepared.update(source='cache', code=cached['code'], result=cached['result'], answer=cached['answer'])
+            keep(cached['result'], cached['code'])
+            return prepared
+
+    planner = context['planner']
+    with trace.stage('fast_path'):
+        plan = planner.plan(question)
+    if plan is not None:
+        result = execute(plan['code'])
+        if isinstance(result, dict) and isinstance(result.get('result'), pd.DataFrame):
+            prepared.update(source='fast_path', code=plan['code'], result=result,
+                            answer=planner.describe(plan, result['result']))
+            prepared['turn'].update(entities=plan['entities'], account=plan['account'], years=plan['years'])
+            keep(result, plan['code'])
+            return prepared
+
+    code_cache = context['code_cache']
+    with trace.stage('template_match'):
+        template = code_cache.match(question, chat_history)
+    result = None
+    if template is not None:
+        code, compiled = template
+        result = execute(code, compiled)
+        if not isinstance(result, dict):
+            template = None
+    if template is None:
+        prompt_stats = {}
+        with trace.stage('code_generation'):
+            code = generate_pandas_code(
+                state.models, state.model_name, context['schema_docs'], question,
+                unique_values["companies"], unique_values["date_range"], unique_values["accounts"],
+                temperature, chat_history=chat_history, retriever=context['retriever'], prompt_stats=prompt_stats
+            )
+        trace.set(
+            code_input_tokens=prompt_stats.get('input_tokens', prompt_stats.get('prompt_tokens')),
+            code_output_tokens=prompt_stats.get('output_tokens'),
+        )
+        result = execute(code)
+        if isinstance(result, dict):
+            code_cache.store(question, chat_history, code)
+    prepared.update(source='template' if template is not None else 'model', code=code, result=result)
+    keep(result, code)
+    prepared['digest'] = formatter_input(result, prepared['handle'])
+    return prepared
+
+
+def format_answer(state, prepared):
+    """Write the narrative of a prepared answer with one formatter call."""
+    with prepared['trace'].stage('formatter'):
+        return format_results_as_natural_language(
+            state.models, state.model_name, prepared['digest'], prepared['question'],
+            prepared['temperature'], chat_history=prepared['chat_history']
+        )
+
+
+def finish_answer(state, prepared, answer):
+    """Store the answer in the cache and the session history and write the trace."""
+    trace = prepared['trace']
+    succeeded = (
+        prepared['source'] in ('template', 'model')
+        and isinstance(prepared['result'], dict)
+        and not prepared['code'].startswith("# Error")
+        and not answer.startswith("Error generating")
+    )
+    if prepared['cache_key'] is not None and succeeded:
+        with trace.stage('cache_store'):
+            state.answer_cache.put(prepared['cache_key'], prepared['question'], prepared['data_version'],
+                                   prepared['code'], prepared['result'], answer)
+    history = prepared['history']
+    if history is not None:
+        history.append("assistant", answer)
+        turn = dict(prepared['turn'], source=prepared['source'], code=prepared['code'],
+                    result=prepared['result'], handle=prepared['handle'])
+        unique_values = prepared['unique_values']
+        history.remember(prepared['question'], unique_values['companies'], unique_values['accounts'], turn)
+    return trace.finish(source=prepared['source'], status='error' if answer.startswith("Error generating") else 'ok')
+
+
+def answer_payload(prepared, answer, record=None):
+    payload = {
+        'question': prepared['question'],
+        'answer': answer,
+        'source': prepared['source'],
+        'code': prepared['code'],
+        'data_version': prepared['data_version'],
+        'result': result_payload(prepared['result'], prepared['handle']),
+    }
+    if isinstance(prepared['result'], str):
+        payload['error'] = prepared['result']
+    if record is not None:
+        payload['trace'] = {'id': record['id'], 'total_ms': record['total_ms'], 'stages': record['stages']}
+    return payload
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+async def _read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get('body', b"")
+        if len(body) > MAX_BODY_BYTES:
+            raise HttpError(413, "Request body too large")
+        if not message.get('more_body'):
+            break
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        raise HttpError(400, "Request body must be JSON")
+    if not isinstance(data, dict):
+        raise HttpError(400, "Request body must be a JSON object")
+    return data
+
+
+def _question_args(data):
+    question = data.get('question')
+    if not isinstance(question, str) or not question.strip():
+        raise HttpError(400, "'question' must be a non-empty string")
+    temperature = data.get('temperature', DEFAULT_TEMPERATURE)
+    if not isinstance(temperature, (int, float)) or not 0 <= temperature <= 2:
+        raise HttpError(400, "'temperature' must be a number between 0 and 2")
+    session_id = data.get('session_id')
+    if session_id is not None and not isinstance(session_id, str):
+        raise HttpError(400, "'session_id' must be a string")
+    return question.strip(), session_id, float(temperature)
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload, default=_json_default).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _event(name, payload):
+    return f"event: {name}\ndata: {json.dumps(payload, default=_json_default)}\n\n".encode()
+
+
+class ApiApp:
+    """
+    ASGI application. The shared state is built at startup (lifespan) or,
+    under servers without lifespan support, on the first request.
+
+    Parameters:
+    state_factory: Callable returning the ApiState (default: ApiState)
+    """
+
+    def __init__(self, state_factory=ApiState):
+        self.state_factory = state_factory
+        self.state = None
+        self._starting = None
+
+    async def _ensure_state(self):
+        if self.state is None:
+            if self._starting is None:
+                self._starting = asyncio.get_running_loop().run_in_executor(None, self.state_factory)
+            self.state = await self._starting
+        return self.state
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.state.pool, func, *args)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        try:
+            await self._ensure_state()
+            await self._route(scope, receive, send)
+        except HttpError as e:
+            await _send_json(send, e.status, {'error': str(e)})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self._ensure_state()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': f"{type(e).__name__}: {e}"})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.state is not None:
+                    self.state.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _route(self, scope, receive, send):
+        method, path = scope['method'], scope['path'].rstrip('/') or '/'
+        routes = {
+            '/health': ('GET', self._health),
+            '/query': ('POST', self._query),
+            '/query/stream': ('POST', self._query_stream),
+            '/batch': ('POST', self._batch),
+        }
+        if path.startswith('/results/'):
+            routes[path] = ('GET', self._results)
+        if path not in routes:
+            raise HttpError(404, f"Not found: {path}")
+        allowed, handler = routes[path]
+        if method != allowed:
+            raise HttpError(405, f"Use {allowed} for {path}")
+        await handler(scope, receive, send)
+
+    async def _health(self, scope, receive, send):
+        snapshot = self.state.store.snapshot()
+        stats = self.state.models.stats() if hasattr(self.state.models, 'stats') else None
+        await _send_json(send, 200, {
+            'status': 'ok',
+            'data_version': snapshot.version,
+            'rows': len(snapshot.df),
+            'loaded_at': snapshot.loaded_at,
+            'results_stored': len(self.state.result_store),
+            'model_gateway': stats,
+        })
+
+    async def _query(self, scope, receive, send):
+        question, session_id, temperature = _question_args(await _read_json(receive))
+        state = self.state
+
+        def run():
+            prepared = prepare_answer(state, question, session_id, temperature)
+            answer = prepared['answer'] if prepared['answer'] is not None else format_answer(state, prepared)
+            record = finish_answer(state, prepared, answer)
+            return answer_payload(prepared, answer, record)
+
+        await _send_json(send, 200, await self._run(run))
+
+    async def _query_stream(self, scope, receive, send):
+        question, session_id, temperature = _question_args(await _read_json(receive))
+        state = self.state
+        prepared = await self._run(prepare_answer, state, question, session_id, temperature)
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')],
+        })
+        meta = answer_payload(prepared, None)
+        meta.pop('answer')
+        await send({'type': 'http.response.body', 'body': _event('meta', meta), 'more_body': True})
+
+        if prepared['answer'] is not None:
+            answer = prepared['answer']
+            await send({'type': 'http.response.body', 'body': _event('chunk', {'text': answer}), 'more_body': True})
+        else:
+            # The formatter stream is consumed on a worker thread and handed
+            # to the event loop chunk by chunk
+            loop = asyncio.get_running_loop()
+            chunks = asyncio.Queue()
+            trace = prepared['trace']
+
+            def pump():
+                started = time.perf_counter()
+                first = True
+                try:
+                    for chunk in stream_results_as_natural_language(
+                        state.models, state.model_name, prepared['digest'], question, temperature,
+                        chat_history=prepared['chat_history']
+                    ):
+                        if first:
+                            trace.record('formatter_first_chunk', (time.perf_counter() - started) * 1000)
+                            first = False
+                        loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+                finally:
+                    trace.record('formatter', (time.perf_counter() - started) * 1000)
+                    loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+            state.pool.submit(pump)
+            parts = []
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                parts.append(chunk)
+                await send({'type': 'http.response.body', 'body': _event('chunk', {'text': chunk}), 'more_body': True})
+            answer = "".join(parts).strip()
+
+        record = await self._run(finish_answer, state, prepared, answer)
+        done = {'answer': answer, 'trace': {'id': record['id'], 'total_ms': record['total_ms'], 'stages': record['stages']}}
+        await send({'type': 'http.response.body', 'body': _event('done', done), 'more_body': False})
+
+    async def _batch(self, scope, receive, send):
+        data = await _read_json(receive)
+        questions = data.get('questions')
+        if not isinstance(questions, list) or not all(isinstance(q, str) for q in questions) or not questions:
+            raise HttpError(400, "'questions' must be a non-empty list of strings")
+        temperature = data.get('temperature', DEFAULT_TEMPERATURE)
+        state = self.state
+
+        def run():
+            context = state.context()
+            snapshot = context['snapshot']
+            items = answer_questions(
+                questions, snapshot.df, context['schema_docs'], context['unique_values'],
+                state.models, state.models, state.model_name, temperature,
+                helpers={"lookup": snapshot.index.lookup, "cube": snapshot.cube, "fx": snapshot.fx},
+                answer_cache=state.answer_cache, data_version=snapshot.version,
+                code_cache=context['code_cache'], retriever=context['retriever'], planner=context['planner']
+            )
+            answers = []
+            for item in items:
+                handle = None
+                if isinstance(item['result'], dict):
+                    handle = state.result_store.put(item['result'].get('result'), item['question'], item['code'],
+                                                    snapshot.version)
+                answers.append({
+                    'question': item['question'], 'answer': item['answer'], 'source': item['source'],
+                    'code': item['code'], 'result': result_payload(item['result'], handle),
+                })
+            return {'data_version': snapshot.version, 'answers': answers}
+
+        await _send_json(send, 200, await self._run(run))
+
+    async def _results(self, scope, receive, send):
+        handle = scope['path'].rstrip('/').rsplit('/', 1)[-1]
+        query = parse_qs(scope.get('query_string', b'').decode())
+        try:
+            offset = max(0, int(query.get('offset', ['0'])[0]))
+            limit = min(10000, max(1, int(query.get('limit', [str(RESULT_ROWS)])[0])))
+        except ValueError:
+            raise HttpError(400, "'offset' and 'limit' must be integers")
+        entry = self.state.result_store.entry(handle)
+        if entry is None:
+            raise HttpError(404, f"Unknown or expired result handle: {handle}")
+        payload = result_payload(entry['result'], handle, offset, limit)
+        payload.update(question=entry['question'], code=entry['code'], data_version=entry['data_version'])
+        await _send_json(send, 200, payload)
+
+
+app = ApiApp()
@@ -1,56 +1,141 @@
 import streamlit as st
 import pandas as pd
 import os
+import time
 
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# The financial frame is shared read-only between sessions; copy-on-write
+# lets generated code modify its own view without touching the shared data.
+pd.set_option("mode.copy_on_write", True)
+
 
 # Import our utility functions
-from utils.data_loader import load_financial_data
-from utils.query_generator import configure_gemini as configure_gemini_qg
-from utils.response_formatter import configure_gemini as configure_gemini_rf
+from utils.data_refresh import DataStore
+from utils.answer_cache import AnswerCache
+from utils.code_cache import CodeTemplateCache
+from utils.sandbox import SandboxExecutor
+from utils.prompt_retrieval import PromptRetriever
+from utils.fast_path import FastPathPlanner
+from utils.chat_history import ChatHistoryStore
+from utils.result_store import ResultStore
+from utils.tracing import TraceSink
+from utils.model_gateway import get_model_gateway
 
 # Modularized UI and chat logic
-from utils.ui import render_sidebar, render_chat
+from utils.ui import chat_export_text, render_sidebar, render_chat, render_cache_stats, render_batch_input, render_batch_results, render_latency_stats
 from utils.chat_logic import process_user_prompt
+from utils.batch import answer_questions
 
 # Configure Gemini models
 try:
     model_name = "gemini-2.5-flash"
     if not os.getenv('GOOGLE_API_KEY'):
         raise ValueError("GOOGLE_API_KEY environment variable not set")
-    query_model_client = configure_gemini_qg()
-    response_model_client = configure_gemini_rf()
+    # One process-wide gateway (pooled connections, concurrency and rate
+    # limits, retries) serves code generation and answer formatting alike
+    query_model_client = response_model_client = get_model_gateway()
 except Exception as e:
     st.error(f"Error configuring Gemini: {str(e)}")
     st.stop()
 
-# Load data with caching
-@st.cache_data
-def get_financial_data():
-    return load_financial_data()
+# Data, dimension index and aggregate cube of the current workbook version,
+# shared by all sessions. The store watches the workbook and swaps in a new
+# snapshot (re-parsing only changed sheets) without restarting sessions; the
+# frame is a read-only, zero-copy view of the memory-mapped cache file.
+@st.cache_resource
+def get_data_store():
+    return DataStore()
+
+# Persistent answer cache shared by all sessions on this host
+@st.cache_resource
+def get_answer_cache():
+    return AnswerCache()
+
+# Drop cached answers once per new data version
+@st.cache_resource(max_entries=2)
+def invalidate_answer_cache(data_version):
+    get_answer_cache().invalidate(data_version)
+    return True
+
+# Generated-code templates, reusable for questions that only change literals
+@st.cache_resource(max_entries=2)
+def get_code_cache(data_version, _unique_values):
+    return CodeTemplateCache(
+        _unique_values["companies"], _unique_values["countries"], _unique_values["accounts"]
+    )
+
+# Keyword retriever that trims the schema and value lists sent per question
+@st.cache_resource(max_entries=2)
+def get_prompt_retriever(data_version, _schema_docs, _unique_values):
+    return PromptRetriever(_schema_docs, _unique_values["companies"], _unique_values["accounts"])
+
+# Rule-based planner that answers common questions without the model
+@st.cache_resource(max_entries=2)
+def get_fast_path_planner(data_version, _unique_values):
+    return FastPathPlanner(_unique_values["companies"], _unique_values["countries"], _unique_values["years"])
+
+# Execution results kept server-side under handles, shared by all sessions
+@st.cache_resource
+def get_result_store():
+    return ResultStore()
 
-# Load schema
-def get_schema():
-    with open("schema/P&L.md", "r") as f:
+# Per-request stage timings, appended to a JSONL file shared by all sessions
+@st.cache_resource
+def get_trace_sink():
+    return TraceSink(os.getenv("TRACE_FILE", "data/.cache/traces.jsonl"))
+
+# Optional pool of sandboxed worker processes for generated code
+# (SANDBOX_WORKERS > 0 enables it; replaced when the data version changes)
+@st.cache_resource
+def get_sandbox_state():
+    return {}
+
+def get_sandbox_executor(data_version):
+    workers = int(os.getenv("SANDBOX_WORKERS", "0"))
+    if workers <= 0:
+        return None
+    state = get_sandbox_state()
+    if state.get("version") != data_version:
+        if state.get("executor") is not None:
+            state["executor"].close()
+        state["executor"] = SandboxExecutor(
+            workers=workers,
+            timeout=float(os.getenv("SANDBOX_TIMEOUT_SECONDS", "30")),
+            memory_limit_mb=int(os.getenv("SANDBOX_MEMORY_LIMIT_MB", "2048"))
+        )
+        state["version"] = data_version
+    return state["executor"]
+
+# Load schema, re-read only when the file changes
+SCHEMA_PATH = "schema/P&L.md"
+
+@st.cache_resource(max_entries=2)
+def get_schema(schema_mtime):
+    with open(SCHEMA_PATH, "r") as f:
         return f.read()
 
-# Get unique values for filters
-def get_unique_values(df):
+# Get unique values for filters, computed once per data version
+@st.cache_resource(max_entries=2)
+def get_unique_values(data_version, _df):
     return {
-        "companies": sorted(df["CompanyName"].dropna().unique().tolist()),
-        "countries": sorted(df["Country"].dropna().unique().tolist()),
-        "accounts": sorted(df["Account"].dropna().unique().tolist()),
-        "date_range": f"{df['Year'].min()} - {df['Year'].max()}"
+        "companies": sorted(_df["CompanyName"].dropna().unique().tolist()),
+        "countries": sorted(_df["Country"].dropna().unique().tolist()),
+        "accounts": sorted(_df["Account"].dropna().unique().tolist()),
+        "years": sorted(_df["Year"].dropna().unique().tolist()),
+        "date_range": f"{_df['Year'].min()} - {_df['Year'].max()}",
+        "total_records": len(_df)
     }
 
 # Initialize session state
-# Initialize or load chat history (in-memory only)
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# Chat history: logged to SQLite per session, bounded in memory, with a
+# rolling summary and prior-query state for the prompts
+if "history" not in st.session_state:
+    st.session_state.history = ChatHistoryStore()
+history = st.session_state.history
 
 # Streamlit app
 st.set_page_config(page_title="Financial Data Chatbot", page_icon="📊", layout="wide")
@@ -68,16 +153,21 @@ st.sidebar.subheader("💾 Chat Management")
 col1, col2 = st.sidebar.columns(2)
 with col1:
     if st.button("Clear Chat History"):
-        st.session_state.messages = []
+        history.clear()
+        st.session_state.chat_export_requested = False
         st.rerun()
 with col2:
-    chat_history = "\n".join([f"{msg['role']}: {msg['content']}" for msg in st.session_state.messages])
-    st.download_button(
-        label="Export Chat History",
-        data=chat_history,
-        file_name="financial_chat_history.txt",
-        mime="text/plain"
-    )
+    # The export is read from the log only once it has been asked for
+    if st.session_state.get("chat_export_requested"):
+        st.download_button(
+            label="Download Chat History",
+            data=chat_export_text(history),
+            file_name="financial_chat_history.txt",
+            mime="text/plain"
+        )
+    elif st.button("Export Chat History"):
+        st.session_state.chat_export_requested = True
+        st.rerun()
 
 # Settings
 st.sidebar.subheader("⚙️ Settings")
@@ -86,9 +176,23 @@ temperature = st.sidebar.slider("Response Creativity", 0.0, 1.0, 0.7)
 # Load data and schema
 try:
     with st.spinner("Loading financial data..."):
-        df = get_financial_data()
-        schema_docs = get_schema()
-        unique_values = get_unique_values(df)
+        # One snapshot per run, so a refresh mid-request cannot mix versions
+        snapshot = get_data_store().snapshot()
+        data_version = snapshot.version
+        df = snapshot.df
+        dimension_index = snapshot.index
+        aggregate_cube = snapshot.cube
+        fx_view = snapshot.fx
+        answer_cache = get_answer_cache()
+        invalidate_answer_cache(data_version)
+        schema_docs = get_schema(os.path.getmtime(SCHEMA_PATH))
+        unique_values = get_unique_values(data_version, df)
+        code_cache = get_code_cache(data_version, unique_values)
+        executor = get_sandbox_executor(data_version)
+        retriever = get_prompt_retriever(data_version, schema_docs, unique_values)
+        planner = get_fast_path_planner(data_version, unique_values)
+        trace_sink = get_trace_sink()
+        result_store = get_result_store()
 except Exception as e:
     st.error(f"Error loading data: {str(e)}")
     st.stop()
@@ -103,12 +207,42 @@ example_queries = [
     "Show me the operating margin for all companies in USD"
 ]
 with st.sidebar:
-    unique_values["total_records"] = len(df)
     render_sidebar(unique_values, schema_docs, example_queries)
+    render_cache_stats(answer_cache.stats(), code_cache.stats())
+    if snapshot.changed_partitions:
+        changed = ", ".join(f"{sheet} {year}" for sheet, year in snapshot.changed_partitions)
+        st.caption(f"🔄 Data refreshed at {time.strftime('%H:%M:%S', time.localtime(snapshot.loaded_at))} ({changed})")
+    if st.checkbox("Show latency stats"):
+        render_latency_stats(trace_sink.stage_percentiles())
+    batch_questions = render_batch_input()
+
+
+# Batch mode: answer a whole question pack with batched model calls
+if batch_questions:
+    with st.spinner(f"Answering {len(batch_questions)} questions..."):
+        st.session_state.batch_results = answer_questions(
+            batch_questions,
+            df,
+            schema_docs,
+            unique_values,
+            query_model_client,
+            response_model_client,
+            model_name,
+            temperature,
+            helpers={"lookup": dimension_index.lookup, "cube": aggregate_cube, "fx": fx_view},
+            answer_cache=answer_cache,
+            data_version=data_version,
+            code_cache=code_cache,
+            executor=executor,
+            retriever=retriever,
+            planner=planner
+        )
+if st.session_state.get("batch_results"):
+    render_batch_results(st.session_state.batch_results)
 
 
 # Main chat interface
-render_chat(st.session_state.messages)
+render_chat(history.recent())
 
 
 # Unified chat input and example prompt processing
@@ -118,7 +252,8 @@ if not prompt and "example_prompt" in st.session_state:
     del st.session_state.example_prompt
 
 if prompt:
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    history.append("user", prompt)
+    turn = {}
     with st.chat_message("user"):
         st.markdown(prompt)
     with st.chat_message("assistant"):
@@ -133,10 +268,27 @@ if prompt:
                     response_model_client,
                     model_name,
                     temperature,
-                    st.session_state.messages
+                    history.context(),
+                    helpers={
+                        "lookup": dimension_index.lookup,
+                        "cube": aggregate_cube,
+                        "fx": fx_view,
+                        "last_result": result_store.get(history.state.get("last_result_handle")),
+                        "results": result_store
+                    },
+                    answer_cache=answer_cache,
+                    data_version=data_version,
+                    code_cache=code_cache,
+                    executor=executor,
+                    retriever=retriever,
+                    planner=planner,
+                    tracer=trace_sink,
+                    turn=turn,
+                    result_store=result_store
                 )
-                st.session_state.messages.append({"role": "assistant", "content": natural_language_response})
+                history.append("assistant", natural_language_response)
+                history.remember(prompt, unique_values["companies"], unique_values["accounts"], turn)
             except Exception as e:
                 error_message = f"Sorry, I encountered an error while processing your request: {str(e)}"
                 st.error(error_message)
-                st.session_state.messages.append({"role": "assistant", "content": error_message})
\ No newline at end of file
+                history.append("assistant", error_message)
\ No newline at end of file
@@ -0,0 +1,288 @@
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import MONTHS
+
+# Company groups from schema/P&L.md: group name -> countries it sums over
+COMPANY_GROUPS = {
+    'Total Retail': ['Chile', 'Argentina', 'Peru', 'Colombia'],
+    'Total Sodimac': ['Chile', 'Argentina', 'Peru', 'Colombia', 'Brasil', 'Uruguay', 'Mexico'],
+    'Total Tottus': ['Chile', 'Peru'],
+}
+
+QUARTERS = {
+    'Q1': MONTHS[0:3],
+    'Q2': MONTHS[3:6],
+    'Q3': MONTHS[6:9],
+    'Q4': MONTHS[9:12],
+}
+
+# Dimensions of a cube cell (Scenario is pivoted into columns)
+CUBE_KEYS = ['Entity', 'Country', 'Account', 'Currency', 'Year', 'Grain', 'Period']
+
+CUBE_COLUMNS = [
+    'Real', 'Presupuesto', 'Real_LY',
+    'Var_LY', 'Var_LY_pct', 'Var_Budget', 'Var_Budget_pct',
+]
+
+_ROW_KEYS = ['Entity', 'Country', 'Account', 'Currency', 'Year']
+
+# Group members report local amounts in different currencies (CLP, ARS,
+# PEN, ...), so group totals only exist in this one
+GROUP_CURRENCY = 'Dolares'
+
+
+def resolve_group_members(group, company_names):
+    """
+    Return the CompanyName values that make up a company group.
+
+    The workbook is not fully consistent with the schema naming (e.g.
+    "Retail Colombia" instead of "Total Retail Colombia"), so each country is
+    matched against "<group> <country>" first and "<base> <country>" second.
+
+    Parameters:
+    group (str): Group name, e.g. "Total Retail"
+    company_names (iterable): CompanyName values present in the data
+
+    Returns:
+    list: Member company names found in the data
+    """
+    available = set(company_names)
+    base = group.replace('Total ', '', 1)
+    members = []
+    for country in COMPANY_GROUPS[group]:
+        for candidate in (f"{group} {country}", f"{base} {country}"):
+            if candidate in available:
+                members.append(candidate)
+                break
+    return members
+
+
+def partition_fingerprints(df):
+    """
+    Hash every (Sheet, Year) partition of the melted frame.
+
+    Parameters:
+    df (pd.DataFrame): Melted financial data
+
+    Returns:
+    dict: (sheet, year) -> integer fingerprint
+    """
+    hashes = pd.util.hash_pandas_object(df, index=False)
+    keys = [df['Sheet'].astype(str), df['Year'].astype(int)]
+    sums = hashes.groupby(keys, sort=False).sum()
+    return {(sheet, int(year)): int(value) for (sheet, year), value in sums.items()}
+
+
+def _monthly_wide(df):
+    """
+    Sum monthly values into one row per (Entity, Country, Account, Currency,
+    Year) with (Scenario, Month) columns, for companies and, in
+    GROUP_CURRENCY only, company groups.
+    """
+    keys = ['CompanyName', 'Country', 'Account', 'Currency', 'Year']
+    wide = df.groupby(keys + ['Scenario', 'Month'], observed=True)['Value'].sum()
+    wide = wide.unstack(['Scenario', 'Month'])
+    wide.index = wide.index.set_names(_ROW_KEYS)
+    wide.index = pd.MultiIndex.from_arrays([
+        wide.index.get_level_values(level).astype(int if level == 'Year' else str)
+        for level in _ROW_KEYS
+    ], names=_ROW_KEYS)
+    columns = pd.MultiIndex.from_product([['Real', 'Presupuesto'], MONTHS])
+    wide = wide.reindex(columns=columns)
+
+    frames = [wide]
+    company_names = wide.index.get_level_values('Entity').unique()
+    in_group_currency = wide.index.get_level_values('Currency') == GROUP_CURRENCY
+    for group in COMPANY_GROUPS:
+        members = resolve_group_members(group, company_names)
+        if not members:
+            continue
+        rows = wide[wide.index.get_level_values('Entity').isin(members) & in_group_currency]
+        summed = rows.groupby(level=['Account', 'Currency', 'Year']).sum(min_count=1)
+        summed = pd.concat({(group, 'All'): summed}, names=['Entity', 'Country'])
+        frames.append(summed)
+    return pd.concat(frames)
+
+
+def _periods(months):
+    """Turn an (n, 12) block of monthly values into the 29 cube periods."""
+    month_values = months.to_numpy()
+    has_value = ~np.isnan(month_values)
+    ytd = np.nancumsum(month_values, axis=1)
+    ytd[~np.maximum.accumulate(has_value, axis=1)] = np.nan
+    blocks = {('Month', month): month_values[:, i] for i, month in enumerate(MONTHS)}
+    for quarter, quarter_months in QUARTERS.items():
+        blocks[('Quarter', quarter)] = months[quarter_months].sum(axis=1, min_count=1).to_numpy()
+    for i, month in enumerate(MONTHS):
+        blocks[('YTD', month)] = ytd[:, i]
+    blocks[('FullYear', 'FullYear')] = months.sum(axis=1, min_count=1).to_numpy()
+    return pd.DataFrame(blocks, index=months.index)
+
+
+def _build_cells(df, years):
+    """Build cube rows for the given years (prior years are used for LY)."""
+    needed = set(years) | {year - 1 for year in years}
+    source = df[df['Year'].isin(list(needed))]
+    if source.empty:
+        return pd.DataFrame(columns=CUBE_KEYS + CUBE_COLUMNS)
+
+    wide = _monthly_wide(source)
+    real = _periods(wide['Real'])
+    budget = _periods(wide['Presupuesto'])
+
+    prior = real.copy()
+    prior.index = prior.index.set_levels(prior.index.levels[_ROW_KEYS.index('Year')] + 1, level='Year')
+    real_ly = prior.reindex(real.index)
+
+    # Long layout: one row per (row key, period) without stacking empty combinations
+    rows = np.repeat(np.arange(len(real)), real.shape[1])
+    periods = np.tile(np.arange(real.shape[1]), len(real))
+    cells = real.index.to_frame(index=False).iloc[rows].reset_index(drop=True)
+    cells['Grain'] = real.columns.get_level_values(0).to_numpy()[periods]
+    cells['Period'] = real.columns.get_level_values(1).to_numpy()[periods]
+    cells['Real'] = real.to_numpy().ravel()
+    cells['Presupuesto'] = budget.to_numpy().ravel()
+    cells['Real_LY'] = real_ly.to_numpy().ravel()
+    cells = cells[cells['Year'].isin(list(years))]
+
+    cells['Var_LY'] = cells['Real'] - cells['Real_LY']
+    cells['Var_LY_pct'] = cells['Var_LY'] / cells['Real_LY'].abs().replace(0, np.nan) * 100
+    cells['Var_Budget'] = cells['Real'] - cells['Presupuesto']
+    cells['Var_Budget_pct'] = cells['Var_Budget'] / cells['Presupuesto'].abs().replace(0, np.nan) * 100
+    return cells[CUBE_KEYS + CUBE_COLUMNS].reset_index(drop=True)
+
+
+def _check_group_currency(entities, currencies):
+    """Raise for company-group cells outside GROUP_CURRENCY, which are never built."""
+    groups = [e for e in entities if e in COMPANY_GROUPS]
+    local = [c for c in currencies if c != GROUP_CURRENCY]
+    if groups and local:
+        raise ValueError(
+            f"Company group totals ({', '.join(groups)}) are only available in {GROUP_CURRENCY}: "
+            f"their members report in different local currencies, so {', '.join(local)} amounts cannot be summed"
+        )
+
+
+class AggregateCube:
+    """
+    Materialized aggregates of the melted frame.
+
+    One row per (Entity, Country, Account, Currency, Year, Grain, Period)
+    where Entity is a CompanyName or a company group ("Total Retail", ...),
+    Grain is Month, Quarter, YTD or FullYear, and Period is the month name,
+    Q1..Q4 or "FullYear". YTD rows are labelled with the last month included.
+    """
+
+    def __init__(self, frame, fingerprints):
+        self.frame = frame.sort_values(CUBE_KEYS, kind='stable').reset_index(drop=True)
+        self.fingerprints = fingerprints
+        key_frame = self.frame[CUBE_KEYS]
+        self._positions = {
+            key: i for i, key in enumerate(zip(*(key_frame[c].tolist() for c in CUBE_KEYS)))
+        }
+        self._values = self.frame[CUBE_COLUMNS].to_numpy()
+        self._countries = dict(zip(self.frame['Entity'], self.frame['Country']))
+
+    def get(self, entity, account, year, period='FullYear', grain=None,
+            currency='Dolares', country=None):
+        """
+        Return one precomputed cell.
+
+        Parameters:
+        entity (str): CompanyName or group name (e.g. "Total Retail")
+        account (str): Account name
+        year (int): Year
+        period (str): Month name, "Q1".."Q4" or "FullYear"
+        grain (str): "Month", "Quarter", "YTD" or "FullYear"; inferred
+            from period when omitted (month names default to "Month")
+        currency (str): "Dolares" or "Moneda Local" (company groups only
+            have "Dolares")
+        country (str): Country; inferred from the entity when omitted
+
+        Returns:
+        dict: Cube columns for the cell, or None if it does not exist
+
+        Raises:
+        ValueError: For a company group in local currency
+        """
+        _check_group_currency([entity], [currency])
+        if grain is None:
+            grain = 'Quarter' if period in QUARTERS else 'FullYear' if period == 'FullYear' else 'Month'
+        if country is None:
+            country = self._countries.get(entity)
+        position = self._positions.get((entity, country, account, currency, int(year), grain, period))
+        if position is None:
+            return None
+        return dict(zip(CUBE_COLUMNS, self._values[position].tolist()))
+
+    def query(self, **filters):
+        """
+        Return the cube rows matching every filter (value or list of values).
+
+        Parameters:
+        **filters: Cube key column mapped to a value or list of values
+
+        Returns:
+        pd.DataFrame: Matching cube rows
+
+        Raises:
+        ValueError: If the filters ask for a company group in local currency
+        """
+        filters = {
+            column: list(value) if isinstance(value, (list, tuple, set)) else [value]
+            for column, value in filters.items()
+        }
+        if 'Entity' in filters and 'Currency' in filters:
+            _check_group_currency(filters['Entity'], filters['Currency'])
+        mask = np.ones(len(self.frame), dtype=bool)
+        for column, values in filters.items():
+            mask &= self.frame[column].isin(values).to_numpy()
+        return self.frame[mask]
+
+
+def build_aggregate_cube(df):
+    """
+    Build the aggregate cube for a melted financial frame.
+
+    Parameters:
+    df (pd.DataFrame): Melted financial data
+
+    Returns:
+    AggregateCube: Materialized aggregates
+    """
+    years = sorted(int(y) for y in df['Year'].unique())
+    return AggregateCube(_build_cells(df, years), partition_fingerprints(df))
+
+
+def update_aggregate_cube(cube, df):
+    """
+    Bring a cube up to date with a new version of the data.
+
+    Only years whose (Sheet, Year) partitions changed are recomputed, plus
+    the following year whose LY columns depend on them.
+
+    Parameters:
+    cube (AggregateCube): Previous cube, or None to build from scratch
+    df (pd.DataFrame): New melted financial data
+
+    Returns:
+    AggregateCube: Updated cube (the previous one is left untouched)
+    """
+    if cube is None:
+        return build_aggregate_cube(df)
+
+    fingerprints = partition_fingerprints(df)
+    changed = {year for _sheet, year in set(fingerprints) ^ set(cube.fingerprints)}
+    changed |= {
+        year for (sheet, year), value in fingerprints.items()
+        if cube.fingerprints.get((sheet, year), value) != value
+    }
+    if not changed:
+        return cube
+
+    present = {int(y) for y in df['Year'].unique()}
+    affected = (changed | {year + 1 for year in changed}) & present
+    kept = cube.frame[~cube.frame['Year'].isin(list(changed | affected))]
+    frame = pd.concat([kept, _build_cells(df, sorted(affected))], ignore_index=True)
+    return AggregateCube(frame, fingerprints)
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.chat_history import CONTEXT_ROLE, HANDLE_LABEL, context_window
+
+DEFAULT_CACHE_PATH = 'data/.cache/answers.sqlite'
+
+
+def normalize_prompt(prompt):
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    text = re.sub(r"\s+", " ", str(prompt).strip().lower())
+    return text.rstrip(" ?!.")
+
+
+def context_key(prompt, chat_history):
+    """
+    Return the part of the chat history that can change the answer.
+
+    Only the previous user turns within the window the prompt builders read
+    (last 3 messages) and the summary/state context message are kept;
+    assistant answers are themselves derived from those. The current prompt
+    is dropped if it was already appended, and so is the last result handle
+    line of the context message: handles are random per session, so two
+    identical conversations must still produce the same key.
+    """
+    window = context_window(chat_history)
+    if window and window[-1].get('role') == 'user' and window[-1].get('content') == prompt:
+        window = window[:-1]
+    key = []
+    for m in window:
+        if m.get('role') == 'user':
+            key.append(normalize_prompt(m['content']))
+        elif m.get('role') == CONTEXT_ROLE:
+            lines = [line for line in str(m['content']).splitlines() if not line.startswith(HANDLE_LABEL)]
+            key.append(normalize_prompt("\n".join(lines)))
+    return key
+
+
+class AnswerCache:
+    """
+    Persistent answer cache with LRU and TTL eviction.
+
+    Entries are stored in SQLite so every worker on the host shares them.
+    Each entry holds the generated code, the pickled execution result and the
+    formatted answer for a (prompt, context, data version, model,
+    temperature) key.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=500, ttl_seconds=24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    data_version TEXT,
+                    prompt TEXT,
+                    code TEXT,
+                    result BLOB,
+                    answer TEXT,
+                    created_at REAL,
+                    accessed_at REAL,
+                    hits INTEGER DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS metrics (name TEXT PRIMARY KEY, value INTEGER)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(prompt, chat_history, data_version, model_name, temperature):
+        """Build the cache key for a request."""
+        payload = json.dumps([
+            normalize_prompt(prompt),
+            context_key(prompt, chat_history),
+            data_version,
+            model_name,
+            round(float(temperature), 2),
+        ])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _count(self, conn, name):
+        conn.execute(
+            "INSERT INTO metrics (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def get(self, key):
+        """
+        Return the cached entry for a key, or None on a miss.
+
+        Returns:
+        dict: {'code', 'result', 'answer'} for a hit
+        """
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT code, result, answer, created_at FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[3] > self.ttl_seconds:
+                conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                self._count(conn, 'misses')
+                return None
+            conn.execute(
+                "UPDATE answers SET accessed_at = ?, hits = hits + 1 WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            self._count(conn, 'hits')
+        try:
+            result = pickle.loads(row[1]) if row[1] is not None else None
+        except Exception:
+            result = None
+        return {'code': row[0], 'result': result, 'answer': row[2]}
+
+    def put(self, key, prompt, data_version, code, result, answer):
+        """Store an answer and evict least recently used entries over the limit."""
+        try:
+            blob = pickle.dumps(result)
+        except Exception:
+            blob = None
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO answers "
+                "(key, data_version, prompt, code, result, answer, created_at, accessed_at, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, data_version, prompt, code, blob, answer, now, now)
+            )
+            conn.execute(
+                "DELETE FROM answers WHERE key NOT IN "
+                "(SELECT key FROM answers ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+
+    def invalidate(self, data_version):
+        """Drop entries computed against any other data version."""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM answers WHERE data_version != ?", (data_version,))
+
+    def stats(self):
+        """
+        Return hit/miss counters for this process and across all processes.
+
+        Returns:
+        dict: hits, misses, hit_rate, total_hits, total_misses, entries
+        """
+        with self._connect() as conn:
+            totals = dict(conn.execute("SELECT name, value FROM metrics").fetchall())
+            entries = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'total_hits': totals.get('hits', 0),
+            'total_misses': totals.get('misses', 0),
+            'entries': entries,
+        }
@@ -0,0 +1,170 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from utils.answer_cache import AnswerCache
+from utils.data_index import _as_values
+from utils.query_generator import generate_batch_pandas_code, validate_and_execute_code
+from utils.response_formatter import format_batch_results_as_natural_language
+from utils.result_store import formatter_input
+
+
+def _filter_key(filters):
+    """Hashable key for lookup filters, or None if a value cannot be hashed."""
+    key = tuple(sorted((column, _as_values(value)) for column, value in filters.items()))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def shared_lookup(lookup):
+    """
+    Wrap a lookup so identical slices are materialized once per batch.
+
+    Questions in a pack tend to filter the same company/year slices; the
+    wrapped function returns the same frame for the same filters. Under
+    copy-on-write a question that modifies its slice gets a private copy,
+    otherwise each caller receives a shallow copy of the shared slice.
+    """
+    frames = {}
+    lock = threading.Lock()
+
+    def cached_lookup(**filters):
+        key = _filter_key(filters)
+        if key is None:
+            # Unhashable filter values are answered uncached, as in DimensionIndex
+            frame = lookup(**filters)
+            return frame if pd.get_option('mode.copy_on_write') else frame.copy()
+        with lock:
+            frame = frames.get(key)
+        if frame is None:
+            frame = lookup(**filters)
+            with lock:
+                frames.setdefault(key, frame)
+        if pd.get_option('mode.copy_on_write'):
+            return frame
+        return frame.copy()
+
+    cached_lookup.frames = frames
+    return cached_lookup
+
+
+def answer_questions(questions, df, schema_docs, unique_values, query_model_client, response_model_client,
+                     model_name, temperature, helpers=None, answer_cache=None, data_version=None,
+                     code_cache=None, executor=None, retriever=None, planner=None, batch_size=10,
+                     max_workers=4):
+    """
+    Answer a pack of standalone questions together.
+
+    Each question is first tried on the fast path, the answer cache and the
+    code templates. The rest are sent to the model in chunks of batch_size
+    questions per code-generation call (chunks run concurrently), executed
+    with a shared lookup so repeated slices are computed once, and described
+    with one formatter call per chunk.
+
+    Parameters:
+    questions (list): Question strings; blank lines are ignored
+    batch_size (int): Questions per model call
+    max_workers (int): Concurrent model calls / sandbox executions
+
+    Returns:
+    list: One dict per question with question, code, result, answer and
+    source ('fast_path', 'cache', 'template' or 'model')
+    """
+    questions = [q.strip() for q in questions if q and q.strip()]
+    items = [{'question': q, 'code': None, 'result': None, 'answer': None, 'source': None} for q in questions]
+
+    batch_helpers = dict(helpers or {})
+    if 'lookup' in batch_helpers:
+        batch_helpers['lookup'] = shared_lookup(batch_helpers['lookup'])
+
+    def execute_all(pending):
+        if executor is not None:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                return list(pool.map(lambda job: executor.execute(job[0]), pending))
+        return [validate_and_execute_code(code, df, batch_helpers, compiled=compiled) for code, compiled in pending]
+
+    # Fast path, answer cache and code templates
+    templated = []
+    for item in items:
+        question = item['question']
+        plan = planner.plan(question) if planner is not None else None
+        if plan is not None:
+            result = execute_all([(plan['code'], None)])[0]
+            if isinstance(result, dict) and isinstance(result.get('result'), pd.DataFrame):
+                item.update(code=plan['code'], result=result, source='fast_path',
+                            answer=planner.describe(plan, result['result']))
+                continue
+        if answer_cache is not None:
+            item['cache_key'] = AnswerCache.make_key(question, None, data_version, model_name, temperature)
+            cached = answer_cache.get(item['cache_key'])
+            if cached is not None:
+                item.update(code=cached['code'], result=cached['result'], answer=cached['answer'], source='cache')
+                continue
+        template = code_cache.match(question, None) if code_cache is not None else None
+        if template is not None:
+            item.update(code=template[0], source='template')
+            templated.append((item, template[1]))
+
+    if templated:
+        results = execute_all([(item['code'], compiled) for item, compiled in templated])
+        for (item, _), result in zip(templated, results):
+            if isinstance(result, dict):
+                item['result'] = result
+            else:
+                item.update(code=None, source=None)
+
+    # One code-generation call per chunk of remaining questions
+    pending = [item for item in items if item['source'] is None]
+    chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+    def generate(chunk):
+        return generate_batch_pandas_code(
+            query_model_client, model_name, schema_docs, [item['question'] for item in chunk],
+            unique_values["companies"], unique_values["date_range"], unique_values["accounts"],
+            temperature, retriever=retriever
+        )
+
+    if chunks:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for chunk, codes in zip(chunks, pool.map(generate, chunks)):
+                for item, code in zip(chunk, codes):
+                    item.update(code=code, source='model')
+
+        results = execute_all([(item['code'], None) for item in pending])
+        for item, result in zip(pending, results):
+            item['result'] = result
+            if code_cache is not None and isinstance(result, dict):
+                code_cache.store(item['question'], None, item['code'])
+
+    # One formatter call per chunk of questions that still need a narrative
+    unanswered = [item for item in items if item['answer'] is None]
+    chunks = [unanswered[i:i + batch_size] for i in range(0, len(unanswered), batch_size)]
+
+    def describe(chunk):
+        return format_batch_results_as_natural_language(
+            response_model_client, model_name,
+            [(item['question'], formatter_input(item['result'])) for item in chunk],
+            temperature
+        )
+
+    if chunks:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for chunk, answers in zip(chunks, pool.map(describe, chunks)):
+                for item, answer in zip(chunk, answers):
+                    item['answer'] = answer
+
+    for item in items:
+        cache_key = item.pop('cache_key', None)
+        succeeded = (
+            item['source'] in ('template', 'model')
+            and isinstance(item['result'], dict)
+            and not item['code'].startswith("# Error")
+            and not item['answer'].startswith("Error generating")
+        )
+        if cache_key is not None and succeeded:
+            answer_cache.put(cache_key, item['question'], data_version, item['code'], item['result'], item['answer'])
+    return items
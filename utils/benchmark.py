@@ -0,0 +1,346 @@
+"""
+Offline benchmark of the question-answering pipeline.
+
+Runs load_financial_data, generate_pandas_code, validate_and_execute_code,
+format_results_as_table and the formatter call over a corpus of realistic
+questions, with a stub (or replayed) model client instead of Gemini, on the
+workbook scaled 1x-1000x. Reports throughput, latency percentiles per stage
+and peak resident memory.
+
+Usage:
+    python -m utils.benchmark --scales 1 10 --latency 0.3
+    python -m utils.benchmark --scales 100 1000 --skip-helpers
+    python -m utils.benchmark --replay data/.cache/recording.jsonl --json report.json
+    python -m utils.benchmark --scales 1 --http    # through the HTTP client and ModelGateway
+"""
+import argparse
+import json
+import os
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import DEFAULT_DATA_FILE, load_financial_data, compact_financial_data
+from utils.data_index import build_dimension_index
+from utils.aggregates import build_aggregate_cube
+from utils.fast_path import FastPathPlanner
+from utils.fx_view import build_fx_view
+from utils.model_stub import StubModelClient, load_recording, serve_stub
+from utils.model_gateway import ModelGateway, create_client
+from utils.query_generator import generate_pandas_code, validate_and_execute_code
+from utils.response_formatter import format_results_as_natural_language, format_results_as_table
+from utils.result_store import formatter_input
+from utils.tracing import percentile
+
+# Questions with the code a model typically writes for them: a mix of full
+# frame masks, lookup() slices, cube and fx view reads, groupbys and pivots.
+QUESTIONS = [
+    ("What is the total revenue for Total Retail Chile in 2023?",
+     'result = lookup(CompanyName="Total Retail Chile", Account="Ingresos de Explotacion", Year=2023, '
+     'Scenario="Real", Currency="Dolares")["Value"].sum()'),
+    ("Compare expenses between Chile and Peru for Sodimac",
+     'rows = {}\n'
+     'for entity in ["Total Sodimac Chile", "Total Sodimac Peru"]:\n'
+     '    rows[entity] = cube.get(entity, "gavPrimo", 2024) or {}\n'
+     'result = pd.DataFrame(rows).T'),
+    ("Show me the profit trend for Tottus over the last 3 years",
+     'mask = df["CompanyName"].isin(["Total Tottus Chile", "Total Tottus Peru"]) & (df["Account"] == "Resultado") '
+     '& (df["Scenario"] == "Real") & (df["Currency"] == "Dolares") & (df["Year"] >= 2023)\n'
+     'result = df[mask].groupby("Year", observed=True)["Value"].sum()'),
+    ("What is the revenue growth of Q2 vs LY for Falabella retail Chile?",
+     'result = cube.get("Total Retail Chile", "Ingresos de Explotacion", 2025, "Q2")'),
+    ("Show me the operating margin for all companies in USD",
+     'mask = (df["Account"] == "Margen de Explotacion") & (df["Scenario"] == "Real") & (df["Currency"] == "Dolares")\n'
+     'result = df[mask].groupby(["CompanyName", "Year"], observed=True)["Value"].sum().unstack()'),
+    ("Revenue by country in 2024",
+     'mask = (df["Account"] == "Ingresos de Explotacion") & (df["Year"] == 2024) & (df["Scenario"] == "Real") '
+     '& (df["Currency"] == "Dolares")\n'
+     'result = df[mask].groupby("Country", observed=True)["Value"].sum().sort_values(ascending=False)'),
+    ("Top 10 companies by revenue in 2024",
+     'mask = (df["Account"] == "Ingresos de Explotacion") & (df["Year"] == 2024) & (df["Scenario"] == "Real") '
+     '& (df["Currency"] == "Dolares")\n'
+     'result = df[mask].groupby("CompanyName", observed=True)["Value"].sum().nlargest(10)'),
+    ("Monthly revenue vs budget for Total Retail Chile in 2024",
+     'data = lookup(CompanyName="Total Retail Chile", Account="Ingresos de Explotacion", Year=2024, Currency="Dolares")\n'
+     'result = data.pivot_table(index="Month", columns="Scenario", values="Value", aggfunc="sum", observed=True)'),
+    ("Gross margin percentage by company in 2023",
+     'data = df[(df["Year"] == 2023) & (df["Scenario"] == "Real") & (df["Currency"] == "Dolares") '
+     '& df["Account"].isin(["Margen Bruto", "Ingresos de Explotacion"])]\n'
+     'totals = data.pivot_table(index="CompanyName", columns="Account", values="Value", aggfunc="sum", observed=True)\n'
+     'result = (totals["Margen Bruto"] / totals["Ingresos de Explotacion"] * 100).dropna().round(2)'),
+    ("Which accounts had the largest budget variance in 2024?",
+     'data = df[(df["Year"] == 2024) & (df["Currency"] == "Dolares")]\n'
+     'pivot = data.pivot_table(index="Account", columns="Scenario", values="Value", aggfunc="sum", observed=True)\n'
+     'result = (pivot["Real"] - pivot["Presupuesto"]).abs().sort_values(ascending=False)'),
+    ("Total Sodimac full year 2024 actual vs budget",
+     'result = cube.get("Total Sodimac", "Ingresos de Explotacion", 2024)'),
+    ("Revenue vs budget in USD and local currency by company in 2024",
+     'rows = fx[(fx["Account"] == "Ingresos de Explotacion") & (fx["Year"] == 2024)]\n'
+     'result = rows.groupby("CompanyName", observed=True)[["Var_Budget_USD", "Var_Budget_Local"]].sum()'),
+    ("Average monthly taxes for Sodimac Colombia in 2023 in local currency",
+     'result = lookup(CompanyName="Sodimac Colombia", Account="Impuestos", Year=2023, Scenario="Real", '
+     'Currency="Moneda Local")["Value"].mean()'),
+]
+
+# Questions the fast path must leave to the model: each has a word or a
+# second period/currency/comparison that its templates cannot express
+FAST_PATH_DECLINED = [
+    "What was retail revenue in 2023 excluding Argentina?",
+    "Which month had the highest sales for Sodimac in 2024?",
+    "Top 3 Sodimac countries by revenue in 2024",
+    "Sodimac revenue as a percentage of costs in 2024",
+    "What is the total revenue for Falabella Retail?",
+    "Average monthly revenue for Sodimac in 2024",
+    "Sodimac revenue in March and April 2024",
+    "Sodimac revenue in Q1 and Q2 2024",
+    "Sodimac revenue January vs February 2024",
+    "Sodimac Colombia revenue in 2024 in USD and local currency",
+    "Sodimac revenue 2024 vs budget vs last year",
+]
+
+STAGES = ['code_generation', 'execution', 'table', 'formatter']
+
+
+def stub_responses():
+    """Canned code and answers for the QUESTIONS corpus."""
+    responses = {}
+    for question, code in QUESTIONS:
+        responses[('code', question)] = code
+        responses[('answer', question)] = f"Here is the answer to: {question}. See the table for details."
+    return responses
+
+
+def scale_financial_data(df, factor, seed=0):
+    """
+    Replicate the frame `factor` times with renamed companies.
+
+    Copy k of every company is named "<company> #k" and its values are
+    scaled by a random factor, so questions about the original companies
+    stay just as selective while full-frame scans grow with the data.
+    Scaling happens on the compact frame rather than in a workbook, since
+    large factors exceed the xlsx row limit.
+    """
+    df = compact_financial_data(df)
+    if factor <= 1:
+        return df
+    rng = np.random.default_rng(seed)
+    noise = np.concatenate([[1.0], rng.uniform(0.8, 1.2, size=factor - 1)])
+    columns = {}
+    for column in df.columns:
+        series = df[column]
+        if column == 'CompanyName':
+            categories = list(series.cat.categories)
+            n = len(categories)
+            names = categories + [f"{c} #{k}" for k in range(1, factor) for c in categories]
+            codes = series.cat.codes.to_numpy().astype(np.int32)
+            all_codes = np.concatenate([codes + k * n for k in range(factor)])
+            columns[column] = pd.Categorical.from_codes(all_codes, names)
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            columns[column] = pd.Categorical.from_codes(
+                np.tile(series.cat.codes.to_numpy(), factor), dtype=series.dtype
+            )
+        elif column == 'Value':
+            values = series.to_numpy()
+            columns[column] = np.concatenate([values * noise[k] for k in range(factor)])
+        else:
+            columns[column] = np.tile(series.to_numpy(), factor)
+    return pd.DataFrame(columns)
+
+
+def _current_rss():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakMemory:
+    """Sample resident memory in a background thread and keep the peak."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = _current_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _current_rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss())
+
+
+def _timed(timings, name, func, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        timings[name] = (time.perf_counter() - started) * 1000
+
+
+def answer_question(question, df, helpers, unique_values, client, model_name='stub'):
+    """Run one question through the pipeline and return its stage timings in ms."""
+    timings = {}
+    started = time.perf_counter()
+    code = _timed(timings, 'code_generation', generate_pandas_code, client, model_name, "", question,
+                  unique_values['companies'], unique_values['date_range'], unique_values['accounts'], 0.0)
+    result = _timed(timings, 'execution', validate_and_execute_code, code, df, helpers)
+    table_data = result.get('result') if isinstance(result, dict) else result
+    _timed(timings, 'table', format_results_as_table, table_data)
+    _timed(timings, 'formatter', format_results_as_natural_language, client, model_name, formatter_input(result),
+           question, 0.0)
+    timings['total'] = (time.perf_counter() - started) * 1000
+    timings['error'] = not isinstance(result, dict)
+    return timings
+
+
+def check_fast_path(df):
+    """Return the FAST_PATH_DECLINED questions the fast path wrongly answers."""
+    planner = FastPathPlanner(df['CompanyName'].unique(), df['Country'].unique(), df['Year'].unique())
+    return [question for question in FAST_PATH_DECLINED if planner.plan(question) is not None]
+
+
+def benchmark_loading(file_path):
+    """Time a cold workbook parse, a cached read and a memory-mapped cached read."""
+    timings = {}
+    _timed(timings, 'parse_workbook', load_financial_data, file_path, use_cache=False)
+    load_financial_data(file_path)  # make sure the cache exists
+    _timed(timings, 'cached_read', load_financial_data, file_path)
+    _timed(timings, 'memory_mapped_read', load_financial_data, file_path, memory_map=True)
+    return timings
+
+
+def benchmark_scale(base_df, factor, client, rounds=3, concurrency=4, helpers=True):
+    """
+    Benchmark the pipeline on the frame scaled by `factor`.
+
+    With helpers=False the dimension index, cube and fx view are not built
+    (they dominate memory at large scales) and questions that use them are
+    skipped.
+
+    Returns:
+    dict: rows, setup timings, throughput, per-stage percentiles, errors and
+    peak RSS for this scale
+    """
+    with PeakMemory() as memory:
+        setup = {}
+        df = _timed(setup, 'scale_frame', scale_financial_data, base_df, factor)
+        corpus = QUESTIONS
+        if helpers:
+            index = _timed(setup, 'build_index', build_dimension_index, df)
+            cube = _timed(setup, 'build_cube', build_aggregate_cube, df)
+            fx = _timed(setup, 'build_fx', build_fx_view, df)
+            helpers = {'lookup': index.lookup, 'cube': cube, 'fx': fx}
+        else:
+            corpus = [
+                (q, code) for q, code in QUESTIONS
+                if 'lookup(' not in code and 'cube.' not in code and 'fx[' not in code
+            ]
+            helpers = {}
+        unique_values = {
+            'companies': sorted(df['CompanyName'].cat.categories[:200].tolist()),
+            'accounts': sorted(df['Account'].cat.categories.tolist()),
+            'date_range': f"{df['Year'].min()} - {df['Year'].max()}",
+        }
+        questions = [q for q, _ in corpus] * rounds
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            runs = list(pool.map(
+                lambda q: answer_question(q, df, helpers, unique_values, client), questions
+            ))
+        elapsed = time.perf_counter() - started
+
+    stages = {}
+    for stage in STAGES + ['total']:
+        values = [run[stage] for run in runs]
+        stages[stage] = {q: round(percentile(values, q), 2) for q in (50, 95, 99)}
+    return {
+        'scale': factor,
+        'rows': len(df),
+        'setup_ms': {k: round(v, 1) for k, v in setup.items()},
+        'questions': len(runs),
+        'errors': sum(run['error'] for run in runs),
+        'throughput_qps': round(len(runs) / elapsed, 2),
+        'stages_ms': stages,
+        'peak_rss_mb': round(memory.peak / (1024 * 1024), 1),
+    }
+
+
+def print_report(report):
+    print("Loading (ms): " + ", ".join(f"{k}={v:.1f}" for k, v in report['loading_ms'].items()))
+    for result in report['scales']:
+        print(f"\nScale {result['scale']}x: {result['rows']:,} rows, peak RSS {result['peak_rss_mb']:,.1f} MB")
+        print("  setup (ms): " + ", ".join(f"{k}={v:,.1f}" for k, v in result['setup_ms'].items()))
+        print(f"  {result['questions']} questions, {result['errors']} errors, {result['throughput_qps']} questions/s")
+        print(f"  {'stage':<16}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for stage, p in result['stages_ms'].items():
+            print(f"  {stage:<16}{p[50]:>10.1f}{p[95]:>10.1f}{p[99]:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark with a stub model client")
+    parser.add_argument('--file', default=DEFAULT_DATA_FILE, help="Workbook to load")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+                        help="Scale factors; memory grows linearly (about 200 MB per 1x with helpers)")
+    parser.add_argument('--skip-helpers', action='store_true',
+                        help="Do not build lookup()/cube/fx; needed for 100x-1000x on small machines")
+    parser.add_argument('--rounds', type=int, default=3, help="Passes over the question corpus per scale")
+    parser.add_argument('--concurrency', type=int, default=4, help="Questions in flight at once")
+    parser.add_argument('--latency', type=float, default=0.0, help="Stub model latency per call (seconds)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Extra random latency per call (seconds)")
+    parser.add_argument('--replay', help="Replay responses recorded with RecordingModelClient")
+    parser.add_argument('--json', help="Also write the report to this JSON file")
+    parser.add_argument('--http', action='store_true',
+                        help="Serve the stub over local HTTP and call it through the real client and ModelGateway")
+    args = parser.parse_args(argv)
+
+    responses = stub_responses()
+    if args.replay:
+        responses.update(load_recording(args.replay))
+    client = StubModelClient(responses, latency=args.latency, jitter=args.jitter, seed=0)
+    server = None
+    if args.http:
+        server = serve_stub(client)
+        client = ModelGateway(create_client(api_key='stub', base_url=server.url), max_concurrency=args.concurrency)
+
+    pd.set_option('mode.copy_on_write', True)
+    report = {'loading_ms': benchmark_loading(args.file), 'scales': []}
+    base_df = load_financial_data(args.file, compact=True)
+    report['fast_path_misplanned'] = check_fast_path(base_df)
+    for factor in args.scales:
+        report['scales'].append(benchmark_scale(
+            base_df, factor, client, args.rounds, args.concurrency, helpers=not args.skip_helpers
+        ))
+
+    if server is not None:
+        report['gateway'] = client.stats()
+        report['gateway']['connections'] = server.connections
+        server.shutdown()
+        print(f"Gateway: {report['gateway']}")
+    print_report(report)
+    misplanned = report['fast_path_misplanned']
+    print(f"Fast path: {len(FAST_PATH_DECLINED) - len(misplanned)}/{len(FAST_PATH_DECLINED)} "
+          f"out-of-template questions left to the model" + (f"; answered: {misplanned}" if misplanned else ""))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+    return report
+
+
+if __name__ == "__main__":
+    main()
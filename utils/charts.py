@@ -0,0 +1,282 @@
+"""
+Chart generation for execution results.
+
+build_chart picks a chart type from the shape of a result (line for
+ordered x values such as years, months or dates, bar for categories,
+nothing for results without numbers), reduces long series server-side
+(LTTB, or min/max per bucket) and caps the figure's JSON size, so that
+what is sent to the browser stays small no matter how large the result is.
+Figures are memoized on the result's content hash, so a rerun does not
+build the same figure again.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import MONTHS
+from utils.response_formatter import result_fingerprint
+
+# Points drawn across all series of one chart
+DEFAULT_MAX_POINTS = 2000
+# Serialized figure size sent to the browser
+MAX_CHART_BYTES = 1_000_000
+MAX_SERIES = 8
+MAX_BARS = 30
+
+_TIME_COLUMNS = ('Date', 'Year', 'Month', 'Period')
+
+_CHART_CACHE_SIZE = 32
+_chart_cache = OrderedDict()
+_chart_cache_lock = threading.Lock()
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Keeps the first and last point and, from each of `threshold - 2` equal
+    buckets in between, the point that forms the largest triangle with the
+    point kept before it and the mean of the next bucket. Peaks and dips
+    are preserved much better than by taking every n-th point.
+
+    Parameters:
+    x (array): Increasing x values (numeric)
+    y (array): y values, without NaN
+    threshold (int): Number of points to keep
+
+    Returns:
+    np.ndarray: Positions of the kept points, increasing
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        following = slice(end, edges[i + 2] if i + 2 < len(edges) else n)
+        mean_x, mean_y = x[following].mean(), y[following].mean()
+        area = np.abs(
+            (x[previous] - mean_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (mean_y - y[previous])
+        )
+        previous = start + int(area.argmax())
+        kept[i + 1] = previous
+    return kept
+
+
+def minmax_buckets(y, threshold):
+    """
+    Min/max bucketing: the lowest and highest point of each of
+    `(threshold - 2) // 2` equal buckets, plus the first and last point.
+
+    Returns:
+    np.ndarray: Positions of the kept points, increasing
+    """
+    n = len(y)
+    if threshold >= n or threshold < 4:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(0, n, (threshold - 2) // 2 + 1).astype(int)
+    kept = [0, n - 1]
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            kept.extend((start + int(y[start:end].argmin()), start + int(y[start:end].argmax())))
+    return np.unique(kept)
+
+
+def downsample(x, y, max_points, method='lttb'):
+    """Positions to keep from one series of at most `max_points` points."""
+    if method == 'minmax':
+        return minmax_buckets(y, max_points)
+    return lttb(x, y, max_points)
+
+
+def _is_time(series):
+    return (
+        series.name in _TIME_COLUMNS
+        or pd.api.types.is_datetime64_any_dtype(series)
+        or isinstance(series.dtype, pd.PeriodDtype)
+    )
+
+
+def _x_positions(values):
+    """Numeric x values for downsampling: timestamps, month numbers or row order."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype('int64').to_numpy(dtype=float)
+    if isinstance(values.dtype, pd.CategoricalDtype) and values.cat.ordered:
+        return values.cat.codes.to_numpy(dtype=float)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=float)
+    return np.arange(len(values), dtype=float)
+
+
+def chart_spec(result):
+    """
+    Choose how to chart a result.
+
+    Returns:
+    dict: kind ('line' or 'bar'), the long-format frame to draw, x, y and
+    color columns and notes on what was left out, or None if the result
+    has nothing to chart
+    """
+    if isinstance(result, pd.Series):
+        if not pd.api.types.is_numeric_dtype(result) or pd.api.types.is_bool_dtype(result):
+            return None
+        name = result.name if result.name is not None else 'value'
+        result = result.to_frame(name=name)
+    if not isinstance(result, pd.DataFrame) or result.empty:
+        return None
+
+    frame = result
+    if frame.index.name is not None or frame.index.nlevels > 1 or not pd.api.types.is_integer_dtype(frame.index):
+        # A groupby key or a date index is the natural x axis
+        frame = frame.reset_index()
+    frame = frame.loc[:, ~frame.columns.duplicated()]
+    frame.columns = [str(c) for c in frame.columns]
+
+    times = [c for c in frame.columns if _is_time(frame[c])]
+    labels = [
+        c for c in frame.columns
+        if c not in times and not pd.api.types.is_numeric_dtype(frame[c])
+    ]
+    values = [
+        c for c in frame.columns
+        if c not in times and pd.api.types.is_numeric_dtype(frame[c]) and not pd.api.types.is_bool_dtype(frame[c])
+    ]
+    if not values:
+        return None
+    notes = []
+    if len(values) > MAX_SERIES:
+        notes.append(f"first {MAX_SERIES} of {len(values)} numeric columns")
+        values = values[:MAX_SERIES]
+
+    x = next((c for c in ('Date', 'Period', 'Month') if c in times), times[0] if times else None)
+    if x is None:
+        x = labels[0] if labels else None
+        color = labels[1] if len(labels) > 1 else None
+    else:
+        color = labels[0] if labels else None
+        if x == 'Month' and 'Year' in times and color is None and frame['Year'].nunique() > 1:
+            color = 'Year'
+    if x is None:
+        frame = frame.assign(row=np.arange(len(frame)))
+        x = 'row'
+
+    # Long format: one row per point, one series per (color, column)
+    if len(values) > 1:
+        id_columns = [x] + ([color] if color else [])
+        frame = frame.melt(id_vars=id_columns, value_vars=values, var_name='Series', value_name='Value')
+        if color:
+            frame['Series'] = frame[color].astype(str) + " · " + frame['Series']
+        y, color = 'Value', 'Series'
+    else:
+        frame = frame[[x] + ([color] if color else []) + values]
+        y = values[0]
+
+    ordered = x in times or x == 'row'
+    if ordered and frame[x].nunique() >= 3:
+        kind = 'line'
+    else:
+        kind = 'bar'
+        categories = frame[x].nunique()
+        if categories > MAX_BARS:
+            totals = frame.groupby(x, observed=True, sort=False)[y].sum().abs()
+            top = totals.nlargest(MAX_BARS).index
+            frame = frame[frame[x].isin(top)]
+            notes.append(f"top {MAX_BARS} of {categories:,} {x} values by {y}")
+    if color and frame[color].nunique() > MAX_SERIES:
+        top = frame.groupby(color, observed=True, sort=False)[y].sum().abs().nlargest(MAX_SERIES).index
+        notes.append(f"top {MAX_SERIES} of {frame[color].nunique():,} series")
+        frame = frame[frame[color].isin(top)]
+    return {'kind': kind, 'frame': frame, 'x': x, 'y': y, 'color': color, 'notes': notes}
+
+
+def _reduce(spec, max_points, method):
+    """Downsample every series of a line spec so all together have at most max_points."""
+    frame = spec['frame'].dropna(subset=[spec['y']])
+    x, y, color = spec['x'], spec['y'], spec['color']
+    groups = [group for _, group in frame.groupby(color, observed=True, sort=False)] if color else [frame]
+    per_series = max(max_points // max(len(groups), 1), 3)
+    parts = []
+    for group in groups:
+        group = group.sort_values(x, kind='stable')
+        if len(group) > per_series:
+            kept = downsample(_x_positions(group[x]), group[y].to_numpy(dtype=float), per_series, method)
+            group = group.iloc[kept]
+        parts.append(group)
+    return pd.concat(parts) if len(parts) > 1 else parts[0]
+
+
+def _figure(spec, frame):
+    import plotly.express as px
+    draw = px.line if spec['kind'] == 'line' else px.bar
+    options = {'barmode': 'group'} if spec['kind'] == 'bar' else {}
+    if spec['x'] == 'Month':
+        options['category_orders'] = {'Month': MONTHS}
+    fig = draw(frame, x=spec['x'], y=spec['y'], color=spec['color'], **options)
+    fig.update_layout(margin=dict(l=10, r=10, t=30, b=10), legend_title_text='')
+    return fig
+
+
+def _build_chart(result, max_points, max_bytes, method):
+    spec = chart_spec(result)
+    if spec is None:
+        return None
+    source_points = len(spec['frame'])
+    budget = max_points
+    while True:
+        frame = _reduce(spec, budget, method) if spec['kind'] == 'line' else spec['frame']
+        fig = _figure(spec, frame)
+        size = len(fig.to_json())
+        if size <= max_bytes or spec['kind'] != 'line' or budget <= 50:
+            break
+        # Over the payload cap: keep halving the points
+        budget //= 2
+    if size > max_bytes:
+        return {'figure': None, 'kind': spec['kind'], 'points': len(frame), 'source_points': source_points,
+                'bytes': size, 'notes': spec['notes'] + [f"chart of {size:,} bytes exceeds the {max_bytes:,}-byte limit"]}
+    notes = list(spec['notes'])
+    if len(frame) < source_points and spec['kind'] == 'line':
+        notes.append(f"{len(frame):,} of {source_points:,} points shown ({method})")
+    return {'figure': fig, 'kind': spec['kind'], 'points': len(frame), 'source_points': source_points,
+            'bytes': size, 'notes': notes}
+
+
+def build_chart(result, max_points=DEFAULT_MAX_POINTS, max_bytes=MAX_CHART_BYTES, method='lttb'):
+    """
+    Build (or reuse) the chart for an execution result.
+
+    Parameters:
+    result: DataFrame or Series (anything else has no chart)
+    max_points (int): Points drawn across all series of a line chart
+    max_bytes (int): Largest serialized figure sent to the browser; line
+        charts are downsampled further until they fit, other charts over
+        the limit are not drawn
+    method (str): 'lttb' or 'minmax' downsampling
+
+    Returns:
+    dict: figure (plotly Figure, or None if over the limit), kind, points
+    drawn, source_points, bytes and notes; or None if there is nothing to
+    chart
+    """
+    fingerprint = result_fingerprint(result)
+    if fingerprint is None:
+        return _build_chart(result, max_points, max_bytes, method)
+    key = (fingerprint, max_points, max_bytes, method)
+    with _chart_cache_lock:
+        if key in _chart_cache:
+            _chart_cache.move_to_end(key)
+            return _chart_cache[key]
+    chart = _build_chart(result, max_points, max_bytes, method)
+    with _chart_cache_lock:
+        _chart_cache[key] = chart
+        while len(_chart_cache) > _CHART_CACHE_SIZE:
+            _chart_cache.popitem(last=False)
+    return chart
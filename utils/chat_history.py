@@ -1,18 +1,280 @@
 import json
-import streamlit as st
 import os
-from datetime import datetime
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
 
-CHAT_HISTORY_FILE = "chat_history.json"
+import pandas as pd
 
-def load_chat_history():
-    """Load chat history from session state."""
-    return st.session_state.get("messages", [])
+from utils.fast_path import COMPANY_ALIASES, METRIC_ALIASES
 
-def save_chat_history(messages):
-    """Save chat history to session state."""
-    st.session_state["messages"] = messages
+DEFAULT_HISTORY_PATH = 'data/.cache/chat_history.sqlite'
 
-def clear_chat_history():
-    """Clear chat history from session state."""
-    st.session_state["messages"] = []
\ No newline at end of file
+# Role of the synthetic message carrying the summary and prior-query state
+CONTEXT_ROLE = 'context'
+
+# Label of the context line naming the last result's handle; handles are
+# random, so cache keys drop this line (see answer_cache.context_key)
+HANDLE_LABEL = "- Last result handle:"
+
+
+def context_window(chat_history, window=3):
+    """
+    Return the part of a chat history that goes into a prompt.
+
+    That is any context message (summary and prior-query state, see
+    ChatHistoryStore.context) followed by the last `window` turns.
+    """
+    messages = list(chat_history or [])
+    context = [m for m in messages if m.get('role') == CONTEXT_ROLE]
+    turns = [m for m in messages if m.get('role') != CONTEXT_ROLE]
+    return context + turns[-window:]
+
+
+def history_text(chat_history, window=3):
+    """Render the prompt window of a chat history as "role: content" lines."""
+    return "\n".join(f"{m['role']}: {m['content']}" for m in context_window(chat_history, window))
+
+
+def describe_result(result):
+    """One-line description of an execution result, for the prior-query state."""
+    if isinstance(result, dict) and 'result' in result:
+        result = result['result']
+    if isinstance(result, pd.DataFrame):
+        columns = ", ".join(str(c) for c in result.columns[:8]) + (", ..." if len(result.columns) > 8 else "")
+        return f"table of {len(result):,} rows x {len(result.columns)} columns ({columns})"
+    if isinstance(result, pd.Series):
+        return f"series of {len(result):,} values ({result.name})"
+    if isinstance(result, dict):
+        keys = ", ".join(str(k) for k in list(result)[:8])
+        return f"dict with {len(result)} keys ({keys})"
+    text = str(result)
+    return text if len(text) <= 80 else text[:77] + "..."
+
+
+def _shorten(text, limit):
+    text = re.sub(r"\s+", " ", str(text)).strip()
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+def _first_sentence(text, limit):
+    text = re.sub(r"[*_#`|]", "", str(text))
+    match = re.match(r"(.+?[.!?])(\s|$)", text.strip(), re.DOTALL)
+    return _shorten(match.group(1) if match else text, limit)
+
+
+class ChatHistoryStore:
+    """
+    Append-only chat log of one session with bounded memory.
+
+    Every message is appended to SQLite (shared by all workers on the host);
+    only the last `max_messages` are kept in memory for display. For the
+    model, messages that fall out of the last `window` turns are folded into
+    a rolling summary (one short line per question and answer, at most
+    `summary_turns` of each), and the entities and result of the latest
+    question are kept as structured state. context() returns that summary
+    and state plus the last turns with long answers shortened, instead of
+    the raw conversation.
+    """
+
+    def __init__(self, session_id=None, path=DEFAULT_HISTORY_PATH, max_messages=50, window=3,
+                 summary_turns=8, answer_chars=400):
+        self.path = path
+        self.max_messages = max_messages
+        self.window = window
+        self.summary_turns = summary_turns
+        self.answer_chars = answer_chars
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    session_id TEXT,
+                    seq INTEGER,
+                    role TEXT,
+                    content TEXT,
+                    created_at REAL,
+                    PRIMARY KEY (session_id, seq)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    message_count INTEGER,
+                    summary TEXT,
+                    state TEXT,
+                    updated_at REAL
+                )
+            """)
+        self._load(session_id or uuid.uuid4().hex)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _load(self, session_id):
+        """Resume a session from disk (or start an empty one)."""
+        self.session_id = session_id
+        self.messages = deque(maxlen=self.max_messages)
+        self.summary = deque(maxlen=2 * self.summary_turns)
+        self.state = {}
+        self.count = 0
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT message_count, summary, state FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return
+            self.count = row[0]
+            self.summary.extend(json.loads(row[1]))
+            self.state = json.loads(row[2])
+            recent = conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+                (session_id, self.max_messages)
+            ).fetchall()
+        self.messages.extend({'role': role, 'content': content} for role, content in reversed(recent))
+
+    def _save_session(self, conn):
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, message_count, summary, state, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (self.session_id, self.count, json.dumps(list(self.summary)), json.dumps(self.state, default=str), time.time())
+        )
+
+    def _fold(self, message):
+        if message['role'] == 'user':
+            self.summary.append(f"Q: {_shorten(message['content'], 160)}")
+        elif message['role'] == 'assistant':
+            self.summary.append(f"A: {_first_sentence(message['content'], 160)}")
+
+    def append(self, role, content):
+        """Log a message and fold the one leaving the prompt window into the summary."""
+        message = {'role': role, 'content': content}
+        with self._lock:
+            self.messages.append(message)
+            self.count += 1
+            if len(self.messages) > self.window:
+                self._fold(self.messages[-(self.window + 1)])
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO messages (session_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (self.session_id, self.count, role, content, time.time())
+                )
+                self._save_session(conn)
+        return message
+
+    def remember(self, question, companies=(), accounts=(), turn=None):
+        """
+        Update the prior-query state after answering a question.
+
+        Companies, accounts and years mentioned in the question (by name, or
+        through the fast path's company and metric aliases) replace the
+        previous ones; anything not mentioned is carried over, so a
+        follow-up such as "and in 2024?" keeps the earlier companies. When
+        the fast path resolved the question, its entities are used as is.
+
+        Parameters:
+        question (str): The question just answered
+        companies (iterable): Known CompanyName values
+        accounts (iterable): Known Account values
+        turn (dict): Optional details of the answer (code, result, handle,
+            entities, account, years, source) as filled in by
+            process_user_prompt
+        """
+        turn = turn or {}
+        text = question.lower()
+        found = {}
+
+        mentioned = []
+        for company in sorted(companies, key=len, reverse=True):
+            if company.lower() in text and not any(company.lower() in m.lower() for m in mentioned):
+                mentioned.append(company)
+        if not mentioned:
+            mentioned = [group for pattern, group in COMPANY_ALIASES if re.search(rf"\b(?:{pattern})\b", text)][:1]
+        account_names = [a for a in accounts if a.lower() in text]
+        if not account_names:
+            account_names = [account for pattern, account in METRIC_ALIASES if re.search(rf"\b(?:{pattern})\b", text)][:1]
+        found['companies'] = turn.get('entities') or mentioned
+        found['accounts'] = [turn['account']] if turn.get('account') else account_names
+        found['years'] = turn.get('years') or sorted({int(y) for y in re.findall(r"\b(?:19|20)\d{2}\b", question)})
+
+        with self._lock:
+            for key, values in found.items():
+                if values:
+                    self.state[key] = [v if isinstance(v, (int, str)) else str(v) for v in values]
+            self.state['last_question'] = _shorten(question, 200)
+            if 'result' in turn:
+                self.state['last_result'] = describe_result(turn['result'])
+                if turn.get('handle'):
+                    self.state['last_result_handle'] = turn['handle']
+                else:
+                    self.state.pop('last_result_handle', None)
+            if turn.get('source'):
+                self.state['last_source'] = turn['source']
+            with self._connect() as conn:
+                self._save_session(conn)
+
+    def context(self):
+        """
+        Return the chat history to pass to the prompt builders.
+
+        Returns:
+        list: A context message with the summary and prior-query state (if
+        any), followed by the last `window` messages with assistant answers
+        shortened to `answer_chars`
+        """
+        with self._lock:
+            messages = list(self.messages)[-self.window:]
+            summary = list(self.summary)
+            state = dict(self.state)
+        parts = []
+        if summary:
+            parts.append("Conversation summary:\n" + "\n".join(f"- {line}" for line in summary))
+        if state:
+            labels = [('companies', 'Companies'), ('accounts', 'Accounts'), ('years', 'Years'),
+                      ('last_question', 'Last question'), ('last_result', 'Last result')]
+            lines = []
+            for key, label in labels:
+                value = state.get(key)
+                if value:
+                    lines.append(f"- {label}: {', '.join(map(str, value)) if isinstance(value, list) else value}")
+            if state.get('last_result_handle'):
+                lines.append(f"{HANDLE_LABEL} {state['last_result_handle']} (available to code as last_result)")
+            parts.append("Prior query state:\n" + "\n".join(lines))
+        context = [{'role': CONTEXT_ROLE, 'content': "\n".join(parts)}] if parts else []
+        for m in messages:
+            content = m['content']
+            if m['role'] == 'assistant':
+                content = _shorten(content, self.answer_chars)
+            context.append({'role': m['role'], 'content': content})
+        return context
+
+    def recent(self):
+        """Return the messages kept in memory, oldest first."""
+        with self._lock:
+            return list(self.messages)
+
+    def export_text(self):
+        """Return the whole session log as "role: content" lines, read from disk."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY seq", (self.session_id,)
+            ).fetchall()
+        return "\n".join(f"{role}: {content}" for role, content in rows)
+
+    def clear(self):
+        """Start a new, empty session; the old one stays in the log."""
+        with self._lock:
+            self._load(uuid.uuid4().hex)
@@ -1,40 +1,25 @@
 # Chat logic for the Streamlit app
 from utils.query_generator import generate_pandas_code, validate_and_execute_code
-from utils.response_formatter import format_results_as_natural_language, format_results_as_table
+from utils.response_formatter import stream_results_as_natural_language, format_results_as_table, DEFAULT_TABLE_ROWS
+from utils.answer_cache import AnswerCache
+from utils.tracing import Trace
+from utils.result_store import formatter_input
+from utils.charts import build_chart
+import queue
+import threading
+import time
 import pandas as pd
-import plotly.express as px
 import streamlit as st
 
-def process_user_prompt(prompt, df, schema_docs, unique_values, query_model_client, response_model_client, model_name, temperature, chat_history):
-    generated_code = generate_pandas_code(
-        query_model_client,
-        model_name,
-        schema_docs,
-        prompt,
-        unique_values["companies"],
-        unique_values["date_range"],
-        unique_values["accounts"],
-        temperature,
-        chat_history=chat_history
-    )
-    with st.expander("🔍 View Generated Code", expanded=False):
-        st.code(generated_code, language="python")
-    execution_result = validate_and_execute_code(generated_code, df)
-    if isinstance(execution_result, dict):
-        output_content = execution_result.get('output', '')
-        result_content = execution_result.get('result', '')
-        formatter_input = f"Output:\n{output_content}\n\nResult:\n{result_content}"
-    else:
-        formatter_input = execution_result
-    natural_language_response = format_results_as_natural_language(
-        response_model_client,
-        model_name,
-        formatter_input,
-        prompt,
-        temperature,
-        chat_history=chat_history
-    )
-    st.markdown(natural_language_response)
+def _result_size(execution_result):
+    """Rows and characters of an execution result, for tracing."""
+    result = execution_result.get('result') if isinstance(execution_result, dict) else execution_result
+    rows = len(result) if isinstance(result, (pd.DataFrame, pd.Series)) else None
+    return {'result_rows': rows, 'result_chars': len(str(result))}
+
+def render_results(execution_result, trace=None):
+    """Render the results table and chart for an execution result."""
+    trace = trace or Trace(None)
     if isinstance(execution_result, dict):
         table_data = execution_result.get('result')
         if table_data is None:
@@ -42,21 +27,238 @@ def process_user_prompt(prompt, df, schema_docs, unique_values, query_model_clie
     else:
         table_data = execution_result
     if table_data is not None and (not isinstance(table_data, str) or (isinstance(table_data, str) and not table_data.startswith("Error"))):
-        with st.expander("📋 View Results Table", expanded=False):
-            table_format = format_results_as_table(table_data)
-            st.markdown(table_format)
-    try:
+        with st.expander("📋 View Results Table", expanded=False), trace.stage('table'):
+            if isinstance(table_data, pd.DataFrame) and len(table_data) > DEFAULT_TABLE_ROWS:
+                # Streamlit runs expander bodies even while collapsed; the grid
+                # ships the frame once as Arrow and the browser draws only the
+                # visible rows, instead of a markdown table of every row.
+                st.caption(f"{len(table_data):,} rows")
+                st.dataframe(table_data, hide_index=True, use_container_width=True)
+            else:
+                table_format = format_results_as_table(table_data)
+                st.markdown(table_format)
+    with trace.stage('chart'):
         chart_data = execution_result.get('result', '') if isinstance(execution_result, dict) else execution_result
-        if hasattr(chart_data, 'plot'):
-            st.subheader("📊 Visualization")
-            st.line_chart(chart_data)
-        elif isinstance(chart_data, pd.DataFrame) and len(chart_data) > 0:
-            numeric_columns = chart_data.select_dtypes(include=['number']).columns
-            if len(numeric_columns) > 0:
-                st.subheader("📊 Visualization")
-                if len(chart_data) <= 20:
-                    fig = px.bar(chart_data, x=chart_data.index, y=numeric_columns[0])
-                    st.plotly_chart(fig, use_container_width=True)
-    except Exception:
-        pass
+        try:
+            chart = build_chart(chart_data)
+        except Exception as e:
+            trace.set(chart_error=f"{type(e).__name__}: {e}")
+            st.caption(f"Chart unavailable: {type(e).__name__}: {e}")
+            return
+        if chart is None:
+            return
+        trace.set(chart_kind=chart['kind'], chart_points=chart['points'], chart_bytes=chart['bytes'])
+        st.subheader("📊 Visualization")
+        if chart['figure'] is not None:
+            st.plotly_chart(chart['figure'], use_container_width=True)
+        if chart['notes']:
+            st.caption("Chart: " + "; ".join(chart['notes']))
+
+def start_stream(chunks):
+    """
+    Consume a chunk generator on a background thread.
+
+    The model request starts immediately and overlaps with whatever the
+    script renders next; the returned queue yields chunks followed by None.
+    """
+    buffer = queue.Queue()
+
+    def pump():
+        try:
+            for chunk in chunks:
+                buffer.put(chunk)
+        finally:
+            buffer.put(None)
+
+    threading.Thread(target=pump, daemon=True).start()
+    return buffer
+
+def timed_chunks(chunks, trace):
+    """Pass chunks through, recording time to the first chunk and to the last."""
+    started = time.perf_counter()
+    first = True
+    for chunk in chunks:
+        if first:
+            trace.record('formatter_first_chunk', (time.perf_counter() - started) * 1000)
+            first = False
+        yield chunk
+    trace.record('formatter', (time.perf_counter() - started) * 1000)
+
+def render_stream(buffer, placeholder):
+    """Render queued chunks into a placeholder as they arrive and return the full text."""
+    text = ""
+    while True:
+        chunk = buffer.get()
+        if chunk is None:
+            break
+        text += chunk
+        placeholder.markdown(text + "▌")
+    text = text.strip()
+    placeholder.markdown(text)
+    return text
+
+def process_user_prompt(prompt, df, schema_docs, unique_values, query_model_client, response_model_client, model_name, temperature, chat_history, helpers=None, answer_cache=None, data_version=None, code_cache=None, executor=None, retriever=None, planner=None, tracer=None, turn=None, result_store=None):
+    """
+    Answer one chat prompt and render it.
+
+    When a utils.tracing.TraceSink is passed as tracer, a trace with stage
+    timings, token counts, result size and answer source is written for the
+    request. When a dict is passed as turn, it is filled with the answer's
+    code, execution result and source (and, for fast-path answers, the
+    resolved entities, account and years) for the chat history state.
+    When a utils.result_store.ResultStore is passed, the execution result is
+    kept in it and its handle is added to turn; the formatter only receives
+    a bounded digest of the result.
+    """
+    turn = {} if turn is None else turn
+    trace = Trace(prompt, sink=tracer)
+    status = 'error'
+    try:
+        answer = _answer_prompt(prompt, df, schema_docs, unique_values, query_model_client, response_model_client, model_name, temperature, chat_history, helpers, answer_cache, data_version, code_cache, executor, retriever, planner, trace, turn, result_store)
+        status = 'error' if answer.startswith("Error generating") else 'ok'
+        return answer
+    finally:
+        trace.finish(status=status)
+
+def _answer_prompt(prompt, df, schema_docs, unique_values, query_model_client, response_model_client, model_name, temperature, chat_history, helpers, answer_cache, data_version, code_cache, executor, retriever, planner, trace, turn, result_store):
+    def keep(execution_result, code):
+        # Keep the result server-side so follow-ups can reference it
+        if result_store is None or not isinstance(execution_result, dict):
+            return None
+        handle = result_store.put(execution_result.get('result'), prompt, code, data_version)
+        turn['handle'] = handle
+        return handle
+
+    cache_key = None
+    if answer_cache is not None:
+        cache_key = AnswerCache.make_key(prompt, chat_history, data_version, model_name, temperature)
+        with trace.stage('cache_lookup'):
+            cached = answer_cache.get(cache_key)
+        if cached is not None:
+            trace.set(source='cache', **_result_size(cached['result']))
+            turn.update(source='cache', code=cached['code'], result=cached['result'])
+            keep(cached['result'], cached['code'])
+            with st.expander("🔍 View Generated Code", expanded=False):
+                st.code(cached['code'], language="python")
+            st.markdown(cached['answer'])
+            st.caption("⚡ Answer served from cache")
+            render_results(cached['result'], trace)
+            return cached['answer']
+
+    def execute(code, compiled=None):
+        with trace.stage('execution'):
+            if executor is not None:
+                return executor.execute(code, helpers)
+            # Estimated cost before and after the rewrite of slow patterns
+            optimization = {}
+            result = validate_and_execute_code(code, df, helpers, compiled=compiled, optimization=optimization)
+            if optimization:
+                trace.set(
+                    cost_before=optimization['cost_before'], cost_after=optimization['cost_after'],
+                    rewrites=optimization['rewrites'],
+                )
+            return result
+
+    # Common questions (totals, comparisons, growth, trends) are answered
+    # from the aggregate cube without calling the model.
+    with trace.stage('fast_path'):
+        plan = planner.plan(prompt) if planner is not None else None
+    if plan is not None:
+        execution_result = execute(plan['code'])
+        if isinstance(execution_result, dict) and isinstance(execution_result.get('result'), pd.DataFrame):
+            with st.expander("🔍 View Generated Code", expanded=False):
+                st.code(plan['code'], language="python")
+            answer = planner.describe(plan, execution_result['result'])
+            st.markdown(answer)
+            st.caption("⚡ Answered directly from the data (no model call)")
+            trace.set(source='fast_path', **_result_size(execution_result))
+            turn.update(
+                source='fast_path', code=plan['code'], result=execution_result,
+                entities=plan['entities'], account=plan['account'], years=plan['years']
+            )
+            keep(execution_result, plan['code'])
+            render_results(execution_result, trace)
+            return answer
+
+    execution_result = None
+    prompt_stats = {}
+    with trace.stage('template_match'):
+        template = code_cache.match(prompt, chat_history) if code_cache is not None else None
+    if template is not None:
+        generated_code, compiled = template
+        execution_result = execute(generated_code, compiled)
+        if not isinstance(execution_result, dict):
+            # The rewritten template failed; fall back to generating fresh code.
+            template = None
+    if template is None:
+        with trace.stage('code_generation'):
+            generated_code = generate_pandas_code(
+                query_model_client,
+                model_name,
+                schema_docs,
+                prompt,
+                unique_values["companies"],
+                unique_values["date_range"],
+                unique_values["accounts"],
+                temperature,
+                chat_history=chat_history,
+                retriever=retriever,
+                prompt_stats=prompt_stats
+            )
+        trace.set(
+            code_input_tokens=prompt_stats.get('input_tokens', prompt_stats.get('prompt_tokens')),
+            code_output_tokens=prompt_stats.get('output_tokens'),
+        )
+    # Show the code as soon as it exists, before running it
+    with st.expander("🔍 View Generated Code", expanded=False):
+        st.code(generated_code, language="python")
+        if 'saved_tokens' in prompt_stats:
+            saved_pct = prompt_stats['saved_tokens'] / prompt_stats['full_tokens']
+            st.caption(
+                f"Prompt ≈ {prompt_stats['prompt_tokens']:,} tokens "
+                f"(saved ≈ {prompt_stats['saved_tokens']:,}, {saved_pct:.0%} vs. full schema)"
+            )
+    trace.set(source='template' if template is not None else 'model')
+    if template is not None:
+        st.caption("⚡ Code reused from a cached template")
+    else:
+        execution_result = execute(generated_code)
+        if code_cache is not None and isinstance(execution_result, dict):
+            code_cache.store(prompt, chat_history, generated_code)
+    trace.set(**_result_size(execution_result))
+    turn.update(source='template' if template is not None else 'model', code=generated_code, result=execution_result)
+    # The formatter gets a bounded digest (shape, first rows, totals,
+    # extremes, changes) instead of the whole result as text
+    digest = formatter_input(execution_result, keep(execution_result, generated_code))
+    trace.set(digest_chars=len(str(digest)))
+
+    # Start the formatter request, render table and chart while it runs,
+    # then stream the narrative into the slot reserved above them.
+    narrative_placeholder = st.empty()
+    formatter_usage = {}
+    buffer = start_stream(timed_chunks(stream_results_as_natural_language(
+        response_model_client,
+        model_name,
+        digest,
+        prompt,
+        temperature,
+        chat_history=chat_history,
+        usage=formatter_usage
+    ), trace))
+    narrative_placeholder.markdown("_Writing answer..._")
+    render_results(execution_result, trace)
+    natural_language_response = render_stream(buffer, narrative_placeholder)
+    trace.set(
+        formatter_input_tokens=formatter_usage.get('input_tokens'),
+        formatter_output_tokens=formatter_usage.get('output_tokens'),
+    )
+
+    succeeded = (
+        isinstance(execution_result, dict)
+        and not generated_code.startswith("# Error")
+        and not natural_language_response.startswith("Error generating")
+    )
+    if cache_key is not None and succeeded:
+        with trace.stage('cache_store'):
+            answer_cache.put(cache_key, prompt, data_version, generated_code, execution_result, natural_language_response)
     return natural_language_response
@@ -0,0 +1,173 @@
+import ast
+import re
+import threading
+from collections import OrderedDict
+
+from utils.answer_cache import context_key
+from utils.data_loader import MONTHS
+
+_YEAR_PATTERN = r"(?:19|20)\d{2}"
+
+
+class CodeTemplateCache:
+    """
+    Cache of generated code keyed on the question with its literals removed.
+
+    "Total revenue for Total Retail Chile in 2023" and "... Total Sodimac Peru
+    in 2024" share the template "total revenue for <company> in <year>". When
+    a new question matches a stored template, the stored code is rewritten by
+    swapping the old literal constants for the new ones and re-executed
+    without calling the model. Rewritten code objects are compiled once and
+    kept in an LRU.
+    """
+
+    def __init__(self, companies=(), countries=(), accounts=(), max_entries=256):
+        self.max_entries = max_entries
+        self._templates = OrderedDict()
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._vocabulary = {}
+        for kind, values in (('company', companies), ('country', countries),
+                             ('account', accounts), ('month', MONTHS)):
+            for value in values:
+                self._vocabulary.setdefault(str(value).lower(), (kind, str(value)))
+        self._known_strings = {canonical for _, canonical in self._vocabulary.values()}
+        terms = sorted(self._vocabulary, key=len, reverse=True)
+        alternatives = [re.escape(t) for t in terms] + [_YEAR_PATTERN]
+        self._pattern = re.compile(r"(?<!\w)(" + "|".join(alternatives) + r")(?!\w)", re.IGNORECASE)
+
+    def extract_literals(self, question):
+        """
+        Find dimension values, month names and years in a question.
+
+        Returns:
+        tuple: (template text, [(kind, value), ...]) in order of appearance
+        """
+        literals = []
+
+        def replace(match):
+            text = match.group(0)
+            if re.fullmatch(_YEAR_PATTERN, text):
+                literals.append(('year', int(text)))
+                return "<year>"
+            kind, canonical = self._vocabulary[text.lower()]
+            literals.append((kind, canonical))
+            return f"<{kind}>"
+
+        template = self._pattern.sub(replace, question)
+        template = re.sub(r"\s+", " ", template.strip().lower()).rstrip(" ?!.")
+        return template, literals
+
+    def _key(self, question, chat_history):
+        template, literals = self.extract_literals(question)
+        kinds = tuple(kind for kind, _ in literals)
+        context = tuple(context_key(question, chat_history))
+        return (template, kinds, context), literals
+
+    def _rewrite(self, code, old_literals, new_literals):
+        """Swap literal constants in code; return None if any literal is unused."""
+        replacements = {}
+        for (_, old), (_, new) in zip(old_literals, new_literals):
+            if old in replacements and replacements[old] != new:
+                return None
+            replacements[old] = new
+
+        used = set()
+        known = self._known_strings
+
+        class Swap(ast.NodeTransformer):
+            def visit_Constant(self, node):
+                value = node.value
+                if isinstance(value, bool):
+                    return node
+                if value in replacements:
+                    used.add(value)
+                    return ast.copy_location(ast.Constant(replacements[value]), node)
+                if isinstance(value, str):
+                    # Country embedded in a company name, e.g. "Total Retail Chile"
+                    for old, new in replacements.items():
+                        if isinstance(old, str) and re.search(rf"\b{re.escape(old)}\b", value):
+                            candidate = re.sub(rf"\b{re.escape(old)}\b", str(new), value)
+                            if candidate in known:
+                                used.add(old)
+                                return ast.copy_location(ast.Constant(candidate), node)
+                return node
+
+        tree = Swap().visit(ast.parse(code))
+        if used != set(replacements):
+            return None
+        ast.fix_missing_locations(tree)
+        return ast.unparse(tree), compile(tree, "<generated>", "exec")
+
+    def match(self, question, chat_history=None):
+        """
+        Return rewritten code for a question matching a stored template.
+
+        Returns:
+        tuple: (source, code object), or None when no template applies
+        """
+        key, literals = self._key(question, chat_history)
+        with self._lock:
+            entry = self._templates.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._templates.move_to_end(key)
+            compiled_key = (key, tuple(value for _, value in literals))
+            compiled = self._compiled.get(compiled_key)
+            if compiled is not None:
+                self._compiled.move_to_end(compiled_key)
+                self.hits += 1
+                return compiled
+
+        code, old_literals = entry
+        compiled = self._rewrite(code, old_literals, literals)
+        with self._lock:
+            if compiled is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._compiled[compiled_key] = compiled
+            if len(self._compiled) > self.max_entries:
+                self._compiled.popitem(last=False)
+        return compiled
+
+    def store(self, question, chat_history, code):
+        """
+        Remember generated code for the question's template.
+
+        Only questions with at least one literal are stored, and only when
+        every literal appears as a constant in the code (otherwise swapping
+        parameters could not change the result).
+        """
+        key, literals = self._key(question, chat_history)
+        if not literals:
+            return False
+        try:
+            compiled = self._rewrite(code, literals, literals)
+        except SyntaxError:
+            return False
+        if compiled is None:
+            return False
+        with self._lock:
+            self._templates[key] = (code, literals)
+            self._templates.move_to_end(key)
+            if len(self._templates) > self.max_entries:
+                self._templates.popitem(last=False)
+            self._compiled[(key, tuple(value for _, value in literals))] = compiled
+            if len(self._compiled) > self.max_entries:
+                self._compiled.popitem(last=False)
+        return True
+
+    def stats(self):
+        """Return template hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'templates': len(self._templates),
+        }
@@ -0,0 +1,708 @@
+"""
+Static analysis and rewriting of generated pandas code.
+
+optimize_code parses the model's code and rewrites common performance
+anti-patterns before the code runs:
+
+- equality and isin filters on dimension columns of ``df``, such as
+  ``df[(df['Year'] == 2024) & (df['Account'] == account)]``, become
+  ``lookup(Year=2024, Account=account)`` calls on the prebuilt index;
+- a comparison on a ``df`` column that appears more than once in
+  straight-line top-level code is computed once into a mask variable,
+  which every occurrence then reuses;
+- ``iterrows`` loops that only add up a column (into a number, optionally
+  behind a comparison, or into a dict keyed by another column) become a
+  vectorized sum or groupby;
+- ``apply``/``map`` calls whose lambda is arithmetic or a comparison on
+  columns become the same expression on whole columns;
+- chained ``.copy()`` calls collapse into one, and under copy-on-write
+  copies of pandas objects become shallow (copy-on-write already keeps
+  them independent).
+
+A rewrite only fires when it keeps the result the same; anything else is
+left as written. estimate_cost gives a rough cost of the code, in row
+operations per row of ``df``, so the effect of the rewrite can be traced.
+"""
+import ast
+import threading
+from collections import OrderedDict
+
+from utils.data_index import INDEX_COLUMNS
+
+# Rough relative costs for estimate_cost
+PYTHON_ROW = 50.0           # Python-level work per row (iterrows, apply with a lambda)
+FILTER_SELECTIVITY = 0.01   # Share of rows an equality filter keeps
+
+# Methods returning the same kind of object (frame or series) as their receiver
+_SAME_KIND_METHODS = {
+    'copy', 'sort_values', 'sort_index', 'head', 'tail', 'dropna', 'fillna', 'rename', 'drop',
+    'astype', 'round', 'abs', 'drop_duplicates',
+}
+_FRAME_METHODS = {'query', 'assign', 'set_index', 'reset_index', 'filter', 'merge'}
+# Methods that make a full pass over their receiver
+_SCAN_METHODS = {
+    'sum', 'mean', 'median', 'min', 'max', 'count', 'std', 'agg', 'aggregate', 'groupby', 'pivot_table',
+    'sort_values', 'merge', 'nunique', 'unique', 'value_counts', 'drop_duplicates', 'query', 'cumsum',
+}
+_MASK_METHODS = {'isin', 'between', 'isna', 'notna', 'isnull', 'notnull'}
+_ARITHMETIC = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+_COMPARISONS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+# Statements whose body may run conditionally, repeatedly or under a handler
+_COMPOUND = (ast.If, ast.For, ast.AsyncFor, ast.While, ast.Try, ast.TryStar, ast.With, ast.AsyncWith, ast.Match)
+
+_OPTIMIZE_CACHE_SIZE = 256
+_optimize_cache = OrderedDict()
+_optimize_cache_lock = threading.Lock()
+
+
+def _root(node):
+    """Name at the root of an attribute/subscript/call chain, or None."""
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _names(node):
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+
+
+def _bindings(tree):
+    """Names bound anywhere in the code, mapped to the top-level statements binding them."""
+    bound = {}
+    for i, statement in enumerate(tree.body):
+        for node in ast.walk(statement):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+                bound.setdefault(node.id, []).append(i)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                bound.setdefault(node.name, []).append(i)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    bound.setdefault((alias.asname or alias.name).split('.')[0], []).append(i)
+    return bound
+
+
+def _mutates_df(tree, bound):
+    """
+    True if the code rebinds ``df``, modifies it in place or aliases it
+    (``data = df``), in which case writes through the alias reach df too.
+    """
+    if 'df' in bound:
+        return True
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign, ast.NamedExpr)) and node.value is not None:
+            values = node.value.elts if isinstance(node.value, (ast.Tuple, ast.List)) else [node.value]
+            if any(isinstance(v, ast.Name) and v.id == 'df' for v in values):
+                return True
+        if isinstance(node, (ast.Subscript, ast.Attribute)) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            if _root(node) == 'df':
+                return True
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and _root(node.func) == 'df':
+            if node.func.attr in ('insert', 'pop', 'update', '__setitem__', '__delitem__'):
+                return True
+            if any(k.arg == 'inplace' and not (isinstance(k.value, ast.Constant) and not k.value.value)
+                   for k in node.keywords):
+                return True
+    return False
+
+
+def _column_of(node, columns):
+    """(receiver, column) for ``X['col']`` or ``X.col`` with a known column, else None."""
+    if isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str):
+        return node.value, node.slice.value
+    if isinstance(node, ast.Attribute) and node.attr in columns:
+        return node.value, node.attr
+    return None
+
+
+def _df_column(node, columns):
+    """Column name for ``df['col']`` or ``df.col``, else None."""
+    found = _column_of(node, columns)
+    if found and isinstance(found[0], ast.Name) and found[0].id == 'df':
+        return found[1]
+    return None
+
+
+def _is_mask(node):
+    """Expressions that evaluate to a boolean Series when applied to a column."""
+    if isinstance(node, ast.Compare):
+        return True
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr, ast.BitXor)):
+        return True
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Invert):
+        return True
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        return node.func.attr in _MASK_METHODS
+    return isinstance(node, ast.Name) and node.id.startswith('_mask_')
+
+
+class _Shapes:
+    """
+    Minimal type inference: whether an expression is a DataFrame or a Series
+    derived from ``df`` (or a ``lookup`` result), and roughly how many of
+    df's rows it holds (as a share of len(df)).
+    """
+
+    def __init__(self, columns, env=None):
+        self.columns = columns
+        self.env = {'df': ('frame', 1.0)} if env is None else env
+
+    def shape(self, node):
+        """(kind, rows) with kind 'frame', 'series' or None."""
+        if isinstance(node, ast.Name):
+            return self.env.get(node.id, (None, 0.0))
+        if isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name) and node.func.id == 'lookup':
+                return 'frame', FILTER_SELECTIVITY
+            if isinstance(node.func, ast.Attribute):
+                kind, rows = self.shape(node.func.value)
+                method = node.func.attr
+                if kind and method in ('head', 'tail'):
+                    return kind, 0.0
+                if kind and method in _SAME_KIND_METHODS:
+                    return kind, rows
+                if kind == 'frame' and method in _FRAME_METHODS:
+                    return kind, rows * (FILTER_SELECTIVITY if method == 'query' else 1.0)
+            return None, 0.0
+        if isinstance(node, ast.Attribute):
+            kind, rows = self.shape(node.value)
+            if kind == 'frame' and node.attr in self.columns:
+                return 'series', rows
+            return None, 0.0
+        if isinstance(node, ast.Subscript):
+            base = node.value
+            located = isinstance(base, ast.Attribute) and base.attr in ('loc', 'iloc')
+            kind, rows = self.shape(base.value if located else base)
+            if kind is None:
+                return None, 0.0
+            selector, columns = node.slice, None
+            if located and isinstance(selector, ast.Tuple) and len(selector.elts) == 2:
+                selector, columns = selector.elts
+            if located and isinstance(selector, ast.Slice) and columns is not None:
+                selector = None
+            elif _is_mask(selector):
+                rows *= FILTER_SELECTIVITY
+            elif located or kind == 'series':
+                return None, 0.0
+            else:
+                columns, selector = selector, None
+            if columns is None:
+                return kind, rows
+            if kind == 'frame' and isinstance(columns, ast.Constant) and isinstance(columns.value, str):
+                return 'series', rows
+            if kind == 'frame' and isinstance(columns, ast.List):
+                return 'frame', rows
+            return None, 0.0
+        return None, 0.0
+
+    def kind(self, node):
+        return self.shape(node)[0]
+
+    def rows(self, node):
+        return self.shape(node)[1]
+
+
+def _stable_env(tree, bound, columns):
+    """Shapes of names bound exactly once at the top level (``df`` included when untouched)."""
+    shapes = _Shapes(columns, {} if 'df' in bound else None)
+    for statement in tree.body:
+        if isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+            target = statement.targets[0]
+            if isinstance(target, ast.Name) and len(bound.get(target.id, ())) == 1:
+                shape = shapes.shape(statement.value)
+                if shape[0]:
+                    shapes.env[target.id] = shape
+    return shapes
+
+
+def estimate_cost(tree, columns=()):
+    """
+    Rough cost of the code in row operations per row of ``df``.
+
+    Counts a full pass for every comparison, mask selection, deep copy and
+    scanning method (sum, groupby, ...) on df or a frame derived from it,
+    scaled by the rows it holds, and PYTHON_ROW per row for ``iterrows`` and
+    ``apply``/``map`` with a lambda. ``lookup`` costs the rows it returns.
+    Names are followed through assignments in statement order.
+
+    Parameters:
+    tree: Parsed code (ast.Module) or source
+    columns (iterable): Columns of df
+
+    Returns:
+    float: Estimated cost relative to len(df)
+    """
+    if isinstance(tree, str):
+        tree = ast.parse(tree)
+    shapes = _Shapes(set(columns))
+    cost = 0.0
+    for statement in tree.body:
+        for node in ast.walk(statement):
+            if isinstance(node, ast.Compare):
+                cost += max(shapes.rows(operand) for operand in [node.left] + node.comparators)
+            elif isinstance(node, ast.Subscript) and _is_mask(
+                node.slice.elts[0] if isinstance(node.slice, ast.Tuple) and node.slice.elts else node.slice
+            ):
+                base = node.value.value if isinstance(node.value, ast.Attribute) and node.value.attr in ('loc', 'iloc') else node.value
+                cost += shapes.rows(base)
+            elif isinstance(node, ast.Call):
+                if isinstance(node.func, ast.Name) and node.func.id == 'lookup':
+                    cost += FILTER_SELECTIVITY
+                if not isinstance(node.func, ast.Attribute):
+                    continue
+                method, rows = node.func.attr, shapes.rows(node.func.value)
+                if method in ('iterrows', 'itertuples'):
+                    cost += rows * PYTHON_ROW
+                elif method in ('apply', 'map', 'applymap') and any(isinstance(a, ast.Lambda) for a in node.args):
+                    cost += rows * PYTHON_ROW
+                elif method == 'copy':
+                    deep = next((k.value for k in node.keywords if k.arg == 'deep'), None)
+                    if not (isinstance(deep, ast.Constant) and deep.value is False):
+                        cost += rows
+                elif method in _SCAN_METHODS or method in _MASK_METHODS:
+                    cost += rows
+        if isinstance(statement, ast.Assign):
+            shape = shapes.shape(statement.value)
+            for target in statement.targets:
+                if isinstance(target, ast.Name):
+                    if shape[0]:
+                        shapes.env[target.id] = shape
+                    else:
+                        shapes.env.pop(target.id, None)
+    return cost
+
+
+class _ScopedTransformer(ast.NodeTransformer):
+    """Transformer that leaves function bodies, lambdas and comprehensions alone."""
+
+    def __init__(self):
+        self.rewrites = []
+
+    def _skip(self, node):
+        return node
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = visit_Lambda = _skip
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = _skip
+
+
+class _LookupRouter(_ScopedTransformer):
+    """``df[<equality filters>]`` and ``df.loc[<filters>, cols]`` -> ``lookup(...)``."""
+
+    def __init__(self, columns, indexed):
+        super().__init__()
+        self.columns = columns
+        self.indexed = indexed
+
+    def _terms(self, mask):
+        if isinstance(mask, ast.BinOp) and isinstance(mask.op, ast.BitAnd):
+            left, right = self._terms(mask.left), self._terms(mask.right)
+            if left is None or right is None or set(left) & set(right):
+                return None
+            return {**left, **right}
+        if isinstance(mask, ast.Compare) and len(mask.ops) == 1 and isinstance(mask.ops[0], ast.Eq):
+            pairs = [(mask.left, mask.comparators[0]), (mask.comparators[0], mask.left)]
+        elif (isinstance(mask, ast.Call) and isinstance(mask.func, ast.Attribute) and mask.func.attr == 'isin'
+              and len(mask.args) == 1 and not mask.keywords):
+            pairs = [(mask.func.value, mask.args[0])]
+        else:
+            return None
+        for column_node, value in pairs:
+            column = _df_column(column_node, self.columns)
+            if column in self.indexed and 'df' not in _names(value):
+                return {column: value}
+        return None
+
+    def _lookup(self, mask):
+        terms = self._terms(mask)
+        if not terms:
+            return None
+        self.rewrites.append(f"filter on {', '.join(terms)} routed to lookup()")
+        return ast.Call(
+            func=ast.Name(id='lookup', ctx=ast.Load()), args=[],
+            keywords=[ast.keyword(arg=column, value=value) for column, value in terms.items()]
+        )
+
+    def visit_Subscript(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.ctx, ast.Load):
+            return node
+        base = node.value
+        if isinstance(base, ast.Name) and base.id == 'df':
+            return self._lookup(node.slice) or node
+        if isinstance(base, ast.Attribute) and base.attr == 'loc' and isinstance(base.value, ast.Name) and base.value.id == 'df':
+            selector, columns = node.slice, None
+            if isinstance(selector, ast.Tuple):
+                if len(selector.elts) != 2 or isinstance(selector.elts[1], ast.Slice):
+                    return node
+                selector, columns = selector.elts
+            call = self._lookup(selector)
+            if call is None:
+                return node
+            return call if columns is None else ast.Subscript(value=call, slice=columns, ctx=ast.Load())
+        return node
+
+
+class _MaskCollector(ast.NodeVisitor):
+    """
+    Comparisons on df columns outside nested scopes and conditional
+    expressions, grouped by their source.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.statement = 0
+        self.groups = OrderedDict()
+
+    def _skip(self, node):
+        pass
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = visit_Lambda = _skip
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = _skip
+    visit_IfExp = visit_BoolOp = _skip
+
+    def _is_term(self, node):
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and isinstance(node.ops[0], _COMPARISONS):
+            return _df_column(node.left, self.columns) is not None and 'df' not in _names(node.comparators[0])
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in _MASK_METHODS
+                and _df_column(node.func.value, self.columns) is not None):
+            return not any('df' in _names(a) for a in node.args + [k.value for k in node.keywords])
+        return False
+
+    def visit(self, node):
+        if isinstance(node, ast.expr) and self._is_term(node):
+            self.groups.setdefault(ast.dump(node), []).append((self.statement, node))
+            return
+        super().visit(node)
+
+
+class _Replacer(ast.NodeTransformer):
+    def __init__(self, replacements):
+        self.replacements = replacements
+
+    def visit(self, node):
+        name = self.replacements.get(id(node))
+        if name is not None:
+            return ast.Name(id=name, ctx=ast.Load())
+        return super().visit(node)
+
+
+def _hoist_masks(tree, bound, columns):
+    """
+    Compute comparisons on df columns that appear more than once a single time.
+
+    Only straight-line top-level statements are considered: a comparison
+    inside an if, try, loop or with block may be guarded by it (a column
+    check, an exception handler), so moving it out could raise where the
+    original code did not.
+    """
+    collector = _MaskCollector(columns)
+    for i, statement in enumerate(tree.body):
+        if isinstance(statement, _COMPOUND):
+            continue
+        collector.statement = i
+        collector.visit(statement)
+
+    replacements, inserts, rewrites = {}, [], []
+    used = _names(tree)
+    counter = 0
+    for occurrences in collector.groups.values():
+        if len(occurrences) < 2:
+            continue
+        first, term = occurrences[0]
+        # Every name the comparison reads must already hold its final value
+        if any(len(bound.get(n, ())) > 1 or bound.get(n, [-1])[0] >= first for n in _names(term) - {'df'} if n in bound):
+            continue
+        counter += 1
+        while f"_mask_{counter}" in used:
+            counter += 1
+        name = f"_mask_{counter}"
+        inserts.append((first, ast.Assign(targets=[ast.Name(id=name, ctx=ast.Store())], value=term)))
+        for _, node in occurrences:
+            replacements[id(node)] = name
+        rewrites.append(f"{ast.unparse(term)} computed once for {len(occurrences)} uses")
+    if not replacements:
+        return tree, []
+    # Replace inside the statements first, so the hoisted terms themselves stay intact
+    tree.body = [_Replacer(replacements).visit(statement) for statement in tree.body]
+    for position, assignment in sorted(inserts, key=lambda item: item[0], reverse=True):
+        tree.body.insert(position, assignment)
+    return tree, rewrites
+
+
+class _LoopRewriter(_ScopedTransformer):
+    """``for _, row in X.iterrows()`` loops that only add up a column -> sum / groupby."""
+
+    def __init__(self, tree):
+        super().__init__()
+        self.tree = tree
+        self.taken = _names(tree)
+
+    def _used_outside_loops(self, name):
+        """True if `name` appears anywhere but inside for loops that bind it (such as this one)."""
+        loops = [
+            loop for loop in ast.walk(self.tree)
+            if isinstance(loop, ast.For) and name in _names(loop.target)
+        ]
+        inside = {id(n) for loop in loops for n in ast.walk(loop)}
+        return any(isinstance(n, ast.Name) and n.id == name and id(n) not in inside for n in ast.walk(self.tree))
+
+    def _row_column(self, node, row):
+        if (isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == row
+                and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str)):
+            return node.slice.value
+        return None
+
+    def _accumulation(self, statement, row):
+        """(accumulator, column) for ``acc += row['col']`` or ``acc = acc + row['col']``."""
+        if (isinstance(statement, ast.AugAssign) and isinstance(statement.op, ast.Add)
+                and isinstance(statement.target, ast.Name)):
+            column = self._row_column(statement.value, row)
+            return (statement.target.id, column) if column else None
+        if (isinstance(statement, ast.Assign) and len(statement.targets) == 1
+                and isinstance(statement.targets[0], ast.Name) and isinstance(statement.value, ast.BinOp)
+                and isinstance(statement.value.op, ast.Add) and isinstance(statement.value.left, ast.Name)
+                and statement.value.left.id == statement.targets[0].id):
+            column = self._row_column(statement.value.right, row)
+            return (statement.targets[0].id, column) if column else None
+        return None
+
+    def _fresh(self, base):
+        name, i = base, 1
+        while name in self.taken:
+            i += 1
+            name = f"{base}_{i}"
+        self.taken.add(name)
+        return name
+
+    def visit_For(self, node):
+        self.generic_visit(node)
+        iterator = node.iter
+        if not (isinstance(iterator, ast.Call) and isinstance(iterator.func, ast.Attribute)
+                and iterator.func.attr == 'iterrows' and not iterator.args and not iterator.keywords
+                and isinstance(node.target, ast.Tuple) and len(node.target.elts) == 2
+                and all(isinstance(e, ast.Name) for e in node.target.elts)
+                and len(node.body) == 1 and not node.orelse):
+            return node
+        index, row = (e.id for e in node.target.elts)
+        # The loop variables must not be read after the loop
+        if any(self._used_outside_loops(name) for name in (index, row)):
+            return node
+        frame = ast.unparse(iterator.func.value)
+        statement = node.body[0]
+
+        accumulation = self._accumulation(statement, row)
+        if accumulation:
+            accumulator, column = accumulation
+            self.rewrites.append(f"iterrows sum of {column!r} vectorized")
+            return ast.parse(f"{accumulator} += ({frame})[{column!r}].sum(skipna=False)").body[0]
+
+        if (isinstance(statement, ast.If) and not statement.orelse and len(statement.body) == 1
+                and isinstance(iterator.func.value, ast.Name)
+                and isinstance(statement.test, ast.Compare) and len(statement.test.ops) == 1
+                and isinstance(statement.test.ops[0], _COMPARISONS)):
+            test_column = self._row_column(statement.test.left, row)
+            value = statement.test.comparators[0]
+            accumulation = self._accumulation(statement.body[0], row)
+            if test_column and accumulation and not _names(value) & {index, row, accumulation[0]}:
+                accumulator, column = accumulation
+                condition = ast.unparse(ast.Compare(
+                    left=ast.parse(f"{frame}[{test_column!r}]", mode='eval').body,
+                    ops=statement.test.ops, comparators=[value]
+                ))
+                self.rewrites.append(f"iterrows conditional sum of {column!r} vectorized")
+                return ast.parse(f"{accumulator} += {frame}.loc[{condition}, {column!r}].sum(skipna=False)").body[0]
+
+        # totals[row['key']] = totals.get(row['key'], 0) + row['value']
+        if (isinstance(statement, ast.Assign) and len(statement.targets) == 1
+                and isinstance(statement.targets[0], ast.Subscript) and isinstance(statement.targets[0].value, ast.Name)
+                and isinstance(statement.value, ast.BinOp) and isinstance(statement.value.op, ast.Add)):
+            target = statement.targets[0]
+            totals = target.value.id
+            key = self._row_column(target.slice, row)
+            get = statement.value.left
+            column = self._row_column(statement.value.right, row)
+            if (key and column and isinstance(get, ast.Call) and isinstance(get.func, ast.Attribute)
+                    and get.func.attr == 'get' and isinstance(get.func.value, ast.Name) and get.func.value.id == totals
+                    and len(get.args) == 2 and not get.keywords and self._row_column(get.args[0], row) == key
+                    and not _names(get.args[1]) & {index, row}):
+                default = ast.unparse(get.args[1])
+                group, total = self._fresh('_key'), self._fresh('_total')
+                self.rewrites.append(f"iterrows totals of {column!r} by {key!r} vectorized")
+                return ast.parse(
+                    f"for {group}, {total} in ({frame}).groupby({key!r}, sort=False, dropna=False, observed=True)"
+                    f"[{column!r}].agg(lambda s: s.sum(skipna=False)).items():\n"
+                    f"    {totals}[{group}] = {totals}.get({group}, {default}) + {total}"
+                ).body[0]
+        return node
+
+
+class _ApplyRewriter(_ScopedTransformer):
+    """``apply``/``map`` with an arithmetic or comparison lambda -> column expression."""
+
+    def __init__(self, shapes):
+        super().__init__()
+        self.shapes = shapes
+
+    def _vectorize(self, node, parameter, receiver, by_row):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str)) and not isinstance(node.value, bool):
+            return node
+        if isinstance(node, ast.BinOp) and isinstance(node.op, _ARITHMETIC):
+            left = self._vectorize(node.left, parameter, receiver, by_row)
+            right = self._vectorize(node.right, parameter, receiver, by_row)
+            return ast.BinOp(left=left, op=node.op, right=right) if left and right else None
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = self._vectorize(node.operand, parameter, receiver, by_row)
+            return ast.UnaryOp(op=node.op, operand=operand) if operand else None
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and isinstance(node.ops[0], _COMPARISONS):
+            left = self._vectorize(node.left, parameter, receiver, by_row)
+            right = self._vectorize(node.comparators[0], parameter, receiver, by_row)
+            return ast.Compare(left=left, ops=node.ops, comparators=[right]) if left and right else None
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'abs'
+                and len(node.args) == 1 and not node.keywords):
+            argument = self._vectorize(node.args[0], parameter, receiver, by_row)
+            return ast.Call(func=node.func, args=[argument], keywords=[]) if argument else None
+        if by_row and (isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == parameter
+                       and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str)):
+            return ast.Subscript(value=receiver, slice=node.slice, ctx=ast.Load())
+        if not by_row and isinstance(node, ast.Name) and node.id == parameter:
+            return receiver
+        return None
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = node.func
+        if not (isinstance(func, ast.Attribute) and func.attr in ('apply', 'map') and len(node.args) == 1
+                and isinstance(node.args[0], ast.Lambda)):
+            return node
+        function = node.args[0]
+        arguments = function.args
+        if (len(arguments.args) != 1 or arguments.vararg or arguments.kwarg or arguments.kwonlyargs
+                or arguments.defaults or arguments.posonlyargs):
+            return node
+        parameter = arguments.args[0].arg
+        receiver = func.value
+        kind = self.shapes.kind(receiver)
+        axis = {k.arg: k.value for k in node.keywords}
+        if func.attr == 'apply' and list(axis) == ['axis']:
+            by_row = isinstance(axis['axis'], ast.Constant) and axis['axis'].value in (1, 'columns')
+            if not by_row or kind != 'frame' or not isinstance(receiver, ast.Name):
+                return node
+        elif not axis and kind == 'series' and (
+                isinstance(receiver, ast.Name)
+                or (isinstance(receiver, ast.Subscript) and isinstance(receiver.value, ast.Name))):
+            by_row = False
+        else:
+            return node
+        if parameter not in _names(function.body):
+            return node
+        vectorized = self._vectorize(function.body, parameter, receiver, by_row)
+        if vectorized is None:
+            return node
+        self.rewrites.append(f"{func.attr} with a lambda vectorized")
+        return vectorized
+
+
+def _is_deep(keywords):
+    """True for the keywords of a ``copy()`` call that is certainly deep (none, or ``deep=True``)."""
+    deep = {k.arg: k.value for k in keywords}
+    return set(deep) <= {'deep'} and (
+        not deep or (isinstance(deep['deep'], ast.Constant) and deep['deep'].value is True)
+    )
+
+
+class _CopyRewriter(_ScopedTransformer):
+    """Collapse ``.copy().copy()``; make copies of pandas objects shallow under copy-on-write."""
+
+    def __init__(self, shapes, copy_on_write):
+        super().__init__()
+        self.shapes = shapes
+        self.copy_on_write = copy_on_write
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = node.func
+        if not (isinstance(func, ast.Attribute) and func.attr == 'copy' and not node.args):
+            return node
+        inner = func.value
+        # x.copy(deep=False).copy() is a deep copy; only a deep inner copy may stand in for it
+        if (not node.keywords and isinstance(inner, ast.Call) and isinstance(inner.func, ast.Attribute)
+                and inner.func.attr == 'copy' and not inner.args and _is_deep(inner.keywords)):
+            self.rewrites.append("chained copy collapsed")
+            return inner
+        if self.copy_on_write and self.shapes.kind(func.value) and _is_deep(node.keywords):
+            self.rewrites.append("copy made shallow (copy-on-write)")
+            node.keywords = [ast.keyword(arg='deep', value=ast.Constant(value=False))]
+        return node
+
+
+def _optimize(code, columns, copy_on_write, use_lookup):
+    tree = ast.parse(code)
+    columns = set(columns)
+    cost_before = estimate_cost(tree, columns)
+    bound = _bindings(tree)
+    rewrites = []
+
+    if not _mutates_df(tree, bound):
+        if use_lookup and 'lookup' not in bound:
+            router = _LookupRouter(columns, set(INDEX_COLUMNS) & columns)
+            tree = router.visit(tree)
+            rewrites += router.rewrites
+        tree, hoisted = _hoist_masks(tree, bound, columns)
+        rewrites += hoisted
+
+    loops = _LoopRewriter(tree)
+    tree = loops.visit(tree)
+    rewrites += loops.rewrites
+
+    bound = _bindings(tree)
+    shapes = _stable_env(tree, bound, columns)
+    for rewriter in (_ApplyRewriter(shapes), _CopyRewriter(shapes, copy_on_write)):
+        tree = rewriter.visit(tree)
+        rewrites += rewriter.rewrites
+
+    if not rewrites:
+        return {'code': code, 'compiled': None, 'rewrites': [], 'cost_before': cost_before, 'cost_after': cost_before}
+    tree = ast.fix_missing_locations(tree)
+    optimized = ast.unparse(tree)
+    return {
+        'code': optimized,
+        'compiled': compile(tree, "<generated>", "exec"),
+        'rewrites': rewrites,
+        'cost_before': cost_before,
+        'cost_after': estimate_cost(tree, columns),
+    }
+
+
+def optimize_code(code, columns=(), copy_on_write=False, use_lookup=True):
+    """
+    Rewrite generated pandas code into a cheaper equivalent.
+
+    Results are memoized on the code and its parameters.
+
+    Parameters:
+    code (str): Generated code
+    columns (iterable): Columns of df; filters and masks are only rewritten
+        for columns that exist
+    copy_on_write (bool): Whether pandas copy-on-write is enabled when the
+        code runs
+    use_lookup (bool): Whether a ``lookup`` helper over df is available
+
+    Returns:
+    dict: code (rewritten source), compiled (its code object, or None if
+    nothing was rewritten), rewrites (descriptions), and cost_before and
+    cost_after (see estimate_cost)
+    """
+    key = (code, tuple(columns), copy_on_write, use_lookup)
+    with _optimize_cache_lock:
+        if key in _optimize_cache:
+            _optimize_cache.move_to_end(key)
+            return _optimize_cache[key]
+    try:
+        plan = _optimize(code, key[1], copy_on_write, use_lookup)
+    except SyntaxError:
+        # Executing the original code reports the error
+        plan = {'code': code, 'compiled': None, 'rewrites': [], 'cost_before': None, 'cost_after': None}
+    with _optimize_cache_lock:
+        _optimize_cache[key] = plan
+        while len(_optimize_cache) > _OPTIMIZE_CACHE_SIZE:
+            _optimize_cache.popitem(last=False)
+    return plan
@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Dimensions with a posting list (value -> row positions)
+INDEX_COLUMNS = ['CompanyName', 'Account', 'Scenario', 'Currency', 'Year', 'Month', 'Country', 'Sheet']
+
+# Composite key hashed directly to its row positions; a query fixing all of
+# these is answered with a single dict lookup before any intersection.
+KEY_COLUMNS = ['CompanyName', 'Account', 'Scenario', 'Currency', 'Year']
+
+_EMPTY = np.empty(0, dtype=np.intp)
+
+
+def _as_values(value):
+    """Normalize a filter value to a tuple of candidate values."""
+    if isinstance(value, (list, tuple, set, frozenset, pd.Index, pd.Series, np.ndarray,
+                          pd.api.extensions.ExtensionArray)):
+        return tuple(value)
+    return (value,)
+
+
+class DimensionIndex:
+    """
+    Row-position index over the melted financial frame.
+
+    Built once per dataset. Each filter costs a hash lookup plus an
+    intersection of sorted position arrays instead of a boolean mask over
+    every row.
+    """
+
+    def __init__(self, df, columns=None, cache_size=256):
+        self.df = df
+        self.columns = [c for c in (columns or INDEX_COLUMNS) if c in df.columns]
+        self._postings = {
+            column: df.groupby(column, observed=True, sort=False).indices
+            for column in self.columns
+        }
+        self._key_columns = [c for c in KEY_COLUMNS if c in self.columns]
+        self._groups = df.groupby(self._key_columns, observed=True, sort=False).indices
+        # Shared across sessions and API threads, so the LRU is guarded
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+
+    def _union(self, column, values):
+        postings = self._postings[column]
+        arrays = [postings[v] for v in values if v in postings]
+        if not arrays:
+            return _EMPTY
+        if len(arrays) == 1:
+            return arrays[0]
+        return np.unique(np.concatenate(arrays))
+
+    def positions(self, **filters):
+        """
+        Return the sorted row positions matching every filter.
+
+        Parameters:
+        **filters: Column name mapped to a value or list of accepted values
+
+        Returns:
+        np.ndarray: Positions into the indexed DataFrame
+        """
+        normalized = {column: _as_values(value) for column, value in filters.items()}
+        cache_key = tuple(sorted(normalized.items()))
+        try:
+            with self._cache_lock:
+                cached = self._cache.get(cache_key)
+                if cached is not None:
+                    self._cache.move_to_end(cache_key)
+        except TypeError:
+            cache_key, cached = None, None
+        if cached is not None:
+            return cached
+
+        unknown = [c for c in normalized if c not in self._postings]
+        if unknown:
+            raise KeyError(f"Cannot lookup on non-dimension column(s): {', '.join(unknown)}")
+
+        candidates = []
+        remaining = dict(normalized)
+        if self._key_columns and all(
+            c in normalized and len(normalized[c]) == 1 for c in self._key_columns
+        ):
+            key = tuple(normalized[c][0] for c in self._key_columns)
+            candidates.append(self._groups.get(key, _EMPTY))
+            for c in self._key_columns:
+                remaining.pop(c)
+        candidates.extend(self._union(c, values) for c, values in remaining.items())
+
+        if not candidates:
+            result = np.arange(len(self.df))
+        else:
+            candidates.sort(key=len)
+            result = candidates[0]
+            for other in candidates[1:]:
+                if not len(result):
+                    break
+                result = np.intersect1d(result, other, assume_unique=True)
+
+        if cache_key is not None:
+            with self._cache_lock:
+                self._cache[cache_key] = result
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def lookup(self, **filters):
+        """
+        Return the rows of the frame matching every filter.
+
+        Example: lookup(CompanyName=["Total Retail Chile", "Total Retail Peru"],
+        Account="Ingresos de Explotacion", Year=2025, Month="March")
+
+        Parameters:
+        **filters: Column name mapped to a value or list of accepted values
+
+        Returns:
+        pd.DataFrame: Matching rows, in original order
+        """
+        return self.df.iloc[self.positions(**filters)]
+
+
+def build_dimension_index(df):
+    """Build the DimensionIndex for a melted financial frame."""
+    return DimensionIndex(df)
@@ -1,8 +1,39 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
 import pandas as pd
 
-def load_financial_data(file_path='data/P&L_ChatBot.xlsx'):
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+DEFAULT_DATA_FILE = 'data/P&L_ChatBot.xlsx'
+
+# Materialized copies of the melted frame live next to the workbook so every
+# Streamlit worker on the host reads the same files.
+CACHE_DIR_ENV = 'FINANCIAL_DATA_CACHE_DIR'
+
+MONTHS = [
+    'January', 'February', 'March', 'April', 'May', 'June',
+    'July', 'August', 'September', 'October', 'November', 'December'
+]
+
+# Low-cardinality string columns that are dictionary-encoded in compact mode
+DIMENSION_COLUMNS = ['Country', 'Currency', 'CompanyName', 'Scenario', 'Account', 'Sheet']
+
+# Workbook layout: four sheets of 19 columns, data starting after two title rows
+SHEET_NAMES = ['USD_REAL', 'USD_PPTO', 'MONEDALOCAL_REAL', 'MONEDALOCAL_PPTO']
+ID_COLUMNS = ['Year', 'Country', 'Currency', 'CompanyName', 'Scenario', 'Account']
+WORKBOOK_COLUMNS = ID_COLUMNS + MONTHS + ['FullYear']
+
+
+def _read_workbook(file_path):
     """
-    Load financial data from Excel file and transform it into a queryable format.
+    Parse the Excel workbook and melt every sheet into long format.
 
     Parameters:
     file_path (str): Path to the Excel file
@@ -11,14 +42,10 @@ def load_financial_data(file_path='data/P&L_ChatBot.xlsx'):
     pd.DataFrame: Transformed financial data with all sheets combined
     """
     # Define the column names
-    column_names = [
-        'Year', 'Country', 'Currency', 'CompanyName', 'Scenario', 'Account',
-        'January', 'February', 'March', 'April', 'May', 'June',
-        'July', 'August', 'September', 'October', 'November', 'December', 'FullYear'
-    ]
+    column_names = WORKBOOK_COLUMNS
 
     # Define sheet names
-    sheet_names = ['USD_REAL', 'USD_PPTO', 'MONEDALOCAL_REAL', 'MONEDALOCAL_PPTO']
+    sheet_names = SHEET_NAMES
 
     # List to store processed dataframes
     dataframes = []
@@ -59,7 +86,474 @@ def load_financial_data(file_path='data/P&L_ChatBot.xlsx'):
 
     return combined_df
 
-# Example usage
+
+def _iter_sheet_chunks(file_path, sheet_name, chunk_rows):
+    """
+    Yield a sheet as wide DataFrames of at most chunk_rows rows.
+
+    file_path is either the Excel workbook, read row by row with openpyxl in
+    read-only mode, or a directory holding one ``<sheet>.parquet`` file per
+    sheet (see utils/synthetic_data.py), read one record batch at a time.
+    """
+    if os.path.isdir(file_path):
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(os.path.join(file_path, f"{sheet_name}.parquet"))
+        for batch in parquet.iter_batches(batch_size=chunk_rows):
+            chunk = batch.to_pandas()
+            chunk.columns = WORKBOOK_COLUMNS
+            yield chunk
+        return
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        # Like read_excel(skiprows=2) in _read_workbook: rows 1-2 are titles,
+        # row 3 is taken as the header and blank rows are skipped.
+        rows = workbook[sheet_name].iter_rows(min_row=4, max_col=len(WORKBOOK_COLUMNS), values_only=True)
+        batch = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            batch.append(row)
+            if len(batch) >= chunk_rows:
+                yield pd.DataFrame(batch, columns=WORKBOOK_COLUMNS)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=WORKBOOK_COLUMNS)
+    finally:
+        workbook.close()
+
+
+def _part_codes(part):
+    return part.cat.codes.to_numpy() if isinstance(part, pd.Series) else part.codes
+
+
+def _concat_compact(parts):
+    """
+    Concatenate compact frames (or dicts of compact columns) in order.
+
+    Categorical dimensions are unioned with sorted categories, the same
+    categories compact_financial_data would produce for the combined data.
+    """
+    from pandas.api.types import union_categoricals
+
+    month_dtype = pd.CategoricalDtype(MONTHS, ordered=True)
+    columns = {}
+    for column in ['Year', 'Country', 'Currency', 'CompanyName', 'Scenario', 'Account', 'Sheet', 'Month', 'Value']:
+        values = [part[column] for part in parts]
+        if column in DIMENSION_COLUMNS:
+            columns[column] = union_categoricals(values, sort_categories=True) if values else pd.Categorical([])
+        elif column == 'Month':
+            codes = np.concatenate([_part_codes(v) for v in values]) if values else np.array([], dtype='int8')
+            columns[column] = pd.Categorical.from_codes(codes, dtype=month_dtype)
+        else:
+            columns[column] = np.concatenate([np.asarray(v) for v in values]) if values else np.array([])
+    return pd.DataFrame(columns)
+
+
+def _read_workbook_chunked(file_path, chunk_rows=50000, sheet_names=None):
+    """
+    Parse and melt the workbook incrementally into the compact layout.
+
+    Each chunk of wide rows is converted to compact columns straight away
+    and split into one piece per month; the pieces are concatenated once at
+    the end in the same order as _read_workbook (sheet, then month, then
+    row). Only the current wide chunk and the compact pieces are held in
+    memory, never the whole wide sheet or an object-dtype melted frame.
+
+    Parameters:
+    file_path (str): Excel workbook, or a directory of per-sheet Parquet files
+    chunk_rows (int): Wide rows parsed per chunk
+    sheet_names (list): Only parse these sheets (default: all of SHEET_NAMES)
+
+    Returns:
+    pd.DataFrame: Same frame as compact_financial_data(_read_workbook(...))
+    """
+    month_dtype = pd.CategoricalDtype(MONTHS, ordered=True)
+    pieces = []
+    for sheet_name in sheet_names or SHEET_NAMES:
+        by_month = [[] for _ in MONTHS]
+        for chunk in _iter_sheet_chunks(file_path, sheet_name, chunk_rows):
+            ids = {'Year': chunk['Year'].astype('int16').to_numpy()}
+            for column in ID_COLUMNS[1:]:
+                ids[column] = pd.Categorical(chunk[column])
+            ids['Sheet'] = pd.Categorical.from_codes(np.zeros(len(chunk), dtype='int8'), [sheet_name])
+            for i, month in enumerate(MONTHS):
+                by_month[i].append({
+                    **ids,
+                    'Month': pd.Categorical.from_codes(np.full(len(chunk), i, dtype='int8'), dtype=month_dtype),
+                    'Value': pd.to_numeric(chunk[month]).astype('float64').to_numpy(),
+                })
+        for month_pieces in by_month:
+            pieces.extend(month_pieces)
+    return _concat_compact(pieces)
+
+
+def sheet_signatures(file_path):
+    """
+    Return a cheap content signature for every sheet.
+
+    For a workbook these come from the zip directory (the CRC of each
+    sheet's XML part, combined with the shared strings table that sheets
+    refer to), so no cell is parsed. For a Parquet directory each sheet
+    file is hashed.
+
+    Returns:
+    dict: {sheet name: signature string}
+    """
+    if os.path.isdir(file_path):
+        return {
+            sheet: _file_sha256(os.path.join(file_path, f"{sheet}.parquet"))
+            for sheet in SHEET_NAMES
+        }
+
+    import zipfile
+    import xml.etree.ElementTree as ET
+
+    main_ns = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+    rel_ns = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+    with zipfile.ZipFile(file_path) as archive:
+        crcs = {info.filename: info.CRC for info in archive.infolist()}
+        targets = {
+            rel.get('Id'): rel.get('Target').lstrip('/')
+            for rel in ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+        }
+        sheets = ET.fromstring(archive.read('xl/workbook.xml')).iter(f"{main_ns}sheet")
+        shared = crcs.get('xl/sharedStrings.xml', 0)
+        signatures = {}
+        for sheet in sheets:
+            target = targets.get(sheet.get(f"{rel_ns}id"), '')
+            member = target if target.startswith('xl/') else f"xl/{target}"
+            signatures[sheet.get('name')] = f"{crcs.get(member, 0):08x}-{shared:08x}"
+    return signatures
+
+
+def compact_financial_data(df):
+    """
+    Convert the melted frame to its compact layout.
+
+    String dimensions become categoricals, Month becomes an ordered
+    categorical (January..December), Year becomes int16 and Value float64.
+    Equality and isin filters then compare small integer codes instead of
+    Python strings.
+
+    Parameters:
+    df (pd.DataFrame): Melted financial data
+
+    Returns:
+    pd.DataFrame: Compact copy of the data
+    """
+    compact = df.copy()
+    for column in DIMENSION_COLUMNS:
+        compact[column] = compact[column].astype('category')
+    compact['Month'] = pd.Categorical(compact['Month'], categories=MONTHS, ordered=True)
+    compact['Year'] = compact['Year'].astype('int16')
+    compact['Value'] = compact['Value'].astype('float64')
+    return compact
+
+
+def expand_financial_data(df):
+    """
+    Convert a compact frame back to the original object/int64 layout.
+
+    Parameters:
+    df (pd.DataFrame): Compact financial data
+
+    Returns:
+    pd.DataFrame: Data with plain string dimensions
+    """
+    expanded = df.copy()
+    for column in DIMENSION_COLUMNS + ['Month']:
+        expanded[column] = expanded[column].astype(object)
+    expanded['Year'] = expanded['Year'].astype('int64')
+    return expanded
+
+
+def _cache_dir_for(file_path, cache_dir=None):
+    """Return the directory holding the materialized cache for a workbook."""
+    if cache_dir:
+        return cache_dir
+    if os.getenv(CACHE_DIR_ENV):
+        return os.getenv(CACHE_DIR_ENV)
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), '.cache')
+
+
+def _source_files(file_path):
+    """The workbook itself, or the files of a per-sheet Parquet directory."""
+    if os.path.isdir(file_path):
+        return [os.path.join(file_path, name) for name in sorted(os.listdir(file_path))
+                if not name.startswith('.')]
+    return [file_path]
+
+
+def _file_sha256(file_path):
+    """Hash the workbook contents (or every file of a directory) in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    for path in _source_files(file_path):
+        if path != file_path:
+            digest.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _stat_signature(file_path):
+    """Return (mtime_ns, size) for a workbook, or the latest/total over a directory."""
+    stats = [os.stat(path) for path in _source_files(file_path)]
+    return max((st.st_mtime_ns for st in stats), default=0), sum(st.st_size for st in stats)
+
+
+def _atomic_write_text(path, text):
+    """Write a small text file so readers never observe a partial write."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def get_data_version(file_path=DEFAULT_DATA_FILE, cache_dir=None):
+    """
+    Return the content hash identifying the current version of the workbook.
+
+    The hash is recorded in a manifest next to the cache together with the
+    file's mtime and size, so the workbook is only re-hashed when either of
+    those change.
+
+    Parameters:
+    file_path (str): Path to the Excel file
+    cache_dir (str): Optional override for the cache directory
+
+    Returns:
+    str: Hex SHA-256 digest of the workbook
+    """
+    mtime_ns, size = _stat_signature(file_path)
+    directory = _cache_dir_for(file_path, cache_dir)
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    manifest_path = os.path.join(directory, f"{stem}.manifest.json")
+
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('mtime_ns') == mtime_ns and manifest.get('size') == size:
+            return manifest['sha256']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    sha256 = _file_sha256(file_path)
+    _atomic_write_text(manifest_path, json.dumps({
+        'mtime_ns': mtime_ns,
+        'size': size,
+        'sha256': sha256,
+    }))
+    return sha256
+
+
+def _cache_path(file_path, version, cache_dir=None):
+    """Return the Feather file for a given workbook version."""
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(_cache_dir_for(file_path, cache_dir), f"{stem}-{version[:16]}.compact.feather")
+
+
+def _remove_stale_caches(file_path, keep_path, cache_dir=None):
+    """Delete Feather files left behind by previous workbook versions."""
+    directory = _cache_dir_for(file_path, cache_dir)
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith(f"{stem}-") and name.endswith('.feather') and path != keep_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _write_cache(df, path):
+    """Write the melted frame to Feather via a temp file and atomic rename."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.feather.tmp')
+    os.close(fd)
+    try:
+        # Uncompressed, single record batch: columns can be memory-mapped
+        # and viewed without copying (see _map_feather).
+        df.to_feather(tmp_path, compression='uncompressed', chunksize=max(len(df), 1))
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _map_feather(path):
+    """
+    Memory-map a Feather cache file as a read-only, zero-copy DataFrame.
+
+    Numeric columns and categorical codes are numpy views over the mapped
+    file, so every process mapping it shares the same physical pages. Writes
+    require pandas copy-on-write (``mode.copy_on_write``), which copies a
+    column the first time it is modified.
+    """
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    table = feather.read_table(path, memory_map=True)
+    columns = {}
+    for name in table.column_names:
+        chunked = table.column(name)
+        array = chunked.chunk(0) if chunked.num_chunks == 1 else chunked.combine_chunks()
+        if pa.types.is_dictionary(array.type):
+            columns[name] = pd.Categorical.from_codes(
+                array.indices.to_numpy(zero_copy_only=False),
+                categories=array.dictionary.to_pylist(),
+                ordered=array.type.ordered,
+                validate=False
+            )
+        else:
+            columns[name] = array.to_numpy(zero_copy_only=False)
+    return pd.DataFrame(columns, copy=False)
+
+
+def _read_cache(path, memory_map=False):
+    """Read a Feather cache file, optionally as a memory-mapped view."""
+    return _map_feather(path) if memory_map else pd.read_feather(path)
+
+
+def _parse_workbook(file_path, chunk_rows=None):
+    """Parse the source into the compact frame, chunked when requested."""
+    if chunk_rows or os.path.isdir(file_path):
+        return _read_workbook_chunked(file_path, chunk_rows or 50000)
+    return compact_financial_data(_read_workbook(file_path))
+
+
+def load_financial_data(file_path=DEFAULT_DATA_FILE, use_cache=True, cache_dir=None, compact=False,
+                        memory_map=False, chunk_rows=None):
+    """
+    Load financial data from Excel file and transform it into a queryable format.
+
+    The melted frame is materialized (in compact layout) as a Feather file
+    keyed on the workbook's content hash. Later loads (from any process on the
+    host) read that file instead of re-parsing the workbook; it is rebuilt
+    only when the workbook changes.
+
+    Parameters:
+    file_path (str): Path to the Excel file, or to a directory with one
+        ``<sheet>.parquet`` file per sheet (always read in chunks)
+    use_cache (bool): Read/write the on-disk Feather cache
+    cache_dir (str): Optional override for the cache directory
+    compact (bool): Return categorical dimensions and int16 Year
+        (see compact_financial_data)
+    memory_map (bool): Return a read-only, zero-copy view over the
+        memory-mapped cache file, shared by every process on the host
+        (implies compact; enable pandas copy-on-write before mutating it)
+    chunk_rows (int): Parse and melt the sheets incrementally, this many
+        wide rows at a time, to bound peak memory on large workbooks
+
+    Returns:
+    pd.DataFrame: Transformed financial data with all sheets combined
+    """
+    if use_cache and memory_map:
+        return _load_cached(file_path, cache_dir, memory_map=True, chunk_rows=chunk_rows)
+    if use_cache:
+        df = _load_cached(file_path, cache_dir, chunk_rows=chunk_rows)
+    else:
+        df = _parse_workbook(file_path, chunk_rows)
+    return df if compact else expand_financial_data(df)
+
+
+def _load_cached(file_path, cache_dir=None, memory_map=False, chunk_rows=None, build=None):
+    """
+    Return the compact frame from the Feather cache, building it if needed.
+
+    `build` is an optional callable returning the compact frame for the
+    current workbook; it defaults to parsing every sheet.
+    """
+    if build is None:
+        def build():
+            return _parse_workbook(file_path, chunk_rows)
+
+    try:
+        version = get_data_version(file_path, cache_dir)
+        path = _cache_path(file_path, version, cache_dir)
+    except OSError:
+        # Read-only or missing cache directory: fall back to parsing.
+        return build()
+
+    if os.path.exists(path):
+        try:
+            return _read_cache(path, memory_map)
+        except Exception:
+            pass
+
+    # Serialize rebuilds so concurrent workers parse the workbook only once.
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    lock_path = os.path.join(os.path.dirname(path), f"{stem}.lock")
+    with open(lock_path, 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(path):
+                try:
+                    return _read_cache(path, memory_map)
+                except Exception:
+                    pass
+            df = build()
+            try:
+                _write_cache(df, path)
+                _remove_stale_caches(file_path, path, cache_dir)
+                if memory_map:
+                    return _read_cache(path, memory_map=True)
+            except Exception:
+                # pyarrow missing or disk full: serve the parsed frame anyway.
+                pass
+            return df
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def refresh_financial_data(file_path=DEFAULT_DATA_FILE, previous_df=None, previous_signatures=None,
+                           cache_dir=None, chunk_rows=None):
+    """
+    Reload the workbook after a change, re-parsing only the sheets that changed.
+
+    Sheets whose signature (see sheet_signatures) is unchanged are sliced
+    out of `previous_df` instead of being parsed again; the combined frame
+    is written to the versioned Feather cache like a full load, so other
+    processes pick it up without parsing anything.
+
+    Parameters:
+    file_path (str): Path to the Excel file or Parquet directory
+    previous_df (pd.DataFrame): Compact frame of the previous version
+    previous_signatures (dict): sheet_signatures() of the previous version
+    cache_dir (str): Optional override for the cache directory
+    chunk_rows (int): Wide rows parsed per chunk for the changed sheets
+
+    Returns:
+    tuple: (memory-mapped compact frame, new signatures, list of changed sheets)
+    """
+    signatures = sheet_signatures(file_path)
+    if previous_df is None or not previous_signatures:
+        changed = list(SHEET_NAMES)
+    else:
+        changed = [sheet for sheet in SHEET_NAMES if signatures.get(sheet) != previous_signatures.get(sheet)]
+
+    def build():
+        if len(changed) == len(SHEET_NAMES):
+            return _parse_workbook(file_path, chunk_rows)
+        parsed = _read_workbook_chunked(file_path, chunk_rows or 50000, sheet_names=changed)
+        parts = []
+        for sheet in SHEET_NAMES:
+            source = parsed if sheet in changed else previous_df
+            parts.append(source[source['Sheet'] == sheet])
+        return _concat_compact(parts)
+
+    df = _load_cached(file_path, cache_dir, memory_map=True, chunk_rows=chunk_rows, build=build)
+    return df, signatures, changed
+
+# Example usage (run from the repository root: python -m utils.data_loader)
 if __name__ == "__main__":
     # Load the data
     financial_data = load_financial_data()
@@ -80,30 +574,34 @@ if __name__ == "__main__":
         "Total Retail Colombia",
     ]
 
+    # Build the dimension index once and reuse it for every slice
+    from utils.data_index import build_dimension_index
+    lookup = build_dimension_index(df).lookup
+
     # Filter data for the specified month and year
-    march_2025_data = df[
-        (df["Month"] == month_to_analyze)
-        & (df["Year"] == year_to_analyze)
-        & (df["CompanyName"].isin(falabella_retail_companies))
-        & (df["Account"] == "Ingresos de Explotacion") # Assuming "revenue" maps to "Ingresos de Explotacion"
-    ]
+    march_2025_data = lookup(
+        Month=month_to_analyze,
+        Year=year_to_analyze,
+        CompanyName=falabella_retail_companies,
+        Account="Ingresos de Explotacion",  # Assuming "revenue" maps to "Ingresos de Explotacion"
+    )
 
     # Filter data for the previous year (March 2024)
-    march_2024_data = df[
-        (df["Month"] == month_to_analyze)
-        & (df["Year"] == year_to_analyze - 1)
-        & (df["CompanyName"].isin(falabella_retail_companies))
-        & (df["Account"] == "Ingresos de Explotacion")
-    ]
+    march_2024_data = lookup(
+        Month=month_to_analyze,
+        Year=year_to_analyze - 1,
+        CompanyName=falabella_retail_companies,
+        Account="Ingresos de Explotacion",
+    )
 
     # Filter data for budget in March 2025
-    march_2025_budget_data = df[
-        (df["Month"] == month_to_analyze)
-        & (df["Year"] == year_to_analyze)
-        & (df["CompanyName"].isin(falabella_retail_companies))
-        & (df["Scenario"] == "Presupuesto")
-        & (df["Account"] == "Ingresos de Explotacion")
-    ]
+    march_2025_budget_data = lookup(
+        Month=month_to_analyze,
+        Year=year_to_analyze,
+        CompanyName=falabella_retail_companies,
+        Scenario="Presupuesto",
+        Account="Ingresos de Explotacion",
+    )
 
     # Aggregate revenue for March 2025
     march_2025_revenue = march_2025_data["Value"].sum()
@@ -0,0 +1,211 @@
+"""
+Hot reload of the financial data while the app is running.
+
+A DataStore holds the current DataSnapshot (frame, dimension index,
+aggregate cube and FX view of one data version). When the workbook changes on disk, a
+watchdog observer (or, without watchdog, the stat check in snapshot())
+triggers a background refresh that re-parses only the changed sheets,
+updates only the changed cube years and then swaps the new snapshot in with
+a single reference assignment. Requests that already hold a snapshot keep
+using it, so every answer is computed against one consistent version.
+"""
+import dataclasses
+import os
+import threading
+import time
+from typing import Any
+
+from utils.data_loader import DEFAULT_DATA_FILE, get_data_version, refresh_financial_data, _stat_signature
+from utils.data_index import build_dimension_index
+from utils.aggregates import update_aggregate_cube
+from utils.fx_view import update_fx_view
+
+
+@dataclasses.dataclass(frozen=True)
+class DataSnapshot:
+    """
+    One immutable version of the data and everything derived from it.
+
+    Snapshots are shared by every session and request, so they are never
+    modified in place; a changed field means a new snapshot
+    (``dataclasses.replace``).
+
+    Attributes:
+    version (str): Content hash of the source (see get_data_version)
+    df (pd.DataFrame): Compact, memory-mapped melted frame
+    index (DimensionIndex): Positional index over df
+    cube (AggregateCube): Precomputed aggregates over df
+    fx (pd.DataFrame): Wide Real/Presupuesto x USD/local view of df (see
+        utils.fx_view)
+    signatures (dict): Per-sheet signatures of the source
+    changed_sheets (list): Sheets re-parsed for this version
+    changed_partitions (list): (Sheet, Year) partitions that differ from
+        the previous version
+    loaded_at (float): Time the snapshot was swapped in
+    """
+
+    version: str
+    df: Any
+    index: Any
+    cube: Any
+    fx: Any
+    signatures: dict
+    stat: Any
+    changed_sheets: list = dataclasses.field(default_factory=list)
+    changed_partitions: list = dataclasses.field(default_factory=list)
+    loaded_at: float = dataclasses.field(default_factory=time.time)
+
+
+class DataStore:
+    """
+    Current data snapshot, refreshed in the background when the source changes.
+
+    Parameters:
+    file_path (str): Workbook or Parquet directory to serve
+    cache_dir (str): Optional override for the Feather cache directory
+    chunk_rows (int): Wide rows parsed per chunk when re-parsing sheets
+    debounce (float): Seconds to wait after the last file event before
+        refreshing, so a workbook that is still being saved is read once
+    watch (bool): Start a watchdog observer on the source's directory
+    """
+
+    def __init__(self, file_path=DEFAULT_DATA_FILE, cache_dir=None, chunk_rows=None, debounce=2.0, watch=True):
+        self.file_path = file_path
+        self.cache_dir = cache_dir
+        self.chunk_rows = chunk_rows
+        self.debounce = debounce
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._timer = None
+        self._last_attempt = 0.0
+        self._observer = None
+        self._current = self._build(None)
+        if watch:
+            self._start_watcher()
+
+    def snapshot(self):
+        """
+        Return the current snapshot.
+
+        Also compares the source's mtime and size with the snapshot's and
+        schedules a refresh if they differ, which covers file systems where
+        watchdog events are not delivered.
+        """
+        current = self._current
+        try:
+            stat = _stat_signature(self.file_path)
+        except OSError:
+            return current
+        if stat != current.stat and time.monotonic() - self._last_attempt > self.debounce:
+            self.schedule_refresh(delay=0)
+        return current
+
+    def schedule_refresh(self, delay=None):
+        """Refresh in a background thread after `delay` seconds (default: debounce), restarting any pending timer."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce if delay is None else delay, self._refresh_quietly)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def refresh(self):
+        """
+        Load the source's current version and swap it in.
+
+        Returns:
+        DataSnapshot: The new snapshot, or the current one if the content
+        did not change
+        """
+        with self._refresh_lock:
+            self._last_attempt = time.monotonic()
+            previous = self._current
+            snapshot = self._build(previous)
+            with self._lock:
+                self._current = snapshot
+            self.last_error = None
+            return snapshot
+
+    def stop(self):
+        """Stop the file watcher and any pending refresh."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # Typically a workbook that is still being written (BadZipFile):
+            # keep serving the current snapshot and retry after the debounce.
+            self.last_error = f"{type(e).__name__}: {e}"
+            self.schedule_refresh()
+
+    def _build(self, previous):
+        """
+        Build the snapshot for the current source, reusing `previous`.
+
+        Only the changed sheets are re-parsed; the cube and the fx view are
+        recomputed for the years whose (Sheet, Year) partitions changed. The
+        dimension index holds row positions into the whole frame, which
+        shift when any sheet changes, so it is rebuilt in full (about 0.5 s
+        on the 1x data).
+        """
+        stat = _stat_signature(self.file_path)
+        version = get_data_version(self.file_path, self.cache_dir)
+        if previous is not None and version == previous.version:
+            # Touched but not modified: same data, new stat signature
+            return dataclasses.replace(previous, stat=stat)
+
+        df, signatures, changed_sheets = refresh_financial_data(
+            self.file_path,
+            previous.df if previous is not None else None,
+            previous.signatures if previous is not None else None,
+            self.cache_dir,
+            self.chunk_rows,
+        )
+        cube = update_aggregate_cube(previous.cube if previous is not None else None, df)
+        changed_partitions = []
+        if previous is not None:
+            old, new = previous.cube.fingerprints, cube.fingerprints
+            changed_partitions = sorted(key for key in set(old) | set(new) if old.get(key) != new.get(key))
+        fx = update_fx_view(
+            previous.fx if previous is not None else None, df, {year for _sheet, year in changed_partitions}
+        )
+        return DataSnapshot(
+            version, df, build_dimension_index(df), cube, fx, signatures, stat,
+            list(changed_sheets), changed_partitions
+        )
+
+    def _start_watcher(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return
+
+        source = os.path.abspath(self.file_path)
+        store = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                paths = [event.src_path, getattr(event, 'dest_path', '')]
+                if any(path and os.path.abspath(path).startswith(source) for path in paths):
+                    store.schedule_refresh()
+
+        directory = source if os.path.isdir(source) else os.path.dirname(source)
+        try:
+            observer = Observer()
+            observer.schedule(Handler(), directory, recursive=False)
+            observer.daemon = True
+            observer.start()
+        except OSError:
+            # No inotify watches left, etc.: the stat check in snapshot() still works
+            return
+        self._observer = observer
@@ -0,0 +1,261 @@
+import re
+
+from utils.aggregates import COMPANY_GROUPS, GROUP_CURRENCY
+from utils.data_loader import MONTHS
+
+# Base company words (schema "Base Company Name Transformations")
+COMPANY_ALIASES = [
+    (r"falabella\s+retail|retail", 'Total Retail'),
+    (r"sodimac", 'Total Sodimac'),
+    (r"tottus", 'Total Tottus'),
+]
+
+# English metric phrases -> Account, most specific first
+METRIC_ALIASES = [
+    (r"gross\s+margin", 'Margen Bruto'),
+    (r"operating\s+margin|margen\s+de\s+explotacion", 'Margen de Explotacion'),
+    (r"operational\s+margin|margen\s+operacional", 'Margen Operacional'),
+    (r"non[-\s]operating(\s+result)?", 'Resultado No Operacional'),
+    (r"pre[-\s]?tax|before\s+tax(es)?", 'Resultado antes de Impto Rta.'),
+    (r"revenues?|sales|ingresos", 'Ingresos de Explotacion'),
+    (r"costs?|costos", 'Costos de Explotacion'),
+    (r"expenses?|expenditures?|gav", 'gavPrimo'),
+    (r"tax(es)?|impuestos", 'Impuestos'),
+    (r"profits?|net\s+income|net\s+result|utilidad|resultado", 'Resultado'),
+]
+
+METRIC_LABELS = {
+    'Ingresos de Explotacion': 'revenue',
+    'Costos de Explotacion': 'costs',
+    'gavPrimo': 'expenses (gavPrimo)',
+    'Margen Bruto': 'gross margin',
+    'Margen de Explotacion': 'operating margin',
+    'Margen Operacional': 'operational margin',
+    'Resultado No Operacional': 'non-operating result',
+    'Resultado antes de Impto Rta.': 'pre-tax result',
+    'Impuestos': 'taxes',
+    'Resultado': 'profit (Resultado)',
+}
+
+_NUMBER_WORDS = {'two': 2, 'three': 3, 'four': 4, 'five': 5}
+
+_TREND = r"(?:over\s+)?(?:the\s+)?last\s+(\d+|two|three|four|five)\s+years"
+_GROWTH = r"\bgrowth\b|\bvs\.?\s+ly\b|last\s+year|prior\s+year|\byoy\b|year[-\s]over[-\s]year"
+_BUDGET = r"budget|presupuesto|\bplan\b"
+_LOCAL = r"local\s+currency|moneda\s+local"
+_USD = r"\busd\b|us\s+dollars?|\bdollars?\b|\bdolares\b"
+
+# Words a templated question may contain besides its metric, companies,
+# period, years, currency and intent. Anything else (excluding, month,
+# highest, top, average, percentage, by, ...) changes the question and
+# sends it to the model.
+_FILLER = {
+    'a', 'about', 'actual', 'actuals', 'against', 'and', 'are', 'between', 'compare', 'compared',
+    'comparison', 'did', 'do', 'does', 'for', 'from', 'full', 'give', 'how', 'in', 'is', 'me', 'much',
+    'of', 'our', 'please', 'real', 's', 'show', 'tell', 'the', 'to', 'total', 'us', 'versus', 'vs',
+    'was', 'were', 'what', 'with', 'year',
+}
+
+_CODE_TEMPLATE = '''cells = []
+for entity in {entities!r}:
+    for year in {years!r}:
+        cell = cube.get(entity, {account!r}, year, {period!r}, grain={grain!r}, currency={currency!r}) or {{}}
+        row = {{"Entity": entity, "Year": year, "Period": {period!r}}}
+        for column in {columns!r}:
+            row[column] = cell.get(column)
+        cells.append(row)
+result = pd.DataFrame(cells)'''
+
+
+def _fmt(value):
+    return "n/a" if value is None or value != value else f"{value:,.2f}"
+
+
+class FastPathPlanner:
+    """
+    Rule-based planner for common P&L questions.
+
+    Recognizes questions made of a metric, one or more companies (schema
+    aliases plus optional countries, or exact CompanyName values), and a
+    period with explicit years: totals, comparisons, growth vs LY / vs
+    budget and N-year trends. Each plan is plain pandas code over the
+    aggregate cube plus a templated narrative, so no model call is needed.
+    The whole question must match: a question without a year, or with any
+    other word (excluding, highest, by, average, ...), returns None and goes
+    to the LLM.
+    """
+
+    def __init__(self, companies, countries, years):
+        self.companies = list(companies)
+        self.countries = [c for c in countries if c != 'Pais']
+        self.years = sorted(int(y) for y in years)
+        names = sorted(self.companies, key=len, reverse=True)
+        self._company_pattern = re.compile(
+            r"(?<!\w)(" + "|".join(re.escape(c) for c in names) + r")(?!\w)", re.IGNORECASE
+        ) if names else None
+        self._canonical = {c.lower(): c for c in self.companies}
+
+    def _entities(self, text):
+        found = []
+        if self._company_pattern is not None:
+            found = [self._canonical[m.group(0).lower()] for m in self._company_pattern.finditer(text)]
+        if found:
+            return list(dict.fromkeys(found))
+
+        groups = [group for pattern, group in COMPANY_ALIASES if re.search(rf"\b(?:{pattern})\b", text)]
+        if len(groups) != 1:
+            return None
+        group = groups[0]
+        countries = [c for c in self.countries if re.search(rf"\b{re.escape(c.lower())}\b", text)]
+        if not countries:
+            return [group]
+
+        base = group.replace('Total ', '', 1)
+        available = set(self.companies)
+        entities = []
+        for country in countries:
+            if country not in COMPANY_GROUPS[group]:
+                return None
+            member = next((c for c in (f"{group} {country}", f"{base} {country}") if c in available), None)
+            if member is None:
+                return None
+            entities.append(member)
+        return entities
+
+    def _period(self, text):
+        """(period, grain), or None if the question names more than one period."""
+        quarters = set(re.findall(r"\bq([1-4])\b", text))
+        months = [m for m in MONTHS if re.search(rf"\b{m.lower()}\b", text)]
+        if len(quarters) + len(months) > 1:
+            return None
+        if quarters:
+            return f"Q{quarters.pop()}", 'Quarter'
+        if months:
+            grain = 'YTD' if re.search(r"\bytd\b|year[-\s]to[-\s]date", text) else 'Month'
+            return months[0], grain
+        return 'FullYear', 'FullYear'
+
+    def _years(self, text):
+        trend = re.search(_TREND, text)
+        if trend:
+            count = trend.group(1)
+            count = int(count) if count.isdigit() else _NUMBER_WORDS[count]
+            return self.years[-count:], True
+        explicit = sorted({int(y) for y in re.findall(r"\b(20\d{2})\b", text)})
+        if explicit:
+            if any(y not in self.years for y in explicit):
+                return None, False
+            return explicit, bool(re.search(r"\btrend\b|over\s+time", text)) and len(explicit) > 1
+        return None, False
+
+    def _fully_matched(self, text, metric, entities):
+        """
+        Check that nothing but template parts and filler words is left once
+        the metric, companies, period, years, currency and intent are removed.
+        """
+        parts = [
+            rf"\b(?:{metric})\b", _TREND, r"\btrend\b|over\s+time", r"\b20\d{2}\b",
+            r"\bq[1-4]\b", r"\bytd\b|year[-\s]to[-\s]date", _GROWTH, _BUDGET, _LOCAL, _USD,
+        ]
+        parts += [rf"\b{m.lower()}\b" for m in MONTHS]
+        parts += [rf"(?<!\w){re.escape(e.lower())}(?!\w)" for e in entities]
+        # Alias and country words only count when they named one of the entities
+        names = " ".join(entities).lower()
+        parts += [
+            rf"\b(?:{pattern})\b" for pattern, group in COMPANY_ALIASES
+            if group.replace('Total ', '', 1).lower() in names
+        ]
+        parts += [rf"\b{re.escape(c.lower())}\b" for c in self.countries if c.lower() in names]
+        rest = text
+        for part in parts:
+            rest = re.sub(part, ' ', rest)
+        return all(word in _FILLER for word in re.findall(r"[a-z0-9]+", rest))
+
+    def plan(self, question):
+        """
+        Parse a question into an executable plan.
+
+        Returns:
+        dict: code, intent and the resolved parameters, or None if the
+        question does not fit a supported template
+        """
+        text = question.lower()
+        metric = next(((p, a) for p, a in METRIC_ALIASES if re.search(rf"\b(?:{p})\b", text)), None)
+        entities = self._entities(text)
+        years, is_trend = self._years(text)
+        if metric is None or not entities or not years:
+            return None
+        if not self._fully_matched(text, metric[0], entities):
+            return None
+        account = metric[1]
+        # One period, one currency and one comparison per template
+        period = self._period(text)
+        growth, budget = re.search(_GROWTH, text), re.search(_BUDGET, text)
+        local = re.search(_LOCAL, text)
+        if period is None or (local and re.search(_USD, text)) or (growth and budget):
+            return None
+        period, grain = period
+        currency = 'Moneda Local' if local else 'Dolares'
+        if currency != GROUP_CURRENCY and any(e in COMPANY_GROUPS for e in entities):
+            return None
+
+        if growth and not is_trend:
+            intent, columns = 'growth', ['Real', 'Real_LY', 'Var_LY', 'Var_LY_pct']
+        elif budget:
+            intent, columns = 'budget', ['Real', 'Presupuesto', 'Var_Budget', 'Var_Budget_pct']
+        elif is_trend:
+            intent, columns = 'trend', ['Real']
+        elif len(entities) > 1:
+            intent, columns = 'compare', ['Real']
+        else:
+            intent, columns = 'total', ['Real']
+
+        code = _CODE_TEMPLATE.format(
+            entities=entities, years=years, account=account, period=period,
+            grain=grain, currency=currency, columns=columns
+        )
+        return {
+            'intent': intent, 'code': code, 'entities': entities, 'years': years,
+            'account': account, 'period': period, 'grain': grain, 'currency': currency,
+        }
+
+    def describe(self, plan, result):
+        """Write the narrative answer for an executed plan."""
+        label = METRIC_LABELS.get(plan['account'], plan['account'])
+        unit = 'USD' if plan['currency'] == 'Dolares' else 'local currency'
+        if plan['grain'] == 'YTD':
+            period = f"YTD through {plan['period']} "
+        elif plan['period'] != 'FullYear':
+            period = f"{plan['period']} "
+        else:
+            period = ''
+        records = result.to_dict('records')
+
+        if plan['intent'] == 'growth':
+            lines = [
+                f"- **{r['Entity']}**, {period}{r['Year']}: {_fmt(r['Real'])} vs {_fmt(r['Real_LY'])} "
+                f"in {r['Year'] - 1} ({_fmt(r['Var_LY'])}, {_fmt(r['Var_LY_pct'])}%)"
+                for r in records
+            ]
+            header = f"Actual {label} growth vs last year ({unit}):"
+        elif plan['intent'] == 'budget':
+            lines = [
+                f"- **{r['Entity']}**, {period}{r['Year']}: actual {_fmt(r['Real'])} vs budget "
+                f"{_fmt(r['Presupuesto'])} ({_fmt(r['Var_Budget'])}, {_fmt(r['Var_Budget_pct'])}%)"
+                for r in records
+            ]
+            header = f"Actual vs budget {label} ({unit}):"
+        else:
+            lines = [f"- **{r['Entity']}**, {period}{r['Year']}: {_fmt(r['Real'])}" for r in records]
+            header = f"Actual {label} ({unit}):"
+
+        notes = []
+        if plan['entities'][0] in COMPANY_GROUPS:
+            notes.append(f"{plan['entities'][0]} is the sum of its countries as defined in the schema.")
+        if plan['intent'] == 'compare' and len(records) > 1:
+            ranked = sorted((r for r in records if r['Real'] == r['Real']), key=lambda r: abs(r['Real']), reverse=True)
+            if ranked:
+                notes.append(f"Largest: {ranked[0]['Entity']} ({_fmt(ranked[0]['Real'])}).")
+        if plan['years'][-1] == self.years[-1] and plan['period'] == 'FullYear':
+            notes.append(f"{self.years[-1]} figures include only the months reported so far.")
+        return "\n".join([header] + lines + ([""] + notes if notes else []))
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import MONTHS
+
+# Row keys of the view: every (Scenario, Currency) pair of a record is a column
+FX_KEYS = ['CompanyName', 'Country', 'Account', 'Year', 'Month']
+
+# Sheet -> value column (the four sheets are Real/Presupuesto x USD/local)
+SHEET_COLUMNS = {
+    'USD_REAL': 'Real_USD',
+    'USD_PPTO': 'Presupuesto_USD',
+    'MONEDALOCAL_REAL': 'Real_Local',
+    'MONEDALOCAL_PPTO': 'Presupuesto_Local',
+}
+
+FX_COLUMNS = [
+    'Real_USD', 'Presupuesto_USD', 'Real_Local', 'Presupuesto_Local',
+    'Var_Budget_USD', 'Var_Budget_USD_pct', 'Var_Budget_Local', 'Var_Budget_Local_pct',
+    'FX_Real', 'FX_Presupuesto',
+]
+
+
+def _ratio(numerator, denominator):
+    """Element-wise numerator / denominator with NaN where the denominator is 0 or missing."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = numerator / denominator
+    out[~np.isfinite(out)] = np.nan
+    return out
+
+
+def update_fx_view(fx, df, years):
+    """
+    Bring an FX view up to date after the given years changed.
+
+    Rows of other years are kept from `fx`; only the changed years are
+    rebuilt from `df`. Falls back to a full build when the categories of
+    the key columns changed (e.g. a new company), since kept and rebuilt
+    rows must share them.
+
+    Parameters:
+    fx (pd.DataFrame): Previous view, or None to build from scratch
+    df (pd.DataFrame): New melted financial data
+    years (iterable): Years whose (Sheet, Year) partitions changed
+
+    Returns:
+    pd.DataFrame: Updated view (the previous one is left untouched)
+    """
+    years = {int(year) for year in years}
+    if fx is None:
+        return build_fx_view(df)
+    if not years:
+        return fx
+    kept = fx[~fx['Year'].isin(list(years))]
+    rebuilt = build_fx_view(df[df['Year'].isin(list(years))])
+    if any(kept[column].dtype != rebuilt[column].dtype for column in FX_KEYS):
+        return build_fx_view(df)
+    view = pd.concat([kept, rebuilt], ignore_index=True)
+    return view.sort_values(FX_KEYS, kind='stable').reset_index(drop=True)
+
+
+def build_fx_view(df):
+    """
+    Pre-join the four sheets into one wide row per record.
+
+    The melted frame stores every (company, account, year, month) four times,
+    once per sheet. The view lines them up side by side so budget-vs-actual
+    and USD-vs-local comparisons are plain column arithmetic instead of a
+    Currency/Scenario filter plus a pivot on every query.
+
+    Parameters:
+    df (pd.DataFrame): Melted financial data (compact or expanded)
+
+    Returns:
+    pd.DataFrame: One row per (CompanyName, Country, Account, Year, Month)
+    with the FX_COLUMNS; categorical keys keep the categories of df and
+    Month stays an ordered categorical
+    """
+    source = df[df['Sheet'].isin(list(SHEET_COLUMNS))]
+    if not isinstance(source['Month'].dtype, pd.CategoricalDtype):
+        source = source.assign(Month=pd.Categorical(source['Month'], categories=MONTHS, ordered=True))
+    codes, uniques = pd.factorize(source['Sheet'].astype(str), sort=False)
+    groups = source.groupby(FX_KEYS, observed=True, sort=True)
+    row = groups.ngroup().to_numpy()
+    keys = groups.size().index.to_frame(index=False)
+
+    # Scatter every value into its (row, sheet) slot in one pass; the keys
+    # plus Sheet are unique, so no aggregation is needed (rows with a missing
+    # key get group -1 and are dropped, as in groupby)
+    values = np.full((len(keys), len(uniques)), np.nan)
+    keep = row >= 0
+    values[row[keep], codes[keep]] = source['Value'].to_numpy(dtype=float)[keep]
+
+    view = keys
+    for i, sheet in enumerate(uniques):
+        view[SHEET_COLUMNS[sheet]] = values[:, i]
+    for column in SHEET_COLUMNS.values():
+        if column not in view:
+            view[column] = np.nan
+
+    real_usd, budget_usd = view['Real_USD'].to_numpy(), view['Presupuesto_USD'].to_numpy()
+    real_local, budget_local = view['Real_Local'].to_numpy(), view['Presupuesto_Local'].to_numpy()
+    view['Var_Budget_USD'] = real_usd - budget_usd
+    view['Var_Budget_USD_pct'] = _ratio(real_usd - budget_usd, np.abs(budget_usd)) * 100
+    view['Var_Budget_Local'] = real_local - budget_local
+    view['Var_Budget_Local_pct'] = _ratio(real_local - budget_local, np.abs(budget_local)) * 100
+    view['FX_Real'] = _ratio(real_local, real_usd)
+    view['FX_Presupuesto'] = _ratio(budget_local, budget_usd)
+    return view[FX_KEYS + FX_COLUMNS]
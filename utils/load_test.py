@@ -0,0 +1,228 @@
+"""
+Load test of the HTTP API (api.py) against the offline model stub.
+
+Serves the API with uvicorn on a local port, backed by the real data and
+a StubModelClient behind a ModelGateway, and fires the benchmark question
+corpus at /query from many concurrent clients. Reports requests per
+second, latency percentiles, time to the first streamed chunk of
+/query/stream and, with --ui, the same questions asked one by one through
+the Streamlit script (the UI path) for comparison. It also checks that a
+follow-up question gets the same cache keys in two identical sessions.
+
+Usage:
+    python -m utils.load_test --requests 300 --concurrency 16
+    python -m utils.load_test --latency 0.3 --ui 12
+"""
+import argparse
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.answer_cache import context_key
+from utils.benchmark import QUESTIONS, stub_responses
+from utils.chat_history import ChatHistoryStore
+from utils.code_cache import CodeTemplateCache
+from utils.data_loader import DEFAULT_DATA_FILE
+from utils.data_refresh import DataStore
+from utils.model_gateway import ModelGateway
+from utils.model_stub import StubModelClient
+from utils.tracing import percentile
+
+
+def serve_api(state, host='127.0.0.1', port=0):
+    """
+    Serve the API for `state` with uvicorn on a background thread.
+
+    Returns:
+    uvicorn.Server: Started server with a ``url`` attribute; set
+    ``should_exit = True`` to stop it
+    """
+    import uvicorn
+    from api import ApiApp
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    config = uvicorn.Config(ApiApp(lambda: state), log_level='warning', timeout_keep_alive=30)
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    server.url = f"http://{host}:{sock.getsockname()[1]}"
+    return server
+
+
+def _summary(latencies, elapsed, errors):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'latency_ms': {q: round(percentile(latencies, q), 1) for q in (50, 95, 99)},
+    }
+
+
+def check_session_keys(unique_values, question, follow_up, result):
+    """
+    Play the same two-turn conversation in two fresh sessions and compare the
+    answer-cache and code-template keys of the follow-up.
+
+    Each session stores the first result under its own random handle; the
+    keys must not depend on it, or follow-ups would never hit either cache.
+
+    Returns:
+    bool: True if both sessions produce the same keys
+    """
+    templates = CodeTemplateCache(unique_values['companies'], unique_values['countries'], unique_values['accounts'])
+    path = os.path.join(tempfile.mkdtemp(), 'history.sqlite')
+    keys = []
+    for handle in ('res_0000000001', 'res_0000000002'):
+        history = ChatHistoryStore(path=path)
+        history.append('user', question)
+        history.append('assistant', "Answer.")
+        history.remember(question, unique_values['companies'], unique_values['accounts'],
+                         {'result': result, 'handle': handle})
+        history.append('user', follow_up)
+        context = history.context()
+        keys.append((context_key(follow_up, context), templates._key(follow_up, context)[0]))
+    return keys[0] == keys[1]
+
+
+def load_test_api(url, questions, concurrency):
+    """POST every question to /query with `concurrency` clients in flight."""
+    import httpx
+
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    with httpx.Client(base_url=url, limits=limits, timeout=120) as client:
+        def ask(question):
+            nonlocal errors
+            started = time.perf_counter()
+            response = client.post('/query', json={'question': question, 'temperature': 0.0})
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200 or 'error' in response.json():
+                    errors += 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(ask, questions))
+        elapsed = time.perf_counter() - started
+    return _summary(latencies, elapsed, errors)
+
+
+def load_test_stream(url, questions):
+    """Time to the first chunk and to the end of /query/stream, one question at a time."""
+    import httpx
+
+    first, total = [], []
+    with httpx.Client(base_url=url, timeout=120) as client:
+        for question in questions:
+            started = time.perf_counter()
+            got_chunk = False
+            with client.stream('POST', '/query/stream', json={'question': question, 'temperature': 0.0}) as response:
+                for line in response.iter_lines():
+                    if line == 'event: chunk' and not got_chunk:
+                        first.append((time.perf_counter() - started) * 1000)
+                        got_chunk = True
+            total.append((time.perf_counter() - started) * 1000)
+    return {
+        'requests': len(total),
+        'first_chunk_ms': {q: round(percentile(first, q), 1) for q in (50, 95)},
+        'total_ms': {q: round(percentile(total, q), 1) for q in (50, 95)},
+    }
+
+
+def load_test_ui(questions, client, script='app.py'):
+    """
+    Ask the questions one by one through the Streamlit script (one session).
+
+    Uses Streamlit's AppTest runner, which executes the script exactly as a
+    browser session would (a full rerun per question) minus the websocket.
+    The app keeps its persistent answer cache, so repeated runs favor the UI.
+    """
+    from streamlit.testing.v1 import AppTest
+    from utils import model_gateway
+
+    os.environ.setdefault('GOOGLE_API_KEY', 'stub')
+    model_gateway._gateway = client
+    app = AppTest.from_file(script, default_timeout=300)
+    app.run()
+    latencies = []
+    started = time.perf_counter()
+    for question in questions:
+        asked = time.perf_counter()
+        app.chat_input[0].set_value(question).run()
+        latencies.append((time.perf_counter() - asked) * 1000)
+    elapsed = time.perf_counter() - started
+    errors = len(app.exception)
+    return _summary(latencies, elapsed, errors)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of the HTTP API with a stub model client")
+    parser.add_argument('--file', default=DEFAULT_DATA_FILE, help="Workbook to serve")
+    parser.add_argument('--requests', type=int, default=240, help="Requests sent to /query")
+    parser.add_argument('--concurrency', type=int, default=16, help="Requests in flight at once")
+    parser.add_argument('--latency', type=float, default=0.0, help="Stub model latency per call (seconds)")
+    parser.add_argument('--stream', type=int, default=12, help="Questions sent one by one to /query/stream")
+    parser.add_argument('--ui', type=int, default=0, help="Also ask this many questions through the Streamlit UI path")
+    parser.add_argument('--json', help="Also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    from api import ApiState
+
+    stub = StubModelClient(stub_responses(), latency=args.latency, seed=0)
+    gateway = ModelGateway(stub, max_concurrency=args.concurrency)
+    trace_file = os.path.join(tempfile.mkdtemp(), 'traces.jsonl')
+    corpus = [question for question, _ in QUESTIONS]
+    questions = [corpus[i % len(corpus)] for i in range(args.requests)]
+    report = {'concurrency': args.concurrency, 'stub_latency_s': args.latency}
+    state = ApiState(
+        data_store=DataStore(args.file, watch=False), model_client=gateway, answer_cache=None,
+        workers=args.concurrency, trace_path=trace_file
+    )
+    context = state.context()
+    report['session_keys_stable'] = check_session_keys(
+        context['unique_values'], corpus[0], "and in 2024?", context['snapshot'].df.head(3)
+    )
+    server = serve_api(state)
+    try:
+        load_test_api(server.url, corpus, args.concurrency)  # warm up
+        report['api'] = load_test_api(server.url, questions, args.concurrency)
+        if args.stream:
+            report['stream'] = load_test_stream(server.url, questions[:args.stream])
+        report['gateway'] = gateway.stats()
+    finally:
+        server.should_exit = True
+    if args.ui:
+        report['ui'] = load_test_ui(questions[:args.ui], ModelGateway(stub, max_concurrency=args.concurrency))
+
+    api = report['api']
+    print(f"Follow-up cache keys identical across sessions: {report['session_keys_stable']}")
+    print(f"API /query: {api['requests']} requests, {api['errors']} errors, "
+          f"{api['requests_per_second']} requests/s at concurrency {args.concurrency}, "
+          f"latency p50/p95/p99 {api['latency_ms'][50]}/{api['latency_ms'][95]}/{api['latency_ms'][99]} ms")
+    if 'stream' in report:
+        stream = report['stream']
+        print(f"API /query/stream: first chunk p50 {stream['first_chunk_ms'][50]} ms, "
+              f"total p50 {stream['total_ms'][50]} ms")
+    if 'ui' in report:
+        ui = report['ui']
+        print(f"UI path: {ui['requests']} questions, {ui['errors']} errors, {ui['requests_per_second']} requests/s, "
+              f"latency p50/p95 {ui['latency_ms'][50]}/{ui['latency_ms'][95]} ms")
+        if ui['requests_per_second']:
+            print(f"API/UI throughput: {api['requests_per_second'] / ui['requests_per_second']:.1f}x")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Process-wide gateway for Gemini calls.
+
+All model traffic of a worker goes through one ModelGateway, which wraps a
+single genai client (one pooled, keep-alive HTTP connection pool) and adds:
+
+- bounded concurrency: at most `max_concurrency` requests in flight,
+  the rest wait in line;
+- rate limiting: a token bucket of `requests_per_minute`, and a shared
+  pause whenever the API answers 429 (quota exhausted);
+- retries with exponential backoff and full jitter on 429, 5xx and
+  connection errors;
+- coalescing: identical non-streaming requests in flight at the same time
+  share one API call.
+
+The gateway exposes the same generate_content / generate_content_stream
+interface as ``client.models``, so existing callers and StubModelClient are
+interchangeable with it. Set GEMINI_BASE_URL to send requests to another
+endpoint, e.g. the local stub server from utils.model_stub.serve_stub.
+"""
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def create_client(api_key=None, base_url=None, timeout_ms=None, max_connections=20):
+    """
+    Create the genai ``client.models`` object used by the gateway.
+
+    Parameters:
+    api_key (str): API key (default: GOOGLE_API_KEY)
+    base_url (str): API endpoint override (default: GEMINI_BASE_URL, if set)
+    timeout_ms (int): Request timeout in milliseconds
+    max_connections (int): Size of the HTTP keep-alive connection pool
+
+    Returns:
+    The client's ``models`` object
+    """
+    import httpx
+    from google import genai
+    from google.genai import types
+
+    api_key = api_key or os.getenv('GOOGLE_API_KEY')
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable not set")
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    http_options = types.HttpOptions(
+        base_url=base_url or os.getenv('GEMINI_BASE_URL') or None,
+        timeout=timeout_ms,
+        client_args={'limits': limits},
+    )
+    return genai.Client(api_key=api_key, http_options=http_options).models
+
+
+def _status_code(error):
+    """HTTP status of a genai API error, or None for other exceptions."""
+    code = getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(error):
+    """True for quota, server and connection errors that are worth retrying."""
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    try:
+        import httpx
+        if isinstance(error, httpx.TransportError):
+            return True
+    except ImportError:
+        pass
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class _RateLimiter:
+    """
+    Token bucket of `per_minute` requests that callers wait on in turn.
+
+    The bucket holds at most one second's worth of tokens, so requests are
+    spread evenly instead of bursting a whole minute's quota at once.
+    """
+
+    def __init__(self, per_minute=None):
+        self.per_minute = per_minute
+        self.capacity = max(1.0, (per_minute or 0) / 60.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def pause(self, seconds):
+        """Hold back every caller for `seconds` (after a 429)."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            if self.per_minute:
+                self._tokens = 0.0
+
+    def acquire(self):
+        """Wait for a token; returns the seconds spent waiting."""
+        started = time.monotonic()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0 and self.per_minute:
+                    rate = self.per_minute / 60.0
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    wait = (1 - self._tokens) / rate
+                elif wait <= 0:
+                    break
+                self._condition.wait(wait)
+        return time.monotonic() - started
+
+
+class ModelGateway:
+    """
+    Shared, rate-limited, retrying wrapper around a ``client.models`` object.
+
+    Parameters:
+    client: genai ``client.models`` (see create_client) or a stand-in with
+        the same methods, e.g. StubModelClient
+    max_concurrency (int): Requests allowed in flight at once
+    requests_per_minute (int): Token-bucket rate; None or 0 disables it
+    max_retries (int): Retries after the first attempt for retryable errors
+    base_delay (float): First backoff in seconds, doubled per retry
+    max_delay (float): Backoff cap in seconds
+    coalesce (bool): Share one call between identical concurrent requests
+    """
+
+    def __init__(self, client, max_concurrency=8, requests_per_minute=None, max_retries=4,
+                 base_delay=0.5, max_delay=8.0, coalesce=True, seed=None):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.coalesce = coalesce
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._limiter = _RateLimiter(requests_per_minute)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._stats = {'requests': 0, 'api_calls': 0, 'coalesced': 0, 'retries': 0, 'errors': 0,
+                       'queued_seconds': 0.0}
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def stats(self):
+        """Counters since start: requests, api_calls, coalesced, retries, errors, queued_seconds."""
+        with self._lock:
+            return dict(self._stats)
+
+    def _backoff(self, attempt, error):
+        delay = self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if _status_code(error) == 429:
+            # Quota exhausted: hold back every caller, not just this one
+            self._limiter.pause(delay)
+        return delay
+
+    def _enter(self):
+        """Wait for the rate limiter and a concurrency slot."""
+        started = time.monotonic()
+        self._limiter.acquire()
+        self._slots.acquire()
+        self._count('queued_seconds', time.monotonic() - started)
+
+    def _call(self, model, contents, config):
+        """One request with rate limiting, a concurrency slot and retries."""
+        attempt = 0
+        while True:
+            self._enter()
+            try:
+                self._count('api_calls')
+                return self.client.generate_content(model=model, contents=contents, config=config)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._count('errors')
+                    raise
+                delay = self._backoff(attempt, e)
+            finally:
+                self._slots.release()
+            self._count('retries')
+            attempt += 1
+            time.sleep(delay)
+
+    @staticmethod
+    def _key(model, contents, config):
+        if hasattr(config, 'model_dump'):
+            config = config.model_dump(exclude_none=True)
+        return json.dumps([model, contents, config], sort_keys=True, default=str)
+
+    def generate_content(self, model, contents, config=None):
+        self._count('requests')
+        if not self.coalesce:
+            return self._call(model, contents, config)
+
+        key = self._key(model, contents, config)
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            self._count('coalesced')
+            return future.result()
+        try:
+            response = self._call(model, contents, config)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def generate_content_stream(self, model, contents, config=None):
+        """
+        Stream a response, holding a concurrency slot until the stream ends.
+
+        Streams are not coalesced. Failures before the first chunk are
+        retried like generate_content; a stream that fails midway is not
+        restarted, since chunks were already handed out.
+        """
+        self._count('requests')
+        attempt = 0
+        while True:
+            self._enter()
+            started = False
+            try:
+                self._count('api_calls')
+                for chunk in self.client.generate_content_stream(model=model, contents=contents, config=config):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or attempt >= self.max_retries or not is_retryable(e):
+                    self._count('errors')
+                    raise
+                delay = self._backoff(attempt, e)
+            finally:
+                self._slots.release()
+            self._count('retries')
+            attempt += 1
+            time.sleep(delay)
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+
+def get_model_gateway():
+    """
+    Return the process-wide gateway, creating it on first use.
+
+    Configured from the environment: GOOGLE_API_KEY, GEMINI_BASE_URL,
+    GEMINI_MAX_CONCURRENCY (default 8), GEMINI_REQUESTS_PER_MINUTE (default
+    0, unlimited) and GEMINI_MAX_RETRIES (default 4).
+    """
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            concurrency = _env_int('GEMINI_MAX_CONCURRENCY', 8)
+            _gateway = ModelGateway(
+                create_client(max_connections=max(concurrency, 1) * 2),
+                max_concurrency=concurrency,
+                requests_per_minute=_env_int('GEMINI_REQUESTS_PER_MINUTE', 0) or None,
+                max_retries=_env_int('GEMINI_MAX_RETRIES', 4),
+            )
+        return _gateway
@@ -0,0 +1,246 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+DEFAULT_CODE = 'result = df[df["Year"] == df["Year"].max()]["Value"].sum()'
+DEFAULT_ANSWER = "The requested figures are shown in the results table."
+
+
+def _question(contents, marker):
+    match = re.search(rf"{marker}\s*(.*)", contents)
+    return match.group(1).strip() if match else ""
+
+
+def _response(text, contents):
+    usage = SimpleNamespace(
+        prompt_token_count=max(1, len(contents) // 4),
+        candidates_token_count=max(1, len(text) // 4),
+    )
+    return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+def prompt_kind(contents):
+    """Classify a prompt as 'code', 'batch_code', 'answer' or 'batch_answer'."""
+    if "generate pandas code for each question" in contents:
+        return 'batch_code'
+    if "generate pandas code" in contents:
+        return 'code'
+    if re.search(r"### Question \d+:", contents):
+        return 'batch_answer'
+    return 'answer'
+
+
+class StubModelClient:
+    """
+    Offline stand-in for the Gemini ``client.models`` object.
+
+    Implements generate_content and generate_content_stream for the prompts
+    built by query_generator and response_formatter. Replies come from
+    `responses`, a dict keyed by ('code', question) or ('answer', question),
+    with canned defaults otherwise. Every call sleeps for `latency` seconds
+    (plus up to `jitter`), and streamed answers sleep `chunk_latency` per
+    chunk, to mimic the network.
+    """
+
+    def __init__(self, responses=None, latency=0.0, jitter=0.0, chunk_latency=0.0,
+                 default_code=DEFAULT_CODE, default_answer=DEFAULT_ANSWER, seed=None):
+        self.responses = dict(responses or {})
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_latency = chunk_latency
+        self.default_code = default_code
+        self.default_answer = default_answer
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _code(self, question):
+        return self.responses.get(('code', question), self.default_code)
+
+    def _answer(self, question):
+        return self.responses.get(('answer', question), self.default_answer)
+
+    def reply(self, contents):
+        """Return the reply text for a prompt without waiting."""
+        kind = prompt_kind(contents)
+        if kind == 'code':
+            return f"```python\n{self._code(_question(contents, 'USER QUESTION:'))}\n```"
+        if kind == 'batch_code':
+            questions = re.findall(r"^\s*Q(\d+): (.*)$", contents, re.MULTILINE)
+            return "\n\n".join(f"```python\n# Q{n}\n{self._code(q.strip())}\n```" for n, q in questions)
+        if kind == 'batch_answer':
+            questions = re.findall(r"### Question (\d+): (.*)", contents)
+            return "\n\n".join(f"### Answer {n}\n{self._answer(q.strip())}" for n, q in questions)
+        return self._answer(_question(contents, 'Current question:'))
+
+    def generate_content(self, model, contents, config=None):
+        self._wait()
+        return _response(self.reply(contents), contents)
+
+    def generate_content_stream(self, model, contents, config=None):
+        self._wait()
+        text = self.reply(contents)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            if self.chunk_latency:
+                time.sleep(self.chunk_latency)
+            chunk = word + (" " if i < len(words) - 1 else "")
+            yield _response(chunk, contents if i == len(words) - 1 else "")
+
+
+class RecordingModelClient:
+    """
+    Wrap a real client and append every reply to a JSONL recording.
+
+    Each line holds the prompt kind, the question and the reply text, so a
+    live session can later be replayed offline with load_recording().
+    """
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _record(self, contents, text):
+        kind = prompt_kind(contents)
+        if kind not in ('code', 'answer'):
+            return
+        marker = 'USER QUESTION:' if kind == 'code' else 'Current question:'
+        if kind == 'code' and "```python" in text:
+            text = text.split("```python")[1].split("```")[0].strip()
+        line = json.dumps({'kind': kind, 'question': _question(contents, marker), 'text': text})
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+
+    def generate_content(self, model, contents, config=None):
+        response = self.client.generate_content(model=model, contents=contents, config=config)
+        self._record(contents, response.text or "")
+        return response
+
+    def generate_content_stream(self, model, contents, config=None):
+        parts = []
+        for chunk in self.client.generate_content_stream(model=model, contents=contents, config=config):
+            parts.append(chunk.text or "")
+            yield chunk
+        self._record(contents, "".join(parts))
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Gemini REST endpoints (generateContent, streamGenerateContent) backed by a StubModelClient."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        contents = "".join(
+            part.get('text', '') for content in request.get('contents', []) for part in content.get('parts', [])
+        )
+        with self.server.lock:
+            self.server.requests += 1
+            status = self.server.failures.popleft() if self.server.failures else None
+        if status is not None:
+            self._send_json(status, {'error': {
+                'code': status, 'message': 'Injected failure', 'status': 'RESOURCE_EXHAUSTED' if status == 429 else 'UNAVAILABLE'
+            }})
+            return
+
+        client = self.server.client
+        client._wait()
+        text = client.reply(contents)
+        usage = {'promptTokenCount': max(1, len(contents) // 4), 'candidatesTokenCount': max(1, len(text) // 4)}
+
+        def candidate(chunk):
+            return {'candidates': [{'content': {'role': 'model', 'parts': [{'text': chunk}]}, 'finishReason': 'STOP'}],
+                    'usageMetadata': usage}
+
+        if ':streamGenerateContent' not in self.path:
+            self._send_json(200, candidate(text))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            if client.chunk_latency:
+                time.sleep(client.chunk_latency)
+            event = f"data: {json.dumps(candidate(word + (' ' if i < len(words) - 1 else '')))}\r\n\r\n".encode()
+            self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve_stub(client=None, host='127.0.0.1', port=0, failures=()):
+    """
+    Serve a StubModelClient over HTTP as a local stand-in for the Gemini API.
+
+    Point the real client at it with GEMINI_BASE_URL=http://host:port (see
+    utils.model_gateway), so connection pooling, retries and streaming are
+    exercised end to end without network access or an API key.
+
+    Parameters:
+    client (StubModelClient): Replies and simulated latency (default: a plain stub)
+    host (str): Interface to bind
+    port (int): Port to bind (0 picks a free one)
+    failures (iterable): HTTP status codes (e.g. 429, 503) returned by the
+        next requests, one per request, before normal replies
+
+    Returns:
+    ThreadingHTTPServer: Running server (serving on a daemon thread) with
+    ``url``, ``requests`` and ``connections`` attributes; call shutdown()
+    to stop it
+    """
+    server = ThreadingHTTPServer((host, port), _StubHandler)
+    server.daemon_threads = True
+    server.client = client or StubModelClient()
+    server.failures = deque(failures)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.connections = 0
+    server.url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load_recording(path):
+    """
+    Read a RecordingModelClient file into StubModelClient responses.
+
+    Returns:
+    dict: {(kind, question): text}; later recordings win
+    """
+    responses = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                responses[(entry['kind'], entry['question'])] = entry['text']
+    return responses
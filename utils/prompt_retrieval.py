@@ -0,0 +1,179 @@
+import math
+import re
+from collections import Counter
+
+from utils.chat_history import CONTEXT_ROLE, context_window
+
+# Sections sent with every request: column semantics and the helpers the
+# generated code is expected to use.
+PINNED_SECTIONS = [
+    'Columns',
+    'Column Types',
+    'FAST LOOKUPS',
+    'AGGREGATE CUBE',
+    'FX VIEW',
+    'Base Company Name Transformations (ALWAYS APPLY FIRST)',
+    'Currency Information',
+]
+
+# English finance terms mapped to words used in the (Spanish) schema and
+# account names, so keyword retrieval can bridge the two.
+QUERY_SYNONYMS = {
+    'revenue': ['ingresos', 'explotacion'],
+    'revenues': ['ingresos', 'explotacion'],
+    'sales': ['ingresos', 'explotacion'],
+    'income': ['ingresos', 'resultado'],
+    'cost': ['costos'],
+    'costs': ['costos'],
+    'expense': ['costos', 'gavprimo', 'expenditure'],
+    'expenses': ['costos', 'gavprimo', 'expenditure'],
+    'profit': ['resultado', 'utilidad'],
+    'profits': ['resultado', 'utilidad'],
+    'margin': ['margen'],
+    'gross': ['bruto'],
+    'operating': ['explotacion', 'operacional'],
+    'tax': ['impuestos'],
+    'taxes': ['impuestos'],
+    'budget': ['presupuesto', 'ppto'],
+    'actual': ['real'],
+    'usd': ['dolares'],
+    'dollars': ['dolares'],
+    'local': ['moneda', 'local'],
+    'falabella': ['retail'],
+    'ly': ['year'],
+}
+
+_STOPWORDS = {
+    'the', 'a', 'an', 'of', 'for', 'in', 'on', 'and', 'or', 'to', 'me', 'show',
+    'what', 'is', 'are', 'was', 'how', 'with', 'by', 'vs', 'all', 'total', 'data',
+}
+
+_CONTEXT_CHARS = 300
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords."""
+    return [t for t in re.findall(r"[a-z0-9&]+", str(text).lower()) if t not in _STOPWORDS]
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+def split_sections(markdown):
+    """
+    Split a markdown document into (heading, text) sections at ## and ###.
+
+    Headings inside fenced code blocks are ignored; #### subsections stay
+    with their parent.
+    """
+    sections = []
+    heading, lines, in_fence = '', [], False
+    for line in markdown.splitlines():
+        if line.strip().startswith('```'):
+            in_fence = not in_fence
+        match = None if in_fence else re.match(r"^(#{1,3})\s+(.*)$", line)
+        if match:
+            if lines and any(l.strip() for l in lines):
+                sections.append((heading, '\n'.join(lines).strip()))
+            heading, lines = match.group(2).strip(), [line]
+        else:
+            lines.append(line)
+    if lines and any(l.strip() for l in lines):
+        sections.append((heading, '\n'.join(lines).strip()))
+    return sections
+
+
+class BM25:
+    """Okapi BM25 over a small list of documents."""
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1, self.b = k1, b
+        self.docs = [Counter(tokenize(d)) for d in documents]
+        self.lengths = [sum(d.values()) for d in self.docs]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.docs else 0
+        frequencies = Counter(t for d in self.docs for t in d)
+        n = len(self.docs)
+        self.idf = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in frequencies.items()}
+
+    def scores(self, query_tokens):
+        scores = []
+        for doc, length in zip(self.docs, self.lengths):
+            score = 0.0
+            for token in query_tokens:
+                tf = doc.get(token)
+                if tf:
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+                    score += self.idf[token] * tf * (self.k1 + 1) / norm
+            scores.append(score)
+        return scores
+
+
+class PromptRetriever:
+    """
+    Select the schema sections and dimension values relevant to a question.
+
+    Pinned sections are always kept; the remaining sections are ranked with
+    BM25 against the question (expanded with finance synonyms) and the top
+    ones are added. Companies and accounts are kept only when their words
+    appear in the question or the recent user turns.
+    """
+
+    def __init__(self, schema_docs, companies, accounts, max_sections=4):
+        self.sections = split_sections(schema_docs)
+        self.companies = list(companies)
+        self.accounts = list(accounts)
+        self.max_sections = max_sections
+        self._bm25 = BM25([f"{h}\n{t}" for h, t in self.sections])
+        self._company_tokens = {c: set(tokenize(c)) for c in self.companies}
+        self._account_tokens = {a: set(tokenize(a)) for a in self.accounts}
+
+    def _query_tokens(self, question, chat_history):
+        text = question
+        if chat_history:
+            text += ' ' + ' '.join(m['content'] for m in context_window(chat_history) if m.get('role') in ('user', CONTEXT_ROLE))
+        tokens = tokenize(text)
+        expanded = list(tokens)
+        for token in tokens:
+            expanded.extend(QUERY_SYNONYMS.get(token, []))
+        return expanded
+
+    def select(self, question, chat_history=None):
+        """
+        Return the reduced prompt inputs for a question.
+
+        Returns:
+        dict: schema_docs, companies, accounts and chat_history to use in
+        place of the full ones
+        """
+        tokens = self._query_tokens(question, chat_history)
+        token_set = set(tokens)
+
+        scores = self._bm25.scores(tokens)
+        ranked = sorted(
+            (i for i, (heading, _) in enumerate(self.sections) if heading not in PINNED_SECTIONS),
+            key=lambda i: scores[i], reverse=True
+        )
+        chosen = {i for i in ranked[:self.max_sections] if scores[i] > 0}
+        chosen |= {i for i, (heading, _) in enumerate(self.sections) if heading in PINNED_SECTIONS}
+        schema_docs = '\n\n'.join(self.sections[i][1] for i in sorted(chosen))
+
+        # A company is relevant when all of its distinctive words are mentioned
+        companies = [c for c, words in self._company_tokens.items() if words and words <= token_set]
+        if not companies:
+            companies = [c for c, words in self._company_tokens.items() if words & token_set]
+        accounts = [a for a, words in self._account_tokens.items() if words & token_set]
+
+        # The context message (summary and state) is already compact
+        compact_history = [
+            m if m['role'] == CONTEXT_ROLE else
+            {'role': m['role'], 'content': m['content'][:_CONTEXT_CHARS] + ('...' if len(m['content']) > _CONTEXT_CHARS else '')}
+            for m in context_window(chat_history)
+        ]
+        return {
+            'schema_docs': schema_docs,
+            'companies': companies or self.companies,
+            'accounts': accounts or self.accounts,
+            'chat_history': compact_history,
+        }
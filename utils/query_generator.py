@@ -1,44 +1,21 @@
-from google import genai
 from google.genai import types
-import os
 from typing import Dict, Any
-import ast
-import sys
+import re
+import warnings
 
-def configure_gemini():
-    """Configure the Gemini API with the API key."""
-    api_key = os.getenv('GOOGLE_API_KEY')
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY environment variable not set")
+from utils.chat_history import history_text
 
-    # Using the recommended approach from documentation
-    client = genai.Client(api_key=api_key)
-    return client.models
+# validate_and_execute_code warns once when copy-on-write is off
+_warned_copy_on_write = False
 
-def generate_pandas_code(model_client, model_name, schema_docs: str, user_question: str,
-                        company_list: list, date_range: str, business_units: list,
-                        temperature: float = 0.7, chat_history=None) -> str:
-    """
-    Generate pandas code using Gemini based on the user question and schema.
-
-    Parameters:
-    model_client: Configured Gemini model client
-    schema_docs (str): Schema documentation
-    user_question (str): User's question
-    company_list (list): List of available companies
-    date_range (str): Available date range
-    business_units (list): List of business units
-
-    Returns:
-    str: Generated pandas code
-    """
+def build_code_prompt(schema_docs: str, user_question: str, company_list: list, date_range: str,
+                      business_units: list, chat_history=None) -> str:
+    """Build the code-generation prompt."""
     # Create context from chat history
-    context = ""
-    if chat_history:
-        context = "\n".join([f"{m['role']}: {m['content']}" for m in chat_history[-3:]])  # Last 3 messages
+    context = history_text(chat_history) if chat_history else ""  # Summary, state and last 3 messages
 
     # Add context to your existing prompt
-    prompt = f"""Previous conversation:\n{context}\n\nCurrent question: {user_question}
+    return f"""Previous conversation:\n{context}\n\nCurrent question: {user_question}
     Based on this context and the current question, generate Python pandas code that...
 
     You are a financial data analyst. Given this schema and user question, generate pandas code.
@@ -58,7 +35,51 @@ def generate_pandas_code(model_client, model_name, schema_docs: str, user_questi
     Make sure to handle potential errors and edge cases.
     Dont comment your code to explain the logic.
     Always assign the main result to a variable named result.
+    Use lookup(...) (see FAST LOOKUPS in the schema) instead of boolean masks on df for dimension filters.
+    For company-group totals, quarters, YTD, full year, vs LY and vs budget questions, read the precomputed cube (see AGGREGATE CUBE in the schema) instead of recomputing from df.
+    For monthly budget-vs-actual or USD-vs-local currency comparisons by company, use the wide fx view (see FX VIEW in the schema) instead of filtering Currency/Scenario and pivoting df.
+    If the question refers to the previous answer (e.g. "sort that", "and as a percentage?") and the prior query state lists a last result handle, start from the variable last_result (the previous result object) instead of recomputing it.
+    """
+
+def generate_pandas_code(model_client, model_name, schema_docs: str, user_question: str,
+                        company_list: list, date_range: str, business_units: list,
+                        temperature: float = 0.7, chat_history=None, retriever=None,
+                        prompt_stats: Dict[str, Any] = None) -> str:
     """
+    Generate pandas code using Gemini based on the user question and schema.
+
+    Parameters:
+    model_client: Configured Gemini model client
+    schema_docs (str): Schema documentation
+    user_question (str): User's question
+    company_list (list): List of available companies
+    date_range (str): Available date range
+    business_units (list): List of business units
+    retriever: Optional utils.prompt_retrieval.PromptRetriever; when given,
+        only the relevant schema sections, companies and accounts are sent
+        and earlier messages are truncated
+    prompt_stats (dict): Optional dict filled with estimated prompt tokens
+        (full_tokens, prompt_tokens, saved_tokens) and the token counts
+        reported by the model (input_tokens, output_tokens)
+
+    Returns:
+    str: Generated pandas code
+    """
+    prompt = build_code_prompt(schema_docs, user_question, company_list, date_range,
+                               business_units, chat_history)
+    if retriever is not None:
+        from utils.prompt_retrieval import estimate_tokens
+        selected = retriever.select(user_question, chat_history)
+        full_tokens = estimate_tokens(prompt)
+        prompt = build_code_prompt(selected['schema_docs'], user_question, selected['companies'],
+                                   date_range, selected['accounts'], selected['chat_history'])
+        prompt_tokens = estimate_tokens(prompt)
+        if prompt_stats is not None:
+            prompt_stats.update({
+                'full_tokens': full_tokens,
+                'prompt_tokens': prompt_tokens,
+                'saved_tokens': full_tokens - prompt_tokens,
+            })
 
     try:
         # Using the recommended approach from documentation
@@ -67,6 +88,9 @@ def generate_pandas_code(model_client, model_name, schema_docs: str, user_questi
             contents=prompt,
             config=types.GenerateContentConfig(temperature=temperature)
         )
+        if prompt_stats is not None:
+            from utils.tracing import usage_tokens
+            prompt_stats.update(usage_tokens(response))
         if response.text:
             # Extract code from markdown code block
             code = response.text
@@ -78,13 +102,120 @@ def generate_pandas_code(model_client, model_name, schema_docs: str, user_questi
     except Exception as e:
         return f"# Error generating code: {str(e)}"
 
-def validate_and_execute_code(code: str, df) -> Any:
+def build_batch_code_prompt(schema_docs: str, questions: list, company_list: list, date_range: str,
+                            business_units: list) -> str:
+    """Build one code-generation prompt for a numbered list of questions."""
+    numbered = "\n".join(f"Q{i}: {q}" for i, q in enumerate(questions, 1))
+    return f"""You are a financial data analyst. Given this schema and the user questions, generate pandas code for each question.
+
+    SCHEMA:
+    {schema_docs}
+
+    AVAILABLE DATA:
+    - Companies: {', '.join(company_list) if company_list else 'Not specified'}
+    - Date Range: {date_range}
+    - Business Units: {', '.join(business_units) if business_units else 'Not specified'}
+
+    USER QUESTIONS:
+    {numbered}
+
+    For EACH question return one separate code block between ```python and ```.
+    The first line of each block must be a comment with the question number, e.g. "# Q1".
+    Each block runs on its own, with a DataFrame named 'df' that contains the financial data.
+    Make sure to handle potential errors and edge cases.
+    Dont comment your code to explain the logic.
+    Always assign the main result of each block to a variable named result.
+    Use lookup(...) (see FAST LOOKUPS in the schema) instead of boolean masks on df for dimension filters.
+    For company-group totals, quarters, YTD, full year, vs LY and vs budget questions, read the precomputed cube (see AGGREGATE CUBE in the schema) instead of recomputing from df.
+    For monthly budget-vs-actual or USD-vs-local currency comparisons by company, use the wide fx view (see FX VIEW in the schema) instead of filtering Currency/Scenario and pivoting df.
+    """
+
+def split_batch_code(text: str, count: int) -> list:
+    """
+    Split a batched response into one code string per question.
+
+    Blocks are matched by their "# Qn" label; unlabeled blocks are used in
+    order when their number matches the question count. Missing answers are
+    returned as "# No code generated".
+    """
+    blocks = re.findall(r"```python\s*\n(.*?)```", text or "", re.DOTALL)
+    codes = [None] * count
+    unlabeled = []
+    for block in blocks:
+        label = re.match(r"\s*#\s*Q(\d+)\b[^\n]*\n?", block)
+        if label and 1 <= int(label.group(1)) <= count:
+            codes[int(label.group(1)) - 1] = block[label.end():].strip()
+        else:
+            unlabeled.append(block.strip())
+    if len(unlabeled) == count and not any(codes):
+        codes = unlabeled
+    return [code if code else "# No code generated" for code in codes]
+
+def generate_batch_pandas_code(model_client, model_name, schema_docs: str, questions: list,
+                               company_list: list, date_range: str, business_units: list,
+                               temperature: float = 0.7, retriever=None) -> list:
+    """
+    Generate pandas code for several questions with a single model call.
+
+    Parameters:
+    questions (list): Standalone questions (no chat history)
+    retriever: Optional utils.prompt_retrieval.PromptRetriever; the schema
+        sections and values are selected for all questions together
+
+    Returns:
+    list: One code string per question, in order
+    """
+    if retriever is not None:
+        selected = retriever.select("\n".join(questions))
+        schema_docs, company_list, business_units = (
+            selected['schema_docs'], selected['companies'], selected['accounts']
+        )
+    prompt = build_batch_code_prompt(schema_docs, questions, company_list, date_range, business_units)
+
+    try:
+        response = model_client.generate_content(
+            model=model_name,
+            contents=prompt,
+            config=types.GenerateContentConfig(temperature=temperature)
+        )
+        return split_batch_code(response.text, len(questions))
+    except Exception as e:
+        return [f"# Error generating code: {str(e)}"] * len(questions)
+
+def _warn_without_copy_on_write():
+    global _warned_copy_on_write
+    if not _warned_copy_on_write:
+        _warned_copy_on_write = True
+        warnings.warn(
+            "pandas copy-on-write is off: generated code shares df's data and in-place writes are not "
+            "isolated; call pd.set_option('mode.copy_on_write', True) before executing code",
+            RuntimeWarning, stacklevel=3,
+        )
+
+
+def validate_and_execute_code(code: str, df, helpers: Dict[str, Any] = None, compiled=None, optimize=True,
+                              optimization: Dict[str, Any] = None) -> Any:
     """
     Execute the generated pandas code without safety restrictions.
 
+    The code gets a shallow copy of ``df``. Callers must enable pandas
+    copy-on-write (``pd.set_option("mode.copy_on_write", True)``, as app.py,
+    api.py, the sandbox workers and the benchmark do) so that in-place
+    writes by the code never reach the shared frame; without it a warning
+    is issued once and such writes are not isolated.
+
     Parameters:
     code (str): Python code to execute
     df: DataFrame containing financial data
+    helpers (dict): Extra names exposed to the code, e.g. the prebuilt
+        ``lookup`` from utils.data_index, ``cube`` from utils.aggregates and
+        ``fx`` from utils.fx_view
+    compiled: Optional code object compiled from ``code`` (e.g. by
+        utils.code_cache) to execute instead of recompiling the source
+    optimize (bool): Rewrite known slow patterns first (see
+        utils.code_optimizer)
+    optimization (dict): If given, filled with the rewrites applied and the
+        estimated cost (row operations) before and after
 
     Returns:
     Any: Result of code execution
@@ -93,20 +224,59 @@ def validate_and_execute_code(code: str, df) -> Any:
         import pandas as pd
         import numpy as np
         import io
-        from contextlib import redirect_stdout
 
+        # Give the code its own frame object. Under pandas copy-on-write a
+        # shallow copy is free and only columns the code modifies get copied,
+        # so the shared (possibly read-only, memory-mapped) frame is never
+        # mutated. A deep copy per query would cost a full pass over the
+        # frame, so callers are expected to turn copy-on-write on instead.
+        if not pd.get_option('mode.copy_on_write'):
+            _warn_without_copy_on_write()
         local_namespace = {
-            'df': df,
+            'df': df.copy(deep=False),
             'pd': pd,
             'np': np,
         }
+        local_namespace.update(helpers or {})
+
+        if optimize:
+            from utils.code_optimizer import optimize_code
+            plan = optimize_code(
+                code, df.columns, pd.get_option('mode.copy_on_write'), use_lookup='lookup' in local_namespace
+            )
+            if plan['rewrites']:
+                code, compiled = plan['code'], plan['compiled']
+            if optimization is not None and plan['cost_before'] is not None:
+                optimization.update(
+                    rewrites=plan['rewrites'],
+                    cost_before=round(plan['cost_before'] * len(df)),
+                    cost_after=round(plan['cost_after'] * len(df)),
+                )
+
+        if 'lookup' not in local_namespace and re.search(r'\blookup\b', code):
+            from utils.data_index import build_dimension_index
+            local_namespace['lookup'] = build_dimension_index(df).lookup
+        if 'cube' not in local_namespace and re.search(r'\bcube\b', code):
+            from utils.aggregates import build_aggregate_cube
+            local_namespace['cube'] = build_aggregate_cube(df)
+        if 'fx' not in local_namespace and re.search(r'\bfx\b', code):
+            from utils.fx_view import build_fx_view
+            local_namespace['fx'] = build_fx_view(df)
 
         f = io.StringIO()
+
+        # Capture print() through the code's own globals rather than
+        # redirect_stdout, which swaps sys.stdout for every thread and
+        # breaks concurrent executions (Streamlit sessions, batches).
+        def captured_print(*args, **kwargs):
+            kwargs.setdefault('file', f)
+            print(*args, **kwargs)
+
         globals_with_pd = globals().copy()
         globals_with_pd['pd'] = pd
         globals_with_pd['np'] = np
-        with redirect_stdout(f):
-            exec(code, globals_with_pd, local_namespace)
+        globals_with_pd['print'] = captured_print
+        exec(compiled if compiled is not None else code, globals_with_pd, local_namespace)
 
         output = f.getvalue()
         if output:
@@ -1,28 +1,15 @@
-from google import genai
 from google.genai import types
-import os
+import hashlib
+import re
+import threading
+from collections import OrderedDict
 from typing import Any
 from datetime import datetime
 
-def configure_gemini():
-    """Configure the Gemini API with the API key."""
-    api_key = os.getenv('GOOGLE_API_KEY')
-    if not api_key:
-        raise ValueError("GOOGLE_API_KEY environment variable not set")
+from utils.chat_history import history_text
 
-    # Using the recommended approach from documentation
-    client = genai.Client(api_key=api_key)
-    return client.models
-
-def format_results_as_natural_language(
-    client,
-    model_name,
-    formatter_input,
-    prompt,
-    temperature,
-    chat_history=None
-):
-    """Format results with chat history context."""
+def _build_formatter_prompt(formatter_input, prompt, chat_history=None):
+    """Build the formatter prompt with chat history context."""
     # Get current date dynamically
     current_date = datetime.now()
 
@@ -34,12 +21,10 @@ def format_results_as_natural_language(
     """
 
     # Create context from chat history
-    context = ""
-    if chat_history:
-        context = "\n".join([f"{m['role']}: {m['content']}" for m in chat_history[-3:]])  # Last 3 messages
+    context = history_text(chat_history) if chat_history else ""  # Summary, state and last 3 messages
 
     # Add context to your existing prompt
-    enhanced_prompt = f"""
+    return f"""
     System: {system_prompt}
 
     Previous conversation:
@@ -54,6 +39,17 @@ def format_results_as_natural_language(
     from before {current_date.strftime('%B %Y')} is historical data, not forecasts.
     """
 
+def format_results_as_natural_language(
+    client,
+    model_name,
+    formatter_input,
+    prompt,
+    temperature,
+    chat_history=None
+):
+    """Format results with chat history context."""
+    enhanced_prompt = _build_formatter_prompt(formatter_input, prompt, chat_history)
+
     try:
         # Using the recommended approach from documentation
         response = client.generate_content(
@@ -68,61 +64,255 @@ def format_results_as_natural_language(
     except Exception as e:
         return f"Error generating natural language response: {str(e)}"
 
-def format_results_as_table(results: Any) -> str:
+def stream_results_as_natural_language(
+    client,
+    model_name,
+    formatter_input,
+    prompt,
+    temperature,
+    chat_history=None,
+    usage=None
+):
+    """
+    Stream the natural language response chunk by chunk.
+
+    Same prompt as format_results_as_natural_language, but yields text as the
+    model produces it so the UI can render it progressively. If a dict is
+    passed as usage, it is filled with the token counts the model reports.
+
+    Yields:
+    str: Successive chunks of the response
+    """
+    enhanced_prompt = _build_formatter_prompt(formatter_input, prompt, chat_history)
+
+    produced = False
+    try:
+        for chunk in client.generate_content_stream(
+            model=model_name,
+            contents=enhanced_prompt,
+            config=types.GenerateContentConfig(temperature=temperature)
+        ):
+            if usage is not None:
+                from utils.tracing import usage_tokens
+                usage.update(usage_tokens(chunk))
+            if chunk.text:
+                produced = True
+                yield chunk.text
+        if not produced:
+            yield "I couldn't generate a response based on the results."
+    except Exception as e:
+        yield f"Error generating natural language response: {str(e)}"
+
+def format_batch_results_as_natural_language(
+    client,
+    model_name,
+    items,
+    temperature,
+    max_result_chars=4000
+):
+    """
+    Write the answers for several questions with a single model call.
+
+    Parameters:
+    items (list): (question, formatter_input) pairs
+    max_result_chars (int): Each result is truncated to this many characters
+
+    Returns:
+    list: One answer per question, in order
+    """
+    current_date = datetime.now()
+    sections = []
+    for i, (question, formatter_input) in enumerate(items, 1):
+        text = str(formatter_input)
+        if len(text) > max_result_chars:
+            text = text[:max_result_chars] + "\n... (truncated)"
+        sections.append(f"### Question {i}: {question}\nResults:\n{text}")
+    results_block = "\n\n".join(sections)
+
+    batch_prompt = f"""
+    System: You are a financial analyst assistant. Today's date is {current_date.strftime('%B %d, %Y')}.
+    Any data from before this date should be treated as historical data, not forecasts.
+    Only treat data after {current_date.strftime('%B %Y')} as forecasts/budgets.
+    If no currency is specified, assume the default currency is Dolares (USD).
+
+    Answer each question below from its own results.
+
+    {results_block}
+
+    For each question write a heading "### Answer N" (N is the question number) followed by a
+    natural language response explaining its results.
+    """
+
+    try:
+        response = client.generate_content(
+            model=model_name,
+            contents=batch_prompt,
+            config=types.GenerateContentConfig(temperature=temperature)
+        )
+        text = response.text or ""
+    except Exception as e:
+        return [f"Error generating natural language response: {str(e)}"] * len(items)
+
+    answers = ["I couldn't generate a response based on the results."] * len(items)
+    parts = re.split(r"^\s*#{1,4}\s*Answer\s+(\d+)[^\n]*$", text, flags=re.MULTILINE)
+    for number, body in zip(parts[1::2], parts[2::2]):
+        if 1 <= int(number) <= len(items) and body.strip():
+            answers[int(number) - 1] = body.strip()
+    return answers
+
+DEFAULT_TABLE_ROWS = 200
+_TABLE_CACHE_SIZE = 64
+_table_cache = OrderedDict()
+_table_cache_lock = threading.Lock()
+
+
+def result_fingerprint(results: Any):
+    """
+    Content hash of a DataFrame or Series result, or None for other types.
+
+    Uses pandas' vectorized row hashing, so two executions that produce the
+    same table share one fingerprint.
+    """
+    import pandas as pd
+    if not isinstance(results, (pd.DataFrame, pd.Series)):
+        return None
+    try:
+        rows = pd.util.hash_pandas_object(results, index=True).to_numpy()
+    except TypeError:
+        # Unhashable cells (lists, dicts)
+        return None
+    digest = hashlib.sha1(rows.tobytes())
+    columns = results.columns if isinstance(results, pd.DataFrame) else [results.name]
+    digest.update(repr((type(results).__name__, [str(c) for c in columns])).encode())
+    return digest.hexdigest()
+
+
+def _format_numbers(values):
+    """Format a float array with thousands separators and 2 decimals; NaN becomes ""."""
+    import numpy as np
+    out = np.full(len(values), "", dtype=object)
+    present = ~np.isnan(values)
+    out[present] = list(map("{:,.2f}".format, values[present]))
+    return out
+
+
+def _format_cells(series, numeric):
+    import numpy as np
+    if numeric:
+        return _format_numbers(series.to_numpy(dtype=float, na_value=np.nan))
+    values = series.to_numpy(dtype=object)
+    if series.dtype == object:
+        # Mixed columns (dict results): format the numbers, keep the rest as text
+        return np.array([
+            "" if isinstance(v, float) and v != v
+            else f"{v:,.2f}" if isinstance(v, (int, float))
+            else str(v)
+            for v in values
+        ], dtype=object)
+    return series.astype(str).to_numpy(dtype=object)
+
+
+def _with_index(df):
+    """
+    Turn a named, multi-level or non-integer index (e.g. groupby keys) into
+    leading columns, as result_store does for row labels; a plain row
+    number index is dropped.
+    """
+    import pandas as pd
+    index = df.index
+    if index.name is None and index.nlevels == 1 and pd.api.types.is_integer_dtype(index):
+        return df
+    names = [
+        name if name is not None and name not in df.columns else f"level_{i}" if index.nlevels > 1 else 'index'
+        for i, name in enumerate(index.names)
+    ]
+    return df.rename_axis(names).reset_index()
+
+
+def _markdown_table(df, numeric_columns, max_rows=DEFAULT_TABLE_ROWS, page=0):
+    """
+    Render one page of a DataFrame as a markdown table.
+
+    Cells are formatted column by column and rows are joined with
+    column-wise string concatenation, so the cost grows with the page size,
+    not the result size.
+    """
+    import numpy as np
+    total = len(df)
+    if max_rows:
+        pages = max(1, -(-total // max_rows))
+        page = min(max(page, 0), pages - 1)
+        df = df.iloc[page * max_rows:(page + 1) * max_rows]
+    df = _with_index(df)
+    cells = []
+    for i, col in enumerate(df.columns):
+        column = _format_cells(df.iloc[:, i], col in numeric_columns)
+        cells.append(np.char.replace(column.astype(str), '|', '\\|').astype(object))
+    header = '| ' + ' | '.join(str(c) for c in df.columns) + ' |'
+    separator = '|' + '|'.join('---:' if c in numeric_columns else ':---' for c in df.columns) + '|'
+    lines = [header, separator]
+    if len(df) and cells:
+        rows = '| ' + cells[0]
+        for column in cells[1:]:
+            rows = rows + ' | ' + column
+        lines.extend((rows + ' |').tolist())
+    table = '\n'.join(lines)
+    if max_rows and total > len(df):
+        first = page * max_rows + 1
+        table += f"\n\n_Rows {first:,}-{first + len(df) - 1:,} of {total:,} (page {page + 1} of {pages})._"
+    return table
+
+
+def _format_results_as_table(results, max_rows, page):
+    import pandas as pd
+    if isinstance(results, pd.Series):
+        results = results.to_frame(name=results.name if results.name is not None else 'Value')
+    if isinstance(results, pd.DataFrame):
+        numeric_columns = set(results.select_dtypes(include=['float', 'int']).columns)
+        return _markdown_table(results, numeric_columns, max_rows, page)
+    if isinstance(results, dict):
+        if results and all(isinstance(v, dict) for v in results.values()):
+            # Nested dicts: one row per key, one column per subkey
+            table = pd.DataFrame.from_dict(results, orient='index')
+        else:
+            table = pd.DataFrame({'Value': pd.Series(list(results.values()), index=list(results), dtype=object)})
+        numeric_columns = set(table.select_dtypes(include=['float', 'int']).columns)
+        table.insert(0, 'Key', [str(k) for k in table.index])
+        return _markdown_table(table.reset_index(drop=True), numeric_columns, max_rows, page)
+    return str(results)
+
+
+def format_results_as_table(results: Any, max_rows: int = DEFAULT_TABLE_ROWS, page: int = 0) -> str:
     """
     Format the results as a markdown table when appropriate.
 
+    Large results are paginated: only `max_rows` rows (page `page`, counted
+    from 0) are formatted, followed by a note with the total row count.
+    Rendered tables are memoized on the result's content hash, so the same
+    result is not formatted twice.
+
     Parameters:
     results (Any): Results from pandas code execution
+    max_rows (int): Rows per page (None or 0 renders every row)
+    page (int): Page to render
 
     Returns:
     str: Markdown table representation of results
     """
     try:
-        import pandas as pd
-        # If results is a pandas DataFrame, format numbers and convert to markdown
-        if hasattr(results, 'to_markdown'):
-            df = results.copy()
-            # Format all float/int columns with thousands separator and 2 decimals
-            for col in df.select_dtypes(include=['float', 'int']).columns:
-                df[col] = df[col].apply(lambda x: f"{x:,.2f}" if pd.notnull(x) else "")
-            return df.to_markdown(index=False)
-        # If results is a dict, check if values are dicts (expand to columns)
-        elif isinstance(results, dict):
-            # If all values are dicts, treat as table with columns
-            if all(isinstance(v, dict) for v in results.values()):
-                # Collect all possible subkeys
-                all_subkeys = set()
-                for v in results.values():
-                    all_subkeys.update(v.keys())
-                all_subkeys = list(all_subkeys)
-                # Header
-                header = '| Key | ' + ' | '.join(all_subkeys) + ' |'
-                sep = '| --- ' * (len(all_subkeys)+1) + '|'
-                lines = [header, sep]
-                for key, subdict in results.items():
-                    row = [str(key)]
-                    for subkey in all_subkeys:
-                        value = subdict.get(subkey, "")
-                        if isinstance(value, (int, float)):
-                            value_str = f"{value:,.2f}"
-                        else:
-                            value_str = str(value)
-                        row.append(value_str)
-                    lines.append('| ' + ' | '.join(row) + ' |')
-                return '\n'.join(lines)
-            else:
-                # Fallback: simple key-value table
-                lines = ["| Key | Value |", "| --- | ----- |"]
-                for key, value in results.items():
-                    if isinstance(value, (int, float)):
-                        value_str = f"{value:,.2f}"
-                    else:
-                        value_str = str(value)
-                    lines.append(f"| {key} | {value_str} |")
-                return "\n".join(lines)
-        # For other types, just return string representation
-        else:
-            return str(results)
+        fingerprint = result_fingerprint(results)
+        key = (fingerprint, max_rows, page)
+        if fingerprint is not None:
+            with _table_cache_lock:
+                if key in _table_cache:
+                    _table_cache.move_to_end(key)
+                    return _table_cache[key]
+        table = _format_results_as_table(results, max_rows, page)
+        if fingerprint is not None:
+            with _table_cache_lock:
+                _table_cache[key] = table
+                while len(_table_cache) > _TABLE_CACHE_SIZE:
+                    _table_cache.popitem(last=False)
+        return table
     except Exception as e:
-        return f"Error formatting results as table: {str(e)}"
\ No newline at end of file
+        return f"Error formatting results as table: {str(e)}"
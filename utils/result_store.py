@@ -0,0 +1,190 @@
+"""
+Server-side storage of execution results.
+
+Results stay in memory under a short handle; the formatter prompt receives
+a size-bounded digest of the result (shape, first rows, totals, extremes
+and first-to-last changes) instead of the whole thing as text, and
+follow-up questions can read a previous result back by its handle.
+"""
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+DEFAULT_DIGEST_CHARS = 4000
+
+
+def _fmt(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return "n/a" if value != value else f"{value:,.2f}"
+    return str(value)
+
+
+def _label_columns(df):
+    """Dimension columns (text columns and Year) whose values differ between rows."""
+    candidates = [c for c in df.columns if c == 'Year' or not pd.api.types.is_numeric_dtype(df[c])]
+    return [c for c in candidates if df[c].nunique(dropna=False) > 1][:4]
+
+
+def _row_labels(df):
+    """
+    Readable label per row: a named or non-integer index (e.g. a groupby
+    key), else the dimension columns that vary, else the row number.
+    """
+    index = df.index
+    if index.name is not None or index.nlevels > 1 or not pd.api.types.is_integer_dtype(index):
+        return [str(label) for label in index]
+    columns = _label_columns(df)
+    if not columns:
+        return [f"row {i}" for i in range(len(df))]
+    return df[columns].astype(str).agg(" / ".join, axis=1).tolist()
+
+
+def _frame_digest(df, max_rows):
+    rows, columns = df.shape
+    lines = [f"DataFrame: {rows:,} rows x {columns} columns"]
+    show_index = df.index.name is not None or df.index.nlevels > 1 or not pd.api.types.is_integer_dtype(df.index)
+    shown = df if rows <= max_rows else df.head(max_rows)
+    if rows > max_rows:
+        lines.append(f"First {max_rows} rows:")
+    lines.append(shown.to_string(index=show_index, max_colwidth=40, float_format=_fmt))
+
+    numeric = [
+        c for c in df.columns
+        if c != 'Year' and pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])
+    ][:8]
+    if rows > 1 and numeric:
+        labels = _row_labels(df)
+        lines.append("Column summary:")
+        for column in numeric:
+            values = df[column].to_numpy(dtype=float, na_value=float('nan'))
+            present = values == values
+            if not present.any():
+                continue
+            low, high = values[present].argmin(), values[present].argmax()
+            positions = present.nonzero()[0]
+            first, last = values[positions[0]], values[positions[-1]]
+            change = last - first
+            pct = f", {change / abs(first):+.1%}" if first else ""
+            lines.append(
+                f"- {column}: total {_fmt(values[present].sum())}, mean {_fmt(values[present].mean())}, "
+                f"min {_fmt(values[positions[low]])} ({labels[positions[low]]}), "
+                f"max {_fmt(values[positions[high]])} ({labels[positions[high]]}), "
+                f"first to last {_fmt(first)} -> {_fmt(last)} ({_fmt(change)}{pct})"
+            )
+    return "\n".join(lines)
+
+
+def result_digest(result, max_rows=10, max_chars=DEFAULT_DIGEST_CHARS):
+    """
+    Summarize an execution result for the formatter prompt.
+
+    DataFrames and Series are described by their shape, their first
+    `max_rows` rows (all rows if there are fewer) and, per numeric column,
+    the total, mean, min and max (with the row they occur in) and the change
+    from the first to the last row. Other results are converted to text.
+    The digest is cut to at most `max_chars` characters.
+
+    Returns:
+    str: The digest
+    """
+    if isinstance(result, pd.Series):
+        result = result.to_frame(name=result.name if result.name is not None else 'value')
+    if isinstance(result, pd.DataFrame):
+        text = _frame_digest(result, max_rows)
+    else:
+        text = str(result)
+    if len(text) > max_chars:
+        text = text[:max_chars] + "\n... (truncated)"
+    return text
+
+
+def formatter_input(execution_result, handle=None, max_chars=DEFAULT_DIGEST_CHARS):
+    """
+    Build the formatter's view of an execution result.
+
+    Printed output and the result digest are each bounded, so the prompt
+    size no longer grows with the result.
+    """
+    if not isinstance(execution_result, dict):
+        return execution_result
+    output = str(execution_result.get('output', ''))
+    if len(output) > max_chars // 2:
+        output = output[:max_chars // 2] + "\n... (truncated)"
+    header = f"Result (handle {handle}):" if handle else "Result:"
+    return f"Output:\n{output}\n\n{header}\n{result_digest(execution_result.get('result', ''), max_chars=max_chars)}"
+
+
+def _result_bytes(result):
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(index=True).sum())
+    if isinstance(result, pd.Series):
+        return int(result.memory_usage(index=True))
+    return sys.getsizeof(result)
+
+
+class ResultStore:
+    """
+    In-memory LRU of execution results keyed by handle.
+
+    Bounded by entry count and by the (shallow) memory of the stored
+    results. Handles are random, so they can be shown to the model and to
+    users without exposing anything about the data.
+    """
+
+    def __init__(self, max_entries=64, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, result, question=None, code=None, data_version=None):
+        """Store a result and return its handle."""
+        handle = f"res_{uuid.uuid4().hex[:10]}"
+        size = _result_bytes(result)
+        entry = {
+            'result': result,
+            'question': question,
+            'code': code,
+            'data_version': data_version,
+            'created_at': time.time(),
+            'bytes': size,
+        }
+        with self._lock:
+            self._entries[handle] = entry
+            self._bytes += size
+            # The newest entry is always kept, even if it alone exceeds max_bytes
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted['bytes']
+        return handle
+
+    def entry(self, handle):
+        """Return the stored entry (result, question, code, ...) or None."""
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is not None:
+                self._entries.move_to_end(handle)
+            return entry
+
+    def get(self, handle, default=None):
+        entry = self.entry(handle) if handle else None
+        return entry['result'] if entry is not None else default
+
+    def __getitem__(self, handle):
+        entry = self.entry(handle)
+        if entry is None:
+            raise KeyError(f"Unknown or expired result handle: {handle}")
+        return entry['result']
+
+    def __contains__(self, handle):
+        with self._lock:
+            return handle in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,278 @@
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+
+from utils.data_loader import DEFAULT_DATA_FILE
+
+# Workers are started with ``python -m utils.sandbox`` from the repository
+# root rather than multiprocessing's spawn, which would re-run the Streamlit
+# script (registered as __main__) in every child.
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_HANDLE = re.compile(r"\bres_[0-9a-f]{10}\b")
+
+
+def _rss_bytes(pid):
+    """Return the resident set size of a process, or None if unavailable."""
+    try:
+        with open(f"/proc/{pid}/statm", 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _picklable(execution_result):
+    """Make sure an execution result can be sent back to the parent."""
+    import pickle
+    try:
+        pickle.dumps(execution_result)
+        return execution_result
+    except Exception:
+        if isinstance(execution_result, dict):
+            return {key: _picklable(value) for key, value in execution_result.items()}
+        return str(execution_result)
+
+
+def _request_helpers(code, helpers):
+    """
+    Per-request helpers to send to a worker along with the code.
+
+    The worker builds lookup, cube and fx itself; only last_result and the
+    results the code refers to by handle (as a plain dict) are sent.
+    """
+    helpers = helpers or {}
+    extras = {}
+    if 'last_result' in helpers:
+        extras['last_result'] = helpers['last_result']
+    store = helpers.get('results')
+    if store is not None:
+        extras['results'] = {
+            handle: store.get(handle) for handle in set(_HANDLE.findall(code)) if handle in store
+        }
+    return extras
+
+
+def _worker_main(reader, writer, file_path):
+    """
+    Worker process: load the data once, then execute code sent by the parent.
+
+    The frame, dimension index, aggregate cube and FX view are built at startup so
+    requests only pay for executing the code itself.
+    """
+    import pandas as pd
+    from utils.data_loader import load_financial_data
+    from utils.data_index import build_dimension_index
+    from utils.aggregates import build_aggregate_cube
+    from utils.fx_view import build_fx_view
+    from utils.query_generator import validate_and_execute_code
+
+    # Every worker maps the same cache file, so the frame's pages are shared
+    # across the pool instead of duplicated per process.
+    pd.set_option('mode.copy_on_write', True)
+    df = load_financial_data(file_path, memory_map=True)
+    helpers = {
+        'lookup': build_dimension_index(df).lookup,
+        'cube': build_aggregate_cube(df),
+        'fx': build_fx_view(df),
+    }
+    writer.send('ready')
+
+    while True:
+        try:
+            request = reader.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        code, extras = request
+        writer.send(_picklable(validate_and_execute_code(code, df, {**helpers, **extras})))
+
+
+class _Worker:
+    """One worker process, talking pickled messages over its stdin/stdout."""
+
+    def __init__(self, file_path):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'utils.sandbox', os.path.abspath(file_path)],
+            cwd=_REPO_ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+        self.writer = Connection(os.dup(self.process.stdin.fileno()), readable=False)
+        self.reader = Connection(os.dup(self.process.stdout.fileno()), writable=False)
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+    def wait_ready(self, timeout):
+        try:
+            if self.reader.poll(timeout):
+                return self.reader.recv() == 'ready'
+        except (EOFError, OSError):
+            pass
+        return False
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait(1)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        finally:
+            self.writer.close()
+            self.reader.close()
+
+
+class SandboxExecutor:
+    """
+    Pool of pre-warmed worker processes that run generated code.
+
+    Each worker memory-maps the financial frame once (from the shared
+    on-disk cache) and keeps it for its lifetime, so only the code and the
+    result cross the process boundary. A worker that exceeds the wall-clock timeout
+    or the RSS limit is killed and replaced, and the caller gets an error
+    string in the same format as validate_and_execute_code. Concurrent
+    requests run in parallel on different workers.
+    """
+
+    def __init__(self, file_path=DEFAULT_DATA_FILE, workers=None, timeout=30.0,
+                 memory_limit_mb=2048, startup_timeout=120.0):
+        self.file_path = file_path
+        self.timeout = timeout
+        self.memory_limit = memory_limit_mb * 1024 * 1024
+        self.startup_timeout = startup_timeout
+        self._idle = queue.Queue()
+        self._closed = False
+        # Every live worker, idle or busy, so close() can account for all of them
+        self._workers = set()
+        self._lock = threading.Lock()
+        size = workers or max(1, (os.cpu_count() or 2) - 1)
+        pending = [_Worker(file_path) for _ in range(size)]
+        for worker in pending:
+            self._admit(worker)
+
+    def _admit(self, worker):
+        ready = worker.wait_ready(self.startup_timeout)
+        with self._lock:
+            if ready and not self._closed:
+                self._workers.add(worker)
+                self._idle.put(worker)
+                return
+        worker.kill()
+
+    def _release(self, worker):
+        """Return a worker to the pool, or stop it if the pool was closed meanwhile."""
+        with self._lock:
+            if not self._closed:
+                self._idle.put(worker)
+                return
+            self._workers.discard(worker)
+        self._stop(worker)
+
+    def _discard(self, worker):
+        with self._lock:
+            self._workers.discard(worker)
+        worker.kill()
+        self._respawn()
+
+    @staticmethod
+    def _stop(worker):
+        try:
+            worker.writer.send(None)
+        except (OSError, ValueError):
+            pass
+        worker.kill()
+
+    def _respawn(self):
+        """Start a replacement worker without blocking the caller."""
+        if self._closed:
+            return
+        threading.Thread(
+            target=lambda: self._admit(_Worker(self.file_path)), daemon=True
+        ).start()
+
+    def execute(self, code, helpers=None):
+        """
+        Execute generated code on an idle worker.
+
+        Parameters:
+        code (str): Python code to execute
+        helpers (dict): Helpers of the request; ``last_result`` and the
+            ``results`` the code refers to by handle are sent to the worker
+            (lookup, cube and fx are built by the worker itself)
+
+        Returns:
+        Any: {'output', 'result'} on success, or an error string
+        """
+        try:
+            worker = self._idle.get(timeout=self.startup_timeout)
+        except queue.Empty:
+            return "Error executing code: no sandbox worker available"
+        extras = _request_helpers(code, helpers)
+        try:
+            worker.writer.send((code, extras))
+        except (OSError, ValueError):
+            self._discard(worker)
+            return "Error executing code: sandbox worker unavailable"
+        except Exception:
+            # A helper that cannot be pickled (nothing was written yet)
+            self._release(worker)
+            return "Error executing code: previous results cannot be sent to the sandbox"
+
+        started = time.monotonic()
+        while True:
+            try:
+                if worker.reader.poll(0.05):
+                    result = worker.reader.recv()
+                    self._release(worker)
+                    return result
+            except (EOFError, OSError):
+                self._discard(worker)
+                return "Error executing code: sandbox worker crashed"
+
+            if time.monotonic() - started > self.timeout:
+                reason = f"timed out after {self.timeout:g}s"
+            else:
+                rss = _rss_bytes(worker.process.pid)
+                if rss is None or rss <= self.memory_limit:
+                    continue
+                reason = f"exceeded memory limit ({rss // (1024 * 1024)} MB)"
+            self._discard(worker)
+            return f"Error executing code: query {reason} and was stopped"
+
+    def close(self):
+        """
+        Stop the pool.
+
+        Idle workers are stopped now; a worker that is running a request
+        finishes it and is stopped instead of being returned to the pool.
+
+        Returns:
+        int: Number of busy workers that will stop after their request
+        """
+        with self._lock:
+            self._closed = True
+            idle = []
+            while True:
+                try:
+                    idle.append(self._idle.get_nowait())
+                except queue.Empty:
+                    break
+            self._workers.difference_update(idle)
+            busy = len(self._workers)
+        for worker in idle:
+            self._stop(worker)
+        return busy
+
+
+if __name__ == "__main__":
+    # Keep the protocol on private descriptors and send stray writes to fd 1
+    # (e.g. from C extensions) to stderr instead.
+    reader = Connection(os.dup(0), writable=False)
+    writer = Connection(os.dup(1), readable=False)
+    os.dup2(2, 1)
+    _worker_main(reader, writer, sys.argv[1])
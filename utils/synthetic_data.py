@@ -0,0 +1,230 @@
+"""
+Synthetic P&L workbooks with the same layout as data/P&L_ChatBot.xlsx.
+
+Four sheets (USD_REAL, USD_PPTO, MONEDALOCAL_REAL, MONEDALOCAL_PPTO) of 19
+columns: Year, Country, Currency, CompanyName, Scenario, Account, twelve
+months and the full-year total. At scale 1 there are about as many
+companies as in the real workbook; scale N adds N times as many. Accounts
+follow the P&L arithmetic (Margen Bruto = Ingresos + Costos, ...) and budget
+and local-currency sheets are derived from the actuals, so generated
+questions have meaningful answers.
+
+Usage:
+    python -m utils.synthetic_data --scale 10
+    python -m utils.synthetic_data --scale 200 --years 2020 2025 --format parquet
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import MONTHS, SHEET_NAMES, WORKBOOK_COLUMNS
+
+# Local currency units per USD
+FX_RATES = {
+    'Chile': 900.0, 'Peru': 3.7, 'Colombia': 4000.0, 'Argentina': 350.0,
+    'Brasil': 5.0, 'Mexico': 18.0, 'Uruguay': 40.0,
+}
+
+# Row order of the accounts within a company/year block
+ACCOUNTS = [
+    'Ingresos de Explotacion', 'Costos de Explotacion', 'Margen Bruto', 'Riesgo',
+    'Margen de Explotacion', 'gavPrimo', 'Fee CMR', 'Margen Operacional',
+    'Resultado No Operacional', 'Ajustes Holding', 'Resultado antes de Impto Rta.',
+    'Impuestos', 'Resultado',
+]
+
+# Named companies used by the schema's company groups and examples
+NAMED_COMPANIES = [
+    ('Total Retail Chile', 'Chile'), ('Total Retail Peru', 'Peru'),
+    ('Total Retail Argentina', 'Argentina'), ('Retail Colombia', 'Colombia'),
+    ('Total Sodimac Chile', 'Chile'), ('Total Sodimac Peru', 'Peru'),
+    ('Total Sodimac Brasil', 'Brasil'), ('Total Sodimac Mexico', 'Mexico'),
+    ('Total Sodimac Uruguay', 'Uruguay'), ('Sodimac Argentina', 'Argentina'),
+    ('Sodimac Colombia', 'Colombia'), ('Total Tottus Chile', 'Chile'),
+    ('Total Tottus Peru', 'Peru'), ('Total Chile', 'Chile'), ('Total Peru', 'Peru'),
+    ('Total Colombia', 'Colombia'), ('Total Argentina', 'Argentina'),
+    ('Total Brasil', 'Brasil'), ('Total Mexico', 'Mexico'), ('Total Uruguay', 'Uruguay'),
+]
+
+BASE_COMPANY_COUNT = 102
+XLSX_MAX_ROWS = 1048576
+_TITLE_ROWS = 3
+
+
+def company_list(scale=1):
+    """Return [(company, country)] for a scale: the named companies plus synthetic ones."""
+    total = max(len(NAMED_COMPANIES), int(round(BASE_COMPANY_COUNT * scale)))
+    countries = list(FX_RATES)
+    synthetic = [
+        (f"Entity {i:05d} {countries[i % len(countries)]}", countries[i % len(countries)])
+        for i in range(total - len(NAMED_COMPANIES))
+    ]
+    return NAMED_COMPANIES + synthetic
+
+
+def _actuals(n_companies, n_years, rng):
+    """
+    Monthly USD actuals with shape (companies, years, accounts, months).
+
+    Revenue has a per-company size, yearly growth and seasonality; the other
+    accounts are ratios of it or sums of the accounts above them.
+    """
+    size = rng.lognormal(mean=16.0, sigma=1.5, size=(n_companies, 1, 1))
+    growth = (1 + rng.normal(0.05, 0.08, size=(n_companies, 1, 1))) ** np.arange(n_years).reshape(1, -1, 1)
+    season = 1 + 0.15 * np.sin(np.linspace(0, 2 * np.pi, 12, endpoint=False)).reshape(1, 1, -1)
+    noise = rng.normal(1.0, 0.05, size=(n_companies, n_years, 12))
+    revenue = size * growth * season * noise
+
+    def ratio(low, high):
+        return rng.uniform(low, high, size=(n_companies, 1, 1))
+
+    values = {'Ingresos de Explotacion': revenue}
+    values['Costos de Explotacion'] = -revenue * ratio(0.55, 0.75)
+    values['Margen Bruto'] = values['Ingresos de Explotacion'] + values['Costos de Explotacion']
+    values['Riesgo'] = -revenue * ratio(0.0, 0.02)
+    values['Margen de Explotacion'] = values['Margen Bruto'] + values['Riesgo']
+    values['gavPrimo'] = -revenue * ratio(0.12, 0.22)
+    values['Fee CMR'] = revenue * ratio(0.0, 0.01)
+    values['Margen Operacional'] = values['Margen de Explotacion'] + values['gavPrimo'] + values['Fee CMR']
+    values['Resultado No Operacional'] = revenue * rng.normal(0.0, 0.02, size=(n_companies, n_years, 12))
+    values['Ajustes Holding'] = np.zeros_like(revenue)
+    values['Resultado antes de Impto Rta.'] = (
+        values['Margen Operacional'] + values['Resultado No Operacional'] + values['Ajustes Holding']
+    )
+    values['Impuestos'] = -np.maximum(values['Resultado antes de Impto Rta.'], 0) * 0.27
+    values['Resultado'] = values['Resultado antes de Impto Rta.'] + values['Impuestos']
+    return np.stack([values[account] for account in ACCOUNTS], axis=2)
+
+
+def generate_sheets(scale=1, years=(2022, 2025), seed=0):
+    """
+    Build the four wide sheets in memory.
+
+    Parameters:
+    scale (float): Company count multiplier (1 = about the real workbook)
+    years (tuple): First and last year, inclusive
+    seed (int): Random seed; the same arguments give the same data
+
+    Returns:
+    dict: {sheet name: DataFrame with WORKBOOK_COLUMNS}
+    """
+    rng = np.random.default_rng(seed)
+    companies = company_list(scale)
+    year_values = list(range(years[0], years[1] + 1))
+    n_companies, n_years, n_accounts = len(companies), len(year_values), len(ACCOUNTS)
+
+    real_usd = _actuals(n_companies, n_years, rng)
+    budget_usd = real_usd * rng.uniform(0.95, 1.08, size=(n_companies, n_years, 1, 1))
+    fx = np.array([FX_RATES[country] for _, country in companies]).reshape(-1, 1, 1, 1)
+    fx_drift = 1 + rng.normal(0, 0.01, size=(1, n_years, 1, 12)).cumsum(axis=3)
+
+    shape = (n_companies, n_years, n_accounts)
+    ids = {
+        'Year': np.broadcast_to(np.array([str(y) for y in year_values], dtype=object).reshape(1, -1, 1), shape),
+        'Country': np.broadcast_to(np.array([c for _, c in companies], dtype=object).reshape(-1, 1, 1), shape),
+        'CompanyName': np.broadcast_to(np.array([c for c, _ in companies], dtype=object).reshape(-1, 1, 1), shape),
+        'Account': np.broadcast_to(np.array(ACCOUNTS, dtype=object).reshape(1, 1, -1), shape),
+    }
+    # Company-major, then year, then account, like the real workbook
+    rows = n_companies * n_years * n_accounts
+
+    sheets = {}
+    for sheet_name, usd, currency, scenario in [
+        ('USD_REAL', real_usd, 'Dolares', 'Real'),
+        ('USD_PPTO', budget_usd, 'Dolares', 'Presupuesto'),
+        ('MONEDALOCAL_REAL', real_usd * fx * fx_drift, 'Moneda Local', 'Real'),
+        ('MONEDALOCAL_PPTO', budget_usd * fx, 'Moneda Local', 'Presupuesto'),
+    ]:
+        monthly = usd.reshape(rows, 12)
+        frame = pd.DataFrame({
+            'Year': ids['Year'].reshape(rows),
+            'Country': ids['Country'].reshape(rows),
+            'Currency': currency,
+            'CompanyName': ids['CompanyName'].reshape(rows),
+            'Scenario': scenario,
+            'Account': ids['Account'].reshape(rows),
+            **{month: monthly[:, i] for i, month in enumerate(MONTHS)},
+            'FullYear': monthly.sum(axis=1),
+        })
+        sheets[sheet_name] = frame[WORKBOOK_COLUMNS]
+    return sheets
+
+
+def write_xlsx(sheets, path):
+    """
+    Write the sheets as a workbook with the real file's layout.
+
+    Rows 1-2 hold the titles and month labels and row 3 the column labels,
+    so the loader (which takes row 3 as its header) reads every data row.
+    Rows are streamed with openpyxl's write-only mode.
+    """
+    from openpyxl import Workbook
+
+    longest = max(len(frame) for frame in sheets.values())
+    if longest + _TITLE_ROWS > XLSX_MAX_ROWS:
+        raise ValueError(
+            f"{longest:,} rows per sheet exceed the xlsx limit of {XLSX_MAX_ROWS:,}; write Parquet instead"
+        )
+    workbook = Workbook(write_only=True)
+    month_labels = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
+    for sheet_name in SHEET_NAMES:
+        sheet = workbook.create_sheet(sheet_name)
+        sheet.append([None] * 7 + ['Oficial', 'Centros de Costos'])
+        sheet.append([None] * 6 + month_labels + ['Total Año'])
+        sheet.append(WORKBOOK_COLUMNS)
+        for row in sheets[sheet_name].itertuples(index=False, name=None):
+            sheet.append(row)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    workbook.save(path)
+
+
+def write_parquet(sheets, directory):
+    """Write one <sheet>.parquet file per sheet (19 columns each) into a directory."""
+    os.makedirs(directory, exist_ok=True)
+    for sheet_name, frame in sheets.items():
+        frame.to_parquet(os.path.join(directory, f"{sheet_name}.parquet"), index=False, row_group_size=100000)
+
+
+def generate_financial_data(output_dir='data/synthetic', scale=1, years=(2022, 2025), seed=0,
+                            formats=('xlsx', 'parquet')):
+    """
+    Generate a synthetic dataset in the requested formats.
+
+    Returns:
+    dict: {format: path}; the xlsx path and the Parquet directory can both
+    be passed to load_financial_data
+    """
+    sheets = generate_sheets(scale, years, seed)
+    stem = f"P&L_x{scale:g}"
+    paths = {}
+    if 'xlsx' in formats:
+        paths['xlsx'] = os.path.join(output_dir, f"{stem}.xlsx")
+        write_xlsx(sheets, paths['xlsx'])
+    if 'parquet' in formats:
+        paths['parquet'] = os.path.join(output_dir, stem)
+        write_parquet(sheets, paths['parquet'])
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic P&L dataset")
+    parser.add_argument('--scale', type=float, default=1, help="Company count multiplier")
+    parser.add_argument('--years', type=int, nargs=2, default=[2022, 2025], metavar=('FIRST', 'LAST'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', default='data/synthetic')
+    parser.add_argument('--format', nargs='+', choices=['xlsx', 'parquet'], default=['xlsx', 'parquet'])
+    args = parser.parse_args(argv)
+
+    paths = generate_financial_data(args.output_dir, args.scale, tuple(args.years), args.seed, args.format)
+    rows = len(company_list(args.scale)) * (args.years[1] - args.years[0] + 1) * len(ACCOUNTS)
+    print(f"{rows:,} rows per sheet, {rows * 4 * 12:,} melted rows")
+    for fmt, path in paths.items():
+        print(f"{fmt}: {path}")
+
+
+if __name__ == "__main__":
+    main()
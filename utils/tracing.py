@@ -0,0 +1,150 @@
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_TRACE_PATH = 'data/.cache/traces.jsonl'
+
+
+def usage_tokens(response):
+    """
+    Read prompt/response token counts from a Gemini response or chunk.
+
+    Returns:
+    dict: input_tokens and output_tokens, or {} if the response has no usage
+    """
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return {}
+    return {
+        'input_tokens': getattr(usage, 'prompt_token_count', None) or 0,
+        'output_tokens': getattr(usage, 'candidates_token_count', None) or 0,
+    }
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Trace:
+    """
+    Timings and attributes of one request.
+
+    Stages are timed with ``with trace.stage(name)`` (repeated stages add
+    up); attributes such as token counts, result sizes and the answer
+    source are set with ``trace.set(...)``. ``finish()`` writes the trace to
+    the sink, if any.
+    """
+
+    def __init__(self, prompt, sink=None):
+        self.id = uuid.uuid4().hex
+        self.prompt = prompt
+        self.sink = sink
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.stages = {}
+        self.attributes = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+
+    def record(self, name, elapsed_ms):
+        self.stages[name] = self.stages.get(name, 0.0) + elapsed_ms
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, name, value):
+        self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'timestamp': self.started_at,
+            'prompt': self.prompt,
+            'total_ms': round((time.perf_counter() - self._started) * 1000, 3),
+            'stages': {name: round(ms, 3) for name, ms in self.stages.items()},
+            **self.attributes,
+        }
+
+    def finish(self, **attributes):
+        self.set(**attributes)
+        record = self.to_dict()
+        if self.sink is not None:
+            self.sink.write(record)
+        return record
+
+
+class TraceSink:
+    """
+    Append-only JSONL file of request traces.
+
+    One JSON object per line, so several app workers can append to the same
+    file. The file is rotated to ``<path>.1`` once it grows past max_bytes.
+    """
+
+    def __init__(self, path=DEFAULT_TRACE_PATH, max_bytes=5 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            try:
+                if os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+            except OSError:
+                pass
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def recent(self, limit=500):
+        """Return the last `limit` traces, oldest first."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = deque(f, maxlen=limit)
+        except OSError:
+            return []
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+    def stage_percentiles(self, limit=500):
+        """
+        Summarize recent traces per stage.
+
+        Returns:
+        dict: {stage: {'count', 'p50', 'p95'}} in milliseconds, including a
+        'total' entry for whole requests
+        """
+        timings = {}
+        for record in self.recent(limit):
+            timings.setdefault('total', []).append(record.get('total_ms', 0.0))
+            for name, ms in record.get('stages', {}).items():
+                timings.setdefault(name, []).append(ms)
+        return {
+            name: {'count': len(values), 'p50': percentile(values, 50), 'p95': percentile(values, 95)}
+            for name, values in timings.items()
+        }
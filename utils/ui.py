@@ -31,8 +31,73 @@ def render_sidebar(unique_values, schema_docs, example_queries):
             st.session_state.example_prompt = query
             st.rerun()
 
-def render_chat(messages):
+# Messages rendered as chat bubbles; older ones are folded into one block
+RECENT_MESSAGES = 20
+
+def chat_export_text(history):
+    """Plain-text export of a ChatHistoryStore session, read again only after new messages."""
+    key = (history.session_id, history.count)
+    cached = st.session_state.get("_chat_export")
+    if cached is None or cached[0] != key:
+        cached = (key, history.export_text())
+        st.session_state["_chat_export"] = cached
+    return cached[1]
+
+def render_chat(messages, recent=RECENT_MESSAGES):
+    """Render the retained messages (bounded by the history store)."""
     st.subheader("💬 Chat")
-    for message in messages:
+    archived = max(0, len(messages) - recent)
+    if archived:
+        with st.expander(f"Earlier messages ({archived})"):
+            st.markdown("\n\n---\n\n".join(
+                f"**{m['role'].capitalize()}:** {m['content']}" for m in messages[:archived]
+            ))
+    for message in messages[archived:]:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
+
+def render_cache_stats(stats, template_stats=None):
+    st.subheader("⚡ Answer Cache")
+    st.write(f"**Hits / Misses (this worker):** {stats['hits']} / {stats['misses']} ({stats['hit_rate']:.0%} hit rate)")
+    st.write(f"**Hits / Misses (all workers):** {stats['total_hits']} / {stats['total_misses']}")
+    st.write(f"**Cached Answers:** {stats['entries']}")
+    if template_stats is not None:
+        st.write(f"**Code Template Hits / Misses:** {template_stats['hits']} / {template_stats['misses']} ({template_stats['templates']} templates)")
+
+def render_batch_input():
+    """Sidebar form for a question pack; returns the questions when submitted."""
+    st.subheader("📦 Batch Questions")
+    with st.form("batch_form", clear_on_submit=False):
+        text = st.text_area("One question per line", height=150)
+        submitted = st.form_submit_button("Answer All")
+    if submitted:
+        return [line for line in text.splitlines() if line.strip()]
+    return None
+
+def render_batch_results(items):
+    st.subheader(f"📦 Batch Answers ({len(items)})")
+    sources = {'fast_path': "⚡ fast path", 'cache': "⚡ cache", 'template': "⚡ template", 'model': "model"}
+    for i, item in enumerate(items, 1):
+        with st.expander(f"{i}. {item['question']}", expanded=False):
+            st.markdown(item['answer'] or "")
+            st.caption(f"Source: {sources.get(item['source'], item['source'])}")
+            if item['code']:
+                st.code(item['code'], language="python")
+    report = "\n\n".join(f"## {i}. {item['question']}\n\n{item['answer']}" for i, item in enumerate(items, 1))
+    st.download_button(
+        label="Export Batch Answers",
+        data=report,
+        file_name="financial_batch_answers.md",
+        mime="text/markdown"
+    )
+
+def render_latency_stats(percentiles):
+    st.subheader("⏱️ Latency")
+    if not percentiles:
+        st.write("No traces recorded yet.")
+        return
+    rows = [
+        {"Stage": name, "Requests": p["count"], "p50 (ms)": round(p["p50"], 1), "p95 (ms)": round(p["p95"], 1)}
+        for name, p in sorted(percentiles.items(), key=lambda item: -item[1]["p50"])
+    ]
+    st.dataframe(rows, hide_index=True, use_container_width=True)